@@ -1,4 +1,5 @@
 import textwrap
+import shutil
 import time as pytime
 import scipy.stats
 import scipy.signal
@@ -9,8 +10,8 @@ from sklearn.metrics import accuracy_score, f1_score
 from .kwargs import MODEL_INITIALIZATION_KWARGS, MODEL_BAYES_INITIALIZATION_KWARGS
 from .formula import *
 from .util import *
-from .data import build_CDR_impulse_data, build_CDR_response_data, corr, corr_cdr, get_first_last_obs_lists, \
-                  split_cdr_outputs
+from .data import build_CDR_response_data, get_impulse_windows, trim_compact_windows, get_time_offsets, \
+                  apply_time_offsets, corr_cdr, get_first_last_obs_lists, split_cdr_outputs
 from .opt import *
 from .plot import *
 
@@ -263,7 +264,7 @@ class Model(object):
             else:
                 for i, df in enumerate(X + Y):
                     if name in df and not name.lower() == 'rate':
-                        column = df[name].values
+                        column = np.asarray(df[name])
                         impulse_means[name] = column.mean()
                         impulse_sds[name] = column.std()
                         quantiles = np.quantile(column, q)
@@ -409,6 +410,11 @@ class Model(object):
 
         self.FLOAT_TF = getattr(tf, self.float_type)
         self.FLOAT_NP = getattr(np, self.float_type)
+        self.STORAGE_FLOAT_TF = getattr(tf, self.storage_float_type or self.float_type)
+        self.STORAGE_FLOAT_NP = getattr(np, self.storage_float_type or self.float_type)
+        self.store_time_offsets = self.storage_float_type is not None and np.dtype(self.FLOAT_NP).itemsize > 4
+        self.train_step_callables = {}
+        self.checkpoint_writer = None
         self.INT_TF = getattr(tf, self.int_type)
         self.INT_NP = getattr(np, self.int_type)
 
@@ -813,21 +819,343 @@ class Model(object):
     #
     ######################################################
 
+    def _initialize_dataset(self):
+        with self.sess.as_default():
+            with self.sess.graph.as_default():
+                # Optional tf.data input pipeline (see fit()). The flat impulse tables from ImpulseWindows.get_tables()
+                # and the response arrays are fed once when the iterator is initialized, and minibatch windows
+                # are then expanded in-graph and prefetched in the background. If use_dataset is False (the default),
+                # the pipeline is bypassed and the model inputs below must be fed as usual.
+                self.use_dataset = tf.placeholder_with_default(tf.constant(False, dtype=tf.bool), shape=[], name='use_dataset')
+                self.dataset_values = tf.placeholder(self.STORAGE_FLOAT_TF, shape=[None, None], name='dataset_values')
+                self.dataset_times = tf.placeholder(self.FLOAT_TF, shape=[None], name='dataset_times')
+                self.dataset_first_obs = tf.placeholder(self.INT_TF, shape=[None, None], name='dataset_first_obs')
+                self.dataset_last_obs = tf.placeholder(self.INT_TF, shape=[None, None], name='dataset_last_obs')
+                self.dataset_file_ix = tf.placeholder(self.INT_TF, shape=[None], name='dataset_file_ix')
+                self.dataset_Y = tf.placeholder(self.FLOAT_TF, shape=[None, self.n_response], name='dataset_Y')
+                self.dataset_Y_time = tf.placeholder(self.FLOAT_TF, shape=[None], name='dataset_Y_time')
+                self.dataset_Y_mask = tf.placeholder(self.FLOAT_TF, shape=[None, self.n_response], name='dataset_Y_mask')
+                self.dataset_Y_gf = tf.placeholder(self.INT_TF, shape=[None, len(self.rangf)], name='dataset_Y_gf')
+                self.dataset_ix = tf.placeholder(self.INT_TF, shape=[None], name='dataset_ix')
+                self.dataset_minibatch_size = tf.placeholder(tf.int64, shape=[], name='dataset_minibatch_size')
+
+                T = self.history_length + self.future_length
+
+                def expand_windows(ix):
+                    # Same indexing as get_window_indices(), applied to all impulse files at once
+                    first_obs = tf.gather(self.dataset_first_obs, ix)[:, None, :]
+                    last_obs = tf.gather(self.dataset_last_obs, ix)[:, None, :]
+                    window_ix = last_obs - T + tf.range(T, dtype=self.INT_TF)[None, :, None]
+                    mask = window_ix >= first_obs
+                    rows = tf.where(mask, window_ix + 1, tf.zeros_like(window_ix))
+                    X_len = tf.reduce_sum(tf.cast(mask, dtype=self.INT_TF), axis=1)
+                    if self.trim_history:
+                        # See trim_compact_windows()
+                        rows = rows[:, T - tf.maximum(tf.reduce_max(X_len), 1):]
+                    X_time_file = tf.gather(self.dataset_times, rows)
+                    X_rows = tf.gather(rows, self.dataset_file_ix, axis=2)
+                    X_cols = tf.zeros_like(X_rows) + tf.range(tf.shape(X_rows)[2], dtype=self.INT_TF)[None, None, :]
+                    X = tf.gather_nd(self.dataset_values, tf.stack([X_rows, X_cols], axis=-1))
+
+                    return (
+                        X,
+                        X_time_file,
+                        X_len,
+                        tf.gather(self.dataset_Y, ix),
+                        tf.gather(self.dataset_Y_time, ix),
+                        tf.gather(self.dataset_Y_mask, ix),
+                        tf.gather(self.dataset_Y_gf, ix)
+                    )
+
+                dataset = tf.data.Dataset.from_tensor_slices(self.dataset_ix)
+                dataset = dataset.batch(self.dataset_minibatch_size)
+                dataset = dataset.map(expand_windows)
+                dataset = dataset.prefetch(self.prefetch_depth)
+                self.dataset_iterator = dataset.make_initializable_iterator()
+
+                def empty_batch():
+                    return (
+                        tf.zeros([0, T, self.n_impulse], dtype=self.STORAGE_FLOAT_TF),
+                        tf.zeros([0, T, 1], dtype=self.FLOAT_TF),
+                        tf.zeros([0, 1], dtype=self.INT_TF),
+                        tf.zeros([0, self.n_response], dtype=self.FLOAT_TF),
+                        tf.zeros([0], dtype=self.FLOAT_TF),
+                        tf.zeros([0, self.n_response], dtype=self.FLOAT_TF),
+                        tf.zeros([0, len(self.rangf)], dtype=self.INT_TF)
+                    )
+
+                # Conditioned once so that all inputs are drawn from the same iterator step
+                self.dataset_batch = tf.cond(
+                    self.use_dataset,
+                    lambda: self.dataset_iterator.get_next(),
+                    empty_batch
+                )
+
+    def dataset_feed_dict(self, X_windows, Y, Y_time, Y_mask, Y_gf, ix, minibatch_size):
+        """
+        Construct the feed dict for initializing the ``tf.data`` input pipeline over a set of responses.
+
+        :param X_windows: ``ImpulseWindows`` object; impulse windows for all responses.
+        :param Y: ``numpy`` array; response matrix.
+        :param Y_time: ``numpy`` vector; response timestamps.
+        :param Y_mask: ``numpy`` array; response mask.
+        :param Y_gf: ``numpy`` array or ``None``; random grouping factor levels. If ``None``, uses default levels.
+        :param ix: ``numpy`` vector; response indices in the order in which they will be batched.
+        :param minibatch_size: ``int``; minibatch size.
+        :return: ``dict``; feed dict for the initializer of ``self.dataset_iterator``.
+        """
+
+        values, times, first_obs, last_obs, file_ix = X_windows.get_tables(float_type=self.storage_float_type)
+        if Y_gf is None:
+            Y_gf = np.tile(self.gf_defaults, [len(Y), 1])
+
+        return {
+            self.dataset_values: values,
+            self.dataset_times: times,
+            self.dataset_first_obs: first_obs,
+            self.dataset_last_obs: last_obs,
+            self.dataset_file_ix: file_ix,
+            self.dataset_Y: Y,
+            self.dataset_Y_time: Y_time,
+            self.dataset_Y_mask: Y_mask,
+            self.dataset_Y_gf: Y_gf,
+            self.dataset_ix: ix,
+            self.dataset_minibatch_size: minibatch_size
+        }
+
+    def get_stored_windows(self, X_windows, Y_time, unique_ix=None):
+        """
+        Expand the impulse windows of all responses for storage over a call to ``fit()``, ``predict()``, etc.
+        Impulses are stored in **storage_float_type**. If that type is set and **float_type** is wider than ``float32``,
+        timestamps are stored as ``float32`` offsets from their response times (see ``restore_time_offsets()``).
+
+        :param X_windows: ``ImpulseWindows``; impulse windows.
+        :param Y_time: ``numpy`` vector; response timestamps.
+        :param unique_ix: ``numpy`` vector or ``None``; responses with distinct windows (see ``get_window_ix()``). If ``None``, windows are stored for all responses.
+        :return: 4-tuple of ``numpy`` arrays or ``None``; compact impulses, timestamps (or timestamp offsets), and window lengths (see ``ImpulseWindows.get()``), and interleaving indices (see ``get_interleave_ix()``).
+        """
+
+        X, X_time, X_len = X_windows.get(unique_ix, compact=True, float_type=self.storage_float_type)
+        X_interleave = self.get_interleave_ix(X_time, X_windows.file_ix)
+        if self.store_time_offsets:
+            X_time = get_time_offsets(X_time, X_len, Y_time if unique_ix is None else Y_time[unique_ix])
+
+        return X, X_time, X_len, X_interleave
+
+    def get_window_ix(self, X_windows, Y_time, Y_gf=None, verbose=True):
+        """
+        Find responses that share model inputs, i.e. impulse windows, response times, and random effects levels
+        (e.g. responses from multiple response files sampled at the same times), so that their windows can be
+        stored and convolved once (see **deduplicate_windows**).
+
+        :param X_windows: ``ImpulseWindows``; impulse windows.
+        :param Y_time: ``numpy`` vector; response timestamps.
+        :param Y_gf: ``numpy`` array or ``None``; random grouping factor levels of each response.
+        :param verbose: ``bool``; whether to report the number of distinct inputs.
+        :return: pair of ``numpy`` vectors or ``None``; index of the distinct inputs of each response, and a response with each distinct input (see ``ImpulseWindows.deduplicate()``). ``None`` if **deduplicate_windows** is ``False`` or all inputs are distinct.
+        """
+
+        if not self.deduplicate_windows:
+            return None, None
+
+        window_ix, unique_ix = X_windows.deduplicate([Y_time] + ([] if Y_gf is None else [Y_gf]))
+        if verbose:
+            stderr('Distinct impulse windows: %d of %d responses\n' % (len(unique_ix), len(window_ix)))
+        if len(unique_ix) == len(window_ix):
+            return None, None
+
+        return window_ix, unique_ix
+
+    def get_window_batch(self, window_ix, unique_ix, ix):
+        """
+        Select the distinct model inputs of a minibatch of responses (see ``get_window_ix()``).
+
+        :param window_ix: ``numpy`` vector or ``None``; index of the distinct inputs of each response.
+        :param unique_ix: ``numpy`` vector or ``None``; a response with each distinct input.
+        :param ix: ``numpy`` vector of row indices or ``slice``; responses in the minibatch.
+        :return: triple; (1) rows of the stored windows (see ``get_stored_windows()``) and (2) responses from which to take the inputs of the minibatch, and (3) feed dict entry mapping the responses in the minibatch to their inputs. If **window_ix** is ``None``, (1) and (2) are **ix** and (3) is empty.
+        """
+
+        if window_ix is None:
+            return ix, ix, {}
+
+        w, Y_window_ix = np.unique(window_ix[ix], return_inverse=True)
+
+        return w, unique_ix[w], {self.Y_window_ix: Y_window_ix}
+
+    def get_feed_batch_size(self, feed_dict):
+        """
+        Get the number of responses in a feed dict (see ``get_window_batch()``).
+
+        :param feed_dict: ``dict``; feed dict.
+        :return: ``int``; number of responses.
+        """
+
+        if self.Y_window_ix in feed_dict:
+            return len(feed_dict[self.Y_window_ix])
+        return len(feed_dict[self.Y_time])
+
+    def restore_time_offsets(self, X_time, X_len, Y_time):
+        """
+        Recover impulse timestamps of a minibatch from storage (see ``get_stored_windows()``).
+
+        :param X_time: ``numpy`` array; stored compact impulse timestamps of the minibatch.
+        :param X_len: ``numpy`` array; window lengths of the minibatch.
+        :param Y_time: ``numpy`` vector; response timestamps of the minibatch.
+        :return: ``numpy`` array; compact impulse timestamps.
+        """
+
+        if self.store_time_offsets:
+            return apply_time_offsets(X_time, X_len, Y_time, float_type=self.float_type)
+        return X_time
+
+    def report_storage_error(self, X_windows):
+        """
+        Report the rounding error incurred by storing impulses in **storage_float_type**.
+
+        :param X_windows: ``ImpulseWindows``; impulse windows.
+        :return: ``None``
+        """
+
+        if self.storage_float_type is None or self.storage_float_type == self.float_type:
+            return
+
+        err, sd = X_windows.storage_error(self.storage_float_type)
+        rel = err / np.where(sd > 0, sd, 1.)
+        stderr('Storing impulses as %s. Max rounding error by impulse (absolute, relative to SD):\n' % self.storage_float_type)
+        for name, _err, _rel in zip(X_windows.impulse_names, err, rel):
+            stderr('  %s: %.4g, %.4g\n' % (name, _err, _rel))
+        if not np.all(np.isfinite(err)):
+            stderr('WARNING: Some impulses overflow %s. Use a wider storage_float_type.\n' % self.storage_float_type)
+
+    def activation_units(self):
+        """
+        Estimate the number of activations computed per response and time step, for memory planning (see ``plan_memory()``).
+
+        :return: ``int``; number of activations.
+        """
+
+        # Impulses, time offsets, IRF responses, and convolved impulses
+        return 4 * max(len(self.terminal_names), self.n_impulse)
+
+    def plan_memory(self, X_windows, optimize_memory=False, use_dataset=False, training=False, verbose=True):
+        """
+        Estimate the memory footprint of a call to ``fit()``, ``predict()``, etc. from the impulse windows and model settings,
+        and choose how to construct inputs. Expanded impulse arrays are either materialized once for all responses or
+        computed on the fly for each minibatch (**optimize_memory**), and model activations scale with the minibatch size.
+        If **memory_budget** is set, inputs are computed on the fly if materializing them would exceed the budget,
+        and the evaluation minibatch size is capped to fit the budget.
+        Estimates do not include the source data tables or the model parameters.
+
+        :param X_windows: ``ImpulseWindows``; impulse windows.
+        :param optimize_memory: ``bool``; whether on-the-fly expansion was requested.
+        :param use_dataset: ``bool``; whether training inputs are expanded in-graph by a ``tf.data`` pipeline.
+        :param training: ``bool``; whether the plan is for training (minibatches of **minibatch_size**, with gradients) or evaluation (minibatches of **eval_minibatch_size**).
+        :param verbose: ``bool``; whether to log the plan.
+        :return: ``dict``; the plan, with keys ``'optimize_memory'`` (whether to compute inputs on the fly), ``'eval_minibatch_size'``, ``'materialized'`` (estimated bytes of materialized inputs), and ``'peak'`` (estimated peak bytes).
+        """
+
+        n = len(X_windows)
+        T = X_windows.window_length
+        if training:
+            B = n if not np.isfinite(self.minibatch_size) else min(self.minibatch_size, n)
+        else:
+            B = min(self.eval_minibatch_size, n)
+        B = max(B, 1)
+        eval_minibatch_size = self.eval_minibatch_size
+        budget = None if self.memory_budget is None else self.memory_budget * 1024 ** 3
+
+        # Per-response bytes of model activations (doubled for gradients) and of an expanded minibatch.
+        # Materialized inputs are sliced into a minibatch copy; on-the-fly inputs hold the prefetched minibatches.
+        act = T * self.activation_units() * np.dtype(self.FLOAT_NP).itemsize * (1 + int(training))
+        row = X_windows.expanded_nbytes(1, float_type=self.storage_float_type)
+        full = X_windows.expanded_nbytes(float_type=self.storage_float_type)
+
+        def peak(materialize, batch_size):
+            if materialize:
+                return full + batch_size * (row + act)
+            return batch_size * ((self.prefetch_depth + 1) * row + act)
+
+        materialize = not (optimize_memory or use_dataset)
+        if budget is not None:
+            if materialize and peak(True, B) > budget:
+                materialize = False
+            if not training:
+                cap = int((budget - peak(materialize, 0)) // (peak(materialize, 1) - peak(materialize, 0)))
+                eval_minibatch_size = max(min(eval_minibatch_size, cap), 1)
+                B = min(B, eval_minibatch_size)
+        out = {
+            'optimize_memory': not materialize and not use_dataset,
+            'eval_minibatch_size': eval_minibatch_size,
+            'materialized': full if materialize else 0,
+            'peak': peak(materialize, B)
+        }
+
+        if verbose:
+            GB = 1024 ** 3
+            rss, rss_peak = get_rss()
+            stderr('Memory plan: %s inputs, %s minibatch size %d. Estimated peak: %.2f GB (%s).\n' % (
+                'materialized' if materialize else ('in-graph' if use_dataset else 'on-the-fly'),
+                'training' if training else 'evaluation',
+                B,
+                out['peak'] / GB,
+                'no budget' if budget is None else 'budget %.2f GB' % (budget / GB)
+            ))
+            if rss is not None:
+                stderr('Current RSS: %.2f GB (peak %.2f GB).\n' % (rss / GB, (rss_peak or rss) / GB))
+            if budget is not None and out['peak'] > budget:
+                stderr('WARNING: Estimated peak memory exceeds memory_budget even with on-the-fly inputs.\n')
+
+        return out
+
+    def get_interleave_ix(self, X_time, file_ix):
+        """
+        Compute the temporal interleaving of asynchronous impulse streams used by the model, if any (CDRNN only).
+
+        :param X_time: ``numpy`` array; compact impulse timestamps with shape (B, T, F) (see ``ImpulseWindows.get()``).
+        :param file_ix: ``numpy`` vector; map from impulse dimensions to columns of **X_time**.
+        :return: ``numpy`` array or ``None``; interleaving indices, or ``None`` if the model does not interleave impulse streams.
+        """
+
+        return None
+
+    def interleave_feed(self, X_time, file_ix, X_interleave=None, ix=None):
+        """
+        Construct the feed dict entry for the temporal interleaving of asynchronous impulse streams (see ``get_interleave_ix()``).
+
+        :param X_time: ``numpy`` array; compact impulse timestamps of the minibatch.
+        :param file_ix: ``numpy`` vector; map from impulse dimensions to columns of **X_time**.
+        :param X_interleave: ``numpy`` array or ``None``; interleaving indices precomputed for all responses. If ``None``, computed from **X_time**.
+        :param ix: ``numpy`` vector of row indices or ``slice``; rows of **X_interleave** in the minibatch (ignored if **X_interleave** is ``None``).
+        :return: ``dict``; feed dict entry, empty if the model does not interleave impulse streams.
+        """
+
+        if X_interleave is None:
+            X_interleave = self.get_interleave_ix(X_time, file_ix)
+            if X_interleave is None:
+                return {}
+        else:
+            X_interleave = X_interleave[ix]
+
+        return {self.X_interleave_ix: X_interleave}
+
     def _initialize_inputs(self):
         with self.sess.as_default():
             with self.sess.graph.as_default():
                 self.training = tf.placeholder_with_default(tf.constant(False, dtype=tf.bool), shape=[], name='training')
 
-                # Impulses
-                self.X = tf.placeholder(
+                self._initialize_dataset()
+
+                # Impulses, in storage precision (see storage_float_type)
+                self.X = tf.placeholder_with_default(
+                    self.dataset_batch[0],
                     shape=[None, None, self.n_impulse],
-                    dtype=self.FLOAT_TF,
                     name='X'
                 )
                 X_shape = tf.shape(self.X)
                 self.X_batch_dim = X_shape[0]
                 self.X_time_dim = X_shape[1]
-                X_processed = self.X
+                X_processed = tf.cast(self.X, dtype=self.FLOAT_TF)
                 if self.center_inputs:
                     X_processed -= self.impulse_means_arr_expanded
                 if self.rescale_inputs:
@@ -835,49 +1163,91 @@ class Model(object):
                     scale = np.where(scale != 0, scale, 1.)
                     X_processed /= scale
                 self.X_processed = X_processed
-                self.X_time = tf.placeholder_with_default(
-                    tf.zeros(
-                        tf.convert_to_tensor([
-                            self.X_batch_dim,
-                            self.history_length + self.future_length,
-                            max(self.n_impulse, 1)
-                        ]),
-                        dtype=self.FLOAT_TF
+
+                # Compact encoding of impulse timestamps and masks (see ImpulseWindows.get()).
+                # Timestamps are fed once per impulse file and masks as window lengths, and both are expanded
+                # over impulse dimensions in-graph. Full X_time and X_mask arrays can still be fed directly.
+                self.X_time_file = tf.placeholder_with_default(
+                    tf.cond(
+                        self.use_dataset,
+                        lambda: self.dataset_batch[1],
+                        lambda: tf.zeros(
+                            tf.convert_to_tensor([
+                                self.X_batch_dim,
+                                self.history_length + self.future_length,
+                                1
+                            ]),
+                            dtype=self.FLOAT_TF
+                        )
                     ),
+                    shape=[None, None, None],
+                    name='X_time_file'
+                )
+                self.X_len = tf.placeholder_with_default(
+                    tf.cond(
+                        self.use_dataset,
+                        lambda: self.dataset_batch[2],
+                        lambda: tf.fill(
+                            tf.convert_to_tensor([self.X_batch_dim, 1]),
+                            tf.constant(self.history_length + self.future_length, dtype=self.INT_TF)
+                        )
+                    ),
+                    shape=[None, None],
+                    name='X_len'
+                )
+                self.X_file_ix = tf.placeholder_with_default(
+                    tf.zeros([max(self.n_impulse, 1)], dtype=self.INT_TF),
+                    shape=[max(self.n_impulse, 1)],
+                    name='X_file_ix'
+                )
+                X_time_dim_file = tf.shape(self.X_time_file)[1]
+                X_len = tf.gather(self.X_len, self.X_file_ix, axis=1)[:, None, :]
+                X_steps = tf.range(X_time_dim_file, dtype=self.INT_TF)[None, :, None]
+                self.X_time = tf.placeholder_with_default(
+                    tf.gather(self.X_time_file, self.X_file_ix, axis=2),
                     shape=[None, None, max(self.n_impulse, 1)],
                     name='X_time'
                 )
                 self.X_mask = tf.placeholder_with_default(
-                    tf.ones(
-                        tf.convert_to_tensor([
-                            self.X_batch_dim,
-                            self.history_length + self.future_length,
-                            max(self.n_impulse, 1)
-                        ]),
-                        dtype=self.FLOAT_TF
-                    ),
+                    tf.cast(X_steps >= X_time_dim_file - X_len, dtype=self.FLOAT_TF),
                     shape=[None, None, max(self.n_impulse, 1)],
                     name='X_mask'
                 )
 
                 # Responses
-                self.Y = tf.placeholder(
+                self.Y = tf.placeholder_with_default(
+                    self.dataset_batch[3],
                     shape=[None, self.n_response],
-                    dtype=self.FLOAT_TF,
                     name=sn('Y')
                 )
                 Y_shape = tf.shape(self.Y)
                 self.Y_batch_dim = Y_shape[0]
                 self.Y_time = tf.placeholder_with_default(
-                    tf.ones(tf.convert_to_tensor([self.Y_batch_dim]), dtype=self.FLOAT_TF),
+                    tf.cond(
+                        self.use_dataset,
+                        lambda: self.dataset_batch[4],
+                        lambda: tf.ones(tf.convert_to_tensor([self.Y_batch_dim]), dtype=self.FLOAT_TF)
+                    ),
                     shape=[None],
                     name=sn('Y_time')
                 )
                 self.Y_mask = tf.placeholder_with_default(
-                    tf.ones(tf.convert_to_tensor([self.Y_batch_dim, self.n_response]), dtype=self.FLOAT_TF),
+                    tf.cond(
+                        self.use_dataset,
+                        lambda: self.dataset_batch[5],
+                        lambda: tf.ones(tf.convert_to_tensor([self.Y_batch_dim, self.n_response]), dtype=self.FLOAT_TF)
+                    ),
                     shape=[None, self.n_response],
                     name='Y_mask'
                 )
+                # Row of the model inputs of each response. Responses that share impulse windows, response times,
+                # and random effects can share a row (see deduplicate_windows), in which case model outputs
+                # are gathered back to responses before computing predictions and likelihoods.
+                self.Y_window_ix = tf.placeholder_with_default(
+                    tf.range(self.X_batch_dim, dtype=self.INT_TF),
+                    shape=[None],
+                    name='Y_window_ix'
+                )
 
                 # Compute tensor of temporal offsets
                 # shape (B,)
@@ -895,7 +1265,11 @@ class Model(object):
                 self.t_delta = t_delta
                 self.gf_defaults = np.expand_dims(np.array(self.rangf_n_levels, dtype=self.INT_NP), 0) - 1
                 self.Y_gf = tf.placeholder_with_default(
-                    tf.cast(self.gf_defaults, dtype=self.INT_TF),
+                    tf.cond(
+                        self.use_dataset,
+                        lambda: self.dataset_batch[6],
+                        lambda: tf.cast(self.gf_defaults, dtype=self.INT_TF)
+                    ),
                     shape=[None, len(self.rangf)],
                     name='Y_gf'
                 )
@@ -1407,12 +1781,14 @@ class Model(object):
                             ]
                         )
 
+                    response_params = tf.gather(response_params + output, self.Y_window_ix)
+                    output = tf.gather(output, self.Y_window_ix)
+
                     for j, response_param_name in enumerate(response_param_names):
                         dim_names = self._expand_param_name_by_dim(response, response_param_name)
                         for k, dim_name in enumerate(dim_names):
                             self.predictive_distribution_delta[response][dim_name] = output[:, j, k]
 
-                    response_params = response_params + output
                     response_params = tf.unstack(response_params, axis=1)
 
                     # Post process response params
@@ -1487,7 +1863,11 @@ class Model(object):
                             )
 
                     # Define EMA over X_conv
-                    X_conv = tf.unstack(self.X_conv[response], axis=2) # X_conv is (batch, impulse, param, dim)
+                    X_conv = self.X_conv[response]
+                    if self.deduplicate_windows:
+                        # Average over responses rather than distinct windows, as without deduplication
+                        X_conv = tf.gather(X_conv, self.Y_window_ix)
+                    X_conv = tf.unstack(X_conv, axis=2) # X_conv is (batch, impulse, param, dim)
                     self.X_conv_ema[response] = {}
                     self.X_conv_ema_debiased[response] = {}
                     for j, response_param_name in enumerate(response_param_names):
@@ -1812,7 +2192,32 @@ class Model(object):
             with self.sess.graph.as_default():
                 self.saver = tf.train.Saver()
 
+                if self.async_save:
+                    # Untracked copies of all saved variables, so that a background thread can write a consistent
+                    # snapshot to disk while training keeps updating the originals.
+                    snapshot_vars = {}
+                    with tf.name_scope('checkpoint_snapshot'):
+                        for v in tf.global_variables():
+                            snapshot_vars[v.op.name] = tf.Variable(
+                                tf.zeros(v.shape, dtype=v.dtype.base_dtype),
+                                trainable=False,
+                                collections=[],
+                                name=v.op.name
+                            )
+                    self.checkpoint_snapshot_op = tf.group(
+                        *[tf.assign(snapshot_vars[v.op.name], v) for v in tf.global_variables() if v.op.name in snapshot_vars]
+                    )
+                    self.checkpoint_saver = tf.train.Saver(snapshot_vars)
+
                 self.check_numerics_ops = [tf.check_numerics(v, 'Numerics check failed') for v in tf.trainable_variables()]
+                self.check_numerics_op = tf.group(*self.check_numerics_ops)
+
+                # Same checks, fused into the training step and ordered after the update so that they validate
+                # the post-update parameters.
+                with tf.control_dependencies([self.train_op]):
+                    self.check_numerics_train_op = tf.group(
+                        *[tf.check_numerics(v.read_value(), 'Numerics check failed') for v in tf.trainable_variables()]
+                    )
 
     def _initialize_ema(self):
         with self.sess.as_default():
@@ -2084,20 +2489,31 @@ class Model(object):
                     self.d0_assign.append(tf.assign(var_d0_iterates, var_d0_iterates_update))
 
     def _compute_and_test_corr(self, iterates):
+        # Column-wise tests over iterates of shape (n, P): correlation with time (rt) and lag-1 autocorrelation (ra)
+        # of each tracked parameter, with two-tailed p-values from a t-test.
         x = np.arange(0, len(iterates)*self.convergence_stride, self.convergence_stride).astype('float')[..., None]
         y = iterates
 
         n_iterates = int(self.convergence_n_iterates / self.convergence_stride)
 
-        rt = corr(x, y)[0]
-        tt = rt * np.sqrt((n_iterates - 2) / (1 - rt ** 2))
-        p_tt = 1 - (scipy.stats.t.cdf(np.fabs(tt), n_iterates - 2) - scipy.stats.t.cdf(-np.fabs(tt), n_iterates - 2))
-        p_tt = np.where(np.isfinite(p_tt), p_tt, np.zeros_like(p_tt))
+        def corr_cols(a, b):
+            a = a - a.mean(axis=0, keepdims=True)
+            b = b - b.mean(axis=0, keepdims=True)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                rho = (a * b).sum(axis=0) / np.sqrt((a ** 2).sum(axis=0) * (b ** 2).sum(axis=0))
+            return np.clip(rho, -1, 1)
 
-        ra = corr(y[1:], y[:-1])[0]
-        ta = ra * np.sqrt((n_iterates - 2) / (1 - ra ** 2))
-        p_ta = 1 - (scipy.stats.t.cdf(np.fabs(ta), n_iterates - 2) - scipy.stats.t.cdf(-np.fabs(ta), n_iterates - 2))
-        p_ta = np.where(np.isfinite(p_ta), p_ta, np.zeros_like(p_ta))
+        def test(r):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                t = r * np.sqrt((n_iterates - 2) / (1 - r ** 2))
+            p = 1 - (scipy.stats.t.cdf(np.fabs(t), n_iterates - 2) - scipy.stats.t.cdf(-np.fabs(t), n_iterates - 2))
+            return np.where(np.isfinite(p), p, np.zeros_like(p))
+
+        rt = corr_cols(x, y)
+        p_tt = test(rt)
+
+        ra = corr_cols(y[1:], y[:-1])
+        p_ta = test(ra)
 
         return rt, p_tt, ra, p_ta
 
@@ -2112,8 +2528,8 @@ class Model(object):
                     p_ta_at_min_p = 0
                     fd_assign = {}
 
-                    cur_step = self.global_step.eval(session=self.sess)
-                    last_check = self.last_convergence_check.eval(session=self.sess)
+                    to_run = [self.global_step, self.last_convergence_check, self.convergence_history, self.d0_saved]
+                    cur_step, last_check, convergence_history, var_d0_iterates = self.sess.run(to_run)
                     offset = cur_step % self.convergence_stride
                     update = last_check < cur_step and self.convergence_stride > 0
                     if update and feed_dict is None:
@@ -2124,70 +2540,65 @@ class Model(object):
                     # End of stride if next step is a push
                     end_of_stride = last_check < (cur_step+1) and self.convergence_stride > 0 and ((cur_step+1) % self.convergence_stride == 0)
 
-                    if self.check_convergence:
-                        if update:
-                            var_d0, var_d0_iterates = self.sess.run([self.d0, self.d0_saved], feed_dict=feed_dict)
+                    # Iterates of all tracked variables are concatenated into a single (n_iterates, P) array,
+                    # so that the iterate buffer is updated and tested for all variables in one pass.
+                    n_slots = int(self.convergence_n_iterates / self.convergence_stride)
+                    bounds = np.cumsum([x.shape[1] for x in var_d0_iterates])[:-1]
+                    iterates_d0 = np.concatenate([np.zeros((n_slots, 0), dtype=self.FLOAT_NP)] + var_d0_iterates, axis=1)
+                    if update and var_d0_iterates:
+                        new_d0 = np.concatenate(self.sess.run(self.d0, feed_dict=feed_dict))
+                        if push:
+                            iterates_d0[:-1] = iterates_d0[1:]
+                            iterates_d0[-1] = new_d0
                         else:
-                            var_d0_iterates = self.sess.run(self.d0_saved)
-
-                        start_ix = int(self.convergence_n_iterates / self.convergence_stride) - int(cur_step / self.convergence_stride)
-                        start_ix = max(0, start_ix)
-
-                        for i in range(len(var_d0_iterates)):
-                            if update:
-                                new_d0 = var_d0[i]
-                                iterates_d0 = var_d0_iterates[i]
-                                if push:
-                                    iterates_d0[:-1] = iterates_d0[1:]
-                                    iterates_d0[-1] = new_d0
-                                else:
-                                    new_d0 = (new_d0 + offset * iterates_d0[-1]) / (offset + 1)
-                                    iterates_d0[-1] = new_d0
-                                fd_assign[self.d0_saved_update[i]] = iterates_d0
+                            iterates_d0[-1] = (new_d0 + offset * iterates_d0[-1]) / (offset + 1)
+                        for i, x in enumerate(np.split(iterates_d0, bounds, axis=1)):
+                            fd_assign[self.d0_saved_update[i]] = x
+
+                    start_ix = int(self.convergence_n_iterates / self.convergence_stride) - int(cur_step / self.convergence_stride)
+                    start_ix = max(0, start_ix)
+
+                    rt, p_tt, ra, p_ta = self._compute_and_test_corr(iterates_d0[start_ix:])
+                    if p_tt.size:
+                        ix = p_tt.argmin()
+                        if p_tt[ix] < min_p:
+                            min_p = p_tt[ix]
+                            min_p_ix = int(np.searchsorted(bounds, ix, side='right'))
+                            rt_at_min_p = rt[ix]
+                            ra_at_min_p = ra[ix]
+                            p_ta_at_min_p = p_ta[ix]
 
-                                rt, p_tt, ra, p_ta = self._compute_and_test_corr(iterates_d0[start_ix:])
-                            else:
-                                rt, p_tt, ra, p_ta = self._compute_and_test_corr(var_d0_iterates[i][start_ix:])
-
-                            new_min_p_ix = p_tt.argmin()
-                            new_min_p = p_tt[new_min_p_ix]
-                            if new_min_p < min_p:
-                                min_p = new_min_p
-                                min_p_ix = i
-                                rt_at_min_p = rt[new_min_p_ix]
-                                ra_at_min_p = ra[new_min_p_ix]
-                                p_ta_at_min_p = p_ta[new_min_p_ix]
-
-                        if update:
-                            fd_assign[self.last_convergence_check_update] = self.global_step.eval(session=self.sess)
-                            to_run = [self.d0_assign, self.last_convergence_check_assign]
-                            self.sess.run(to_run, feed_dict=fd_assign)
+                    to_run = []
+                    if update:
+                        fd_assign[self.last_convergence_check_update] = cur_step
+                        to_run += [self.d0_assign, self.last_convergence_check_assign]
 
                     if end_of_stride:
                         locally_converged = cur_step > self.convergence_n_iterates and \
                                     (min_p > self.convergence_alpha)
-                        convergence_history = self.convergence_history.eval(session=self.sess)
                         convergence_history[:-1] = convergence_history[1:]
                         convergence_history[-1] = locally_converged
-                        self.sess.run(self.convergence_history_assign, {self.convergence_history_update: convergence_history})
+                        fd_assign[self.convergence_history_update] = convergence_history
+                        to_run.append(self.convergence_history_assign)
 
-                    if self.log_freq > 0 and self.global_step.eval(session=self.sess) % self.log_freq == 0:
-                        fd_convergence = {
-                                self.rho_t: rt_at_min_p,
-                                self.p_rho_t: min_p
-                            }
-                        summary_convergence = self.sess.run(
-                            self.summary_convergence,
-                            feed_dict=fd_convergence
-                        )
-                        self.writer.add_summary(summary_convergence, self.global_step.eval(session=self.sess))
+                    if self.log_freq > 0 and cur_step % self.log_freq == 0:
+                        fd_assign[self.rho_t] = rt_at_min_p
+                        fd_assign[self.p_rho_t] = min_p
+                        to_run.append(self.summary_convergence)
 
-                    proportion_converged = self.proportion_converged.eval(session=self.sess)
+                    proportion_converged = convergence_history.mean()
                     converged = cur_step > self.convergence_n_iterates and \
                                 (min_p > self.convergence_alpha) and \
                                 (proportion_converged > self.convergence_alpha)
                                 # (p_ta_at_min_p > self.convergence_alpha)
 
+                    # Apply all updates in one call
+                    fd_assign[self.converged_in] = converged
+                    to_run.append(self.set_converged)
+                    out = self.sess.run(to_run, feed_dict=fd_assign)
+                    if self.log_freq > 0 and cur_step % self.log_freq == 0:
+                        self.writer.add_summary(out[-2], cur_step)
+
                     if verbose:
                         stderr('rho_t: %s.\n' % rt_at_min_p)
                         stderr('p of rho_t: %s.\n' % min_p)
@@ -2202,7 +2613,7 @@ class Model(object):
                     if verbose:
                         stderr('Convergence checking off.\n')
 
-                self.sess.run(self.set_converged, feed_dict={self.converged_in: converged})
+                    self.sess.run(self.set_converged, feed_dict={self.converged_in: converged})
 
                 return min_p_ix, min_p, rt_at_min_p, ra_at_min_p, p_ta_at_min_p, proportion_converged, converged
 
@@ -2235,29 +2646,18 @@ class Model(object):
 
         raise NotImplementedError
 
-    def run_train_step(self, feed_dict):
+    def run_train_step(self, feed_dict, check_numerics=False):
         """
         Update the model from a batch of training data.
 
         :param feed_dict: ``dict``; A dictionary of predictor and response values
+        :param check_numerics: ``bool``; Whether to check that all trainable parameters are finite after the update, in the same session call (see ``check_numerics()``). Throws an error if not.
         :return: ``numpy`` array; Predicted responses, one for each training sample
         """
 
         with self.sess.as_default():
             with self.sess.graph.as_default():
-                to_run = [self.train_op]
-                to_run += self.ema_ops
-
-                to_run += [self.loss_func, self.reg_loss]
-                to_run_names = ['loss', 'reg_loss']
-
-                if self.loss_filter_n_sds:
-                    to_run_names.append('n_dropped')
-                    to_run.append(self.n_dropped)
-
-                if self.is_bayesian:
-                    to_run_names.append('kl_loss')
-                    to_run.append(self.kl_loss)
+                to_run, to_run_names = self._get_train_step_fetches(check_numerics=check_numerics)
 
                 out = self.sess.run(
                     to_run,
@@ -2268,6 +2668,54 @@ class Model(object):
 
                 return out_dict
 
+    def run_train_steps(self, feed_dict, n_steps, check_numerics=False):
+        """
+        Update the model from **n_steps** consecutive batches of training data drawn from the ``tf.data`` input pipeline (see ``fit()``).
+        Equivalent to calling ``run_train_step()`` **n_steps** times with the same feed dict, but the fetches and feeds are
+        compiled into a session callable once, which removes most of the per-step overhead of ``Session.run()``.
+
+        :param feed_dict: ``dict``; A dictionary of constant feeds for all steps (e.g. ``use_dataset``)
+        :param n_steps: ``int``; Number of updates to run
+        :param check_numerics: ``bool``; Whether to check that all trainable parameters are finite after each update (see ``run_train_step()``).
+        :return: ``list`` of ``dict``; Outputs of each step, as returned by ``run_train_step()``
+        """
+
+        with self.sess.as_default():
+            with self.sess.graph.as_default():
+                to_run, to_run_names = self._get_train_step_fetches(check_numerics=check_numerics)
+                feed_list = list(feed_dict.keys())
+                key = (self.sess, tuple(feed_list), check_numerics)
+                if key not in self.train_step_callables:
+                    self.train_step_callables[key] = self.sess.make_callable(to_run, feed_list=feed_list)
+                fn = self.train_step_callables[key]
+                feed_vals = [feed_dict[x] for x in feed_list]
+
+                out = []
+                for _ in range(n_steps):
+                    _out = fn(*feed_vals)
+                    out.append({x: y for x, y in zip(to_run_names, _out[-len(to_run_names):])})
+
+                return out
+
+    def _get_train_step_fetches(self, check_numerics=False):
+        to_run = [self.train_op]
+        to_run += self.ema_ops
+        if check_numerics:
+            to_run.append(self.check_numerics_train_op)
+
+        to_run += [self.loss_func, self.reg_loss]
+        to_run_names = ['loss', 'reg_loss']
+
+        if self.loss_filter_n_sds:
+            to_run_names.append('n_dropped')
+            to_run.append(self.n_dropped)
+
+        if self.is_bayesian:
+            to_run_names.append('kl_loss')
+            to_run.append(self.kl_loss)
+
+        return to_run, to_run_names
+
     ######################################################
     #
     #  Private model inspection methods
@@ -2443,8 +2891,7 @@ class Model(object):
 
         with self.sess.as_default():
             with self.sess.graph.as_default():
-                for op in self.check_numerics_ops:
-                    self.sess.run(op)
+                self.sess.run(self.check_numerics_op)
 
     def initialized(self):
         """
@@ -2464,6 +2911,8 @@ class Model(object):
     def save(self, dir=None):
         """
         Save the CDR model.
+        The checkpoint is written to a temporary directory and moved into place by atomic rename, so an interrupted save never leaves a partially written checkpoint in **dir**.
+        If ``async_save`` is ``True``, variables are snapshotted in memory and written to disk on a background thread while training continues. Use ``flush_saves()`` to wait for pending writes.
 
         :param dir: ``str``; output directory. If ``None``, use model default.
         :return: ``None``
@@ -2475,25 +2924,129 @@ class Model(object):
             dir = self.outdir
         with self.sess.as_default():
             with self.sess.graph.as_default():
-                failed = True
-                i = 0
+                if self.async_save:
+                    if self.checkpoint_writer is None:
+                        self.checkpoint_writer = BackgroundWriter()
+                    self.checkpoint_writer.flush() # The snapshot variables must not change while they are being written
+                    self.sess.run(self.checkpoint_snapshot_op)
+                    self.checkpoint_writer.submit(self._save_checkpoint, dir, pickle.dumps(self), self.checkpoint_saver)
+                else:
+                    self.flush_saves()
+                    self._save_checkpoint(dir, pickle.dumps(self), self.saver)
+
+    def flush_saves(self):
+        """
+        Block until any checkpoint being written in the background has reached disk.
+        Errors raised by the background write are re-raised here.
+
+        :return: ``None``
+        """
+
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.flush()
+
+    def _save_checkpoint(self, dir, obj, saver):
+        """
+        Write a checkpoint, retrying on failure and falling back to a backup checkpoint if all retries fail.
+
+        :param dir: ``str``; output directory.
+        :param obj: ``bytes``; pickled model object.
+        :param saver: ``tf.train.Saver``; saver used to write the variable values.
+        :return: ``None``
+        """
+
+        failed = True
+        i = 0
+        retained = None
+
+        # Try/except to handle race conditions in Windows
+        while failed and i < 10:
+            try:
+                # Rotate only once per save, so that retries do not shift the retained checkpoints again
+                if retained is None:
+                    retained = self._rotate_checkpoints(dir)
+                self._write_checkpoint(dir, obj, saver, retained)
+                failed = False
+            except Exception:
+                stderr('Write failure during save. Retrying...\n')
+                pytime.sleep(1)
+                i += 1
+        if i >= 10:
+            stderr('Could not save model to checkpoint file. Saving to backup...\n')
+            saver.save(self.sess, dir + '/model_backup.ckpt')
+            with open(dir + '/m.obj', 'wb') as f:
+                f.write(obj)
+
+    def _write_checkpoint(self, dir, obj, saver, retained):
+        """
+        Write a checkpoint to a temporary directory and move the new files into place by atomic rename.
+        Data shards are moved before the index and the model object is moved last, so readers never see an index
+        that points to missing data. Safe to call again if a previous call failed partway.
+
+        :param dir: ``str``; output directory.
+        :param obj: ``bytes``; pickled model object.
+        :param saver: ``tf.train.Saver``; saver used to write the variable values.
+        :param retained: ``list`` of ``str``; paths of retained older checkpoints, oldest first, as returned by ``_rotate_checkpoints()``.
+        :return: ``None``
+        """
+
+        tmpdir = dir + '/tmp_ckpt'
+        if os.path.exists(tmpdir):
+            shutil.rmtree(tmpdir)
+        os.makedirs(tmpdir)
+
+        saver.save(self.sess, tmpdir + '/model.ckpt', write_state=False)
+        with open(tmpdir + '/m.obj', 'wb') as f:
+            f.write(obj)
+
+        names = sorted(x for x in os.listdir(tmpdir) if x.startswith('model.ckpt.'))
+        names = [x for x in names if '.data-' in x] + [x for x in names if '.data-' not in x] + ['m.obj']
 
-                # Try/except to handle race conditions in Windows
-                while failed and i < 10:
+        for name in names:
+            os.replace(tmpdir + '/' + name, dir + '/' + name)
+        os.rmdir(tmpdir)
+
+        tf.train.update_checkpoint_state(
+            dir,
+            dir + '/model.ckpt',
+            all_model_checkpoint_paths=retained + [dir + '/model.ckpt']
+        )
+
+    def _rotate_checkpoints(self, dir):
+        """
+        Shift retained checkpoints back by one (``model.ckpt`` -> ``model_1.ckpt`` -> ``model_2.ckpt`` ...), dropping
+        any beyond ``checkpoint_keep``. ``model.ckpt`` itself is hard-linked (or copied) rather than moved, so it
+        remains valid until it is replaced by the new checkpoint.
+
+        :param dir: ``str``; output directory.
+        :return: ``list`` of ``str``; paths of retained older checkpoints, oldest first.
+        """
+
+        retained = []
+        if self.checkpoint_keep < 2 or not os.path.exists(dir + '/model.ckpt.index'):
+            return retained
+
+        for i in range(self.checkpoint_keep - 1, 0, -1):
+            src = 'model.ckpt' if i == 1 else 'model_%d.ckpt' % (i - 1)
+            dst = 'model_%d.ckpt' % i
+            suffixes = [x[len(src):] for x in os.listdir(dir) if x.startswith(src + '.')]
+            if not suffixes:
+                continue
+            for suffix in suffixes:
+                if i == 1:
+                    tmp = dir + '/' + dst + suffix + '.tmp'
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
                     try:
-                        self.saver.save(self.sess, dir + '/model.ckpt')
-                        with open(dir + '/m.obj', 'wb') as f:
-                            pickle.dump(self, f)
-                        failed = False
-                    except:
-                        stderr('Write failure during save. Retrying...\n')
-                        pytime.sleep(1)
-                        i += 1
-                if i >= 10:
-                    stderr('Could not save model to checkpoint file. Saving to backup...\n')
-                    self.saver.save(self.sess, dir + '/model_backup.ckpt')
-                    with open(dir + '/m.obj', 'wb') as f:
-                        pickle.dump(self, f)
+                        os.link(dir + '/' + src + suffix, tmp)
+                    except OSError:
+                        shutil.copy2(dir + '/' + src + suffix, tmp)
+                    os.replace(tmp, dir + '/' + dst + suffix)
+                else:
+                    os.replace(dir + '/' + src + suffix, dir + '/' + dst + suffix)
+            retained.append(dir + '/' + dst)
+
+        return retained
 
     def load(self, outdir=None, predict=False, restore=True, allow_missing=True):
         """
@@ -2509,6 +3062,7 @@ class Model(object):
 
         if outdir is None:
             outdir = self.outdir
+        self.flush_saves()
         with self.sess.as_default():
             with self.sess.graph.as_default():
                 if not self.initialized():
@@ -2584,6 +3138,9 @@ class Model(object):
         :return: ``None``
         """
 
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.close()
+            self.checkpoint_writer = None
         self.sess.close()
 
     def set_predict_mode(self, mode):
@@ -2604,6 +3161,27 @@ class Model(object):
 
             self.predict_mode = mode
 
+    def get_training_state(self):
+        """
+        Fetch the iteration-level training state in a single session call.
+
+        :return: ``dict``; current iteration (key ``'step'``), whether the model has converged (key ``'converged'``), and, if the learning rate decays, the learning rate (key ``'lr'``).
+        """
+
+        to_run = {'step': self.global_step}
+        if self.check_convergence:
+            to_run['converged'] = self.converged
+        if self.optim_name is not None and self.lr_decay_family is not None:
+            to_run['lr'] = self.lr
+
+        with self.sess.as_default():
+            with self.sess.graph.as_default():
+                out = self.sess.run(to_run)
+
+        out['converged'] = bool(out.get('converged', False))
+
+        return out
+
     def has_converged(self):
         """
         Check whether model has reached its automatic convergence criteria
@@ -3242,7 +3820,8 @@ class Model(object):
             X_in_Y_names=None,
             n_iter=10000,
             force_training_evaluation=True,
-            optimize_memory=False
+            optimize_memory=False,
+            use_dataset=False
             ):
         """
         Fit the model.
@@ -3267,7 +3846,8 @@ class Model(object):
         :param X_in_Y_names: ``list`` of ``str``; names of predictors contained in **Y** rather than **X** (must be present in all elements of **Y**). If ``None``, no such predictors.
         :param n_iter: ``int``; maximum number of training iterations. Training will stop either at convergence or **n_iter**, whichever happens first.
         :param force_training_evaluation: ``bool``; (Re-)run post-fitting evaluation, even if resuming a model whose training is already complete.
-        :param optimize_memory: ``bool``; Compute expanded impulse arrays on the fly rather than pre-computing. Can reduce memory consumption by orders of magnitude but adds computational overhead at each minibatch, slowing training (typically around 1.5-2x the unoptimized training time).
+        :param optimize_memory: ``bool``; Compute expanded impulse arrays on the fly rather than pre-computing. Can reduce memory consumption by orders of magnitude at the cost of a vectorized gather from the source impulse tables at each minibatch.
+        :param use_dataset: ``bool``; Feed training minibatches through a ``tf.data`` pipeline that expands impulse windows in-graph and prefetches them in the background, rather than through ``feed_dict``. Like **optimize_memory**, never materializes the expanded impulse arrays. Evaluation always uses ``feed_dict``.
         """
 
         lengths = [len(_Y) for _Y in Y]
@@ -3296,6 +3876,11 @@ class Model(object):
         Y_in = Y
         if X_in_Y_names:
             X_in_Y_names = [x for x in X_in_Y_names if x in self.impulse_names]
+        if all('chunk' in _Y for _Y in Y):
+            # Data were preprocessed out of core, so shuffle within chunks to keep minibatch reads local
+            chunk_ix = np.concatenate([_Y['chunk'].values for _Y in Y], axis=0)
+        else:
+            chunk_ix = None
 
         Y, first_obs, last_obs, Y_time, Y_mask, Y_gf, X_in_Y = build_CDR_response_data(
             self.response_names,
@@ -3307,19 +3892,38 @@ class Model(object):
             gf_map=self.rangf_map
         )
 
-        if not optimize_memory:
-            X, X_time, X_mask = build_CDR_impulse_data(
-                X_in,
-                first_obs,
-                last_obs,
-                X_in_Y_names=X_in_Y_names,
-                X_in_Y=X_in_Y,
-                history_length=self.history_length,
-                future_length=self.future_length,
-                impulse_names=self.impulse_names,
-                int_type=self.int_type,
-                float_type=self.float_type,
-            )
+        X_windows = get_impulse_windows(
+            X_in,
+            first_obs,
+            last_obs,
+            X_in_Y_names=X_in_Y_names,
+            X_in_Y=X_in_Y,
+            history_length=self.history_length,
+            future_length=self.future_length,
+            impulse_names=self.impulse_names,
+            int_type=self.int_type,
+            float_type=self.float_type,
+        )
+
+        self.report_storage_error(X_windows)
+        optimize_memory = self.plan_memory(
+            X_windows,
+            optimize_memory=optimize_memory,
+            use_dataset=use_dataset,
+            training=True
+        )['optimize_memory']
+        if use_dataset:
+            window_ix, unique_ix = None, None
+        else:
+            window_ix, unique_ix = self.get_window_ix(X_windows, Y_time, Y_gf)
+
+        if self.bucket_pool_size and minibatch_size < n:
+            window_lengths = X_windows.window_lengths()
+        else:
+            window_lengths = None
+
+        if not optimize_memory and not use_dataset:
+            X, X_time, X_len, X_interleave = self.get_stored_windows(X_windows, Y_time, unique_ix)
 
             # impulse_names = self.impulse_names
             # stderr('Correlation matrix for input variables:\n')
@@ -3333,36 +3937,47 @@ class Model(object):
         with self.sess.as_default():
             with self.sess.graph.as_default():
                 self.run_convergence_check(verbose=False)
+                state = self.get_training_state()
 
-                if (self.global_step.eval(session=self.sess) < n_iter) and not self.has_converged():
+                if state['step'] < n_iter and not state['converged']:
                     self.set_training_complete(False)
 
                 if self.training_complete.eval(session=self.sess):
                     stderr('Model training is already complete; no additional updates to perform. To train for additional iterations, re-run fit() with a larger n_iter.\n\n')
                 else:
-                    if self.global_step.eval(session=self.sess) == 0:
+                    if state['step'] == 0:
                         if not type(self).__name__.startswith('CDRNN'):
-                            summary_params = self.sess.run(self.summary_params)
-                            self.writer.add_summary(summary_params, self.global_step.eval(session=self.sess))
+                            to_run = [self.summary_params]
                             if self.log_random and self.is_mixed_model:
-                                summary_random = self.sess.run(self.summary_random)
-                                self.writer.add_summary(summary_random, self.global_step.eval(session=self.sess))
+                                to_run.append(self.summary_random)
+                            for summary in self.sess.run(to_run):
+                                self.writer.add_summary(summary, state['step'])
                             self.writer.flush()
                     else:
                         stderr('Resuming training from most recent checkpoint...\n\n')
 
-                    if self.global_step.eval(session=self.sess) == 0:
+                    if state['step'] == 0:
                         stderr('Saving initial weights...\n')
                         self.save()
 
-                    while not self.has_converged() and self.global_step.eval(session=self.sess) < n_iter:
-                        p, p_inv = get_random_permutation(n)
+                    while not state['converged'] and state['step'] < n_iter:
+                        if chunk_ix is None:
+                            p, p_inv = get_random_permutation(n)
+                        else:
+                            p, p_inv = get_chunked_random_permutation(chunk_ix)
+                        if window_lengths is not None:
+                            p, p_inv = get_bucketed_random_permutation(
+                                window_lengths,
+                                minibatch_size,
+                                self.bucket_pool_size,
+                                p=p
+                            )
                         t0_iter = pytime.time()
                         stderr('-' * 50 + '\n')
-                        stderr('Iteration %d\n' % int(self.global_step.eval(session=self.sess) + 1))
+                        stderr('Iteration %d\n' % int(state['step'] + 1))
                         stderr('\n')
-                        if self.optim_name is not None and self.lr_decay_family is not None:
-                            stderr('Learning rate: %s\n' %self.lr.eval(session=self.sess))
+                        if 'lr' in state:
+                            stderr('Learning rate: %s\n' % state['lr'])
 
                         pb = tf.contrib.keras.utils.Progbar(n_minibatch)
 
@@ -3373,53 +3988,92 @@ class Model(object):
                         if self.loss_filter_n_sds:
                             n_dropped = 0.
 
+                        if use_dataset:
+                            self.sess.run(
+                                self.dataset_iterator.initializer,
+                                feed_dict=self.dataset_feed_dict(
+                                    X_windows,
+                                    Y,
+                                    Y_time,
+                                    Y_mask,
+                                    Y_gf,
+                                    p,
+                                    minibatch_size
+                                )
+                            )
+                        else:
+                            batches = [self.get_window_batch(window_ix, unique_ix, p[i:i + minibatch_size]) for i in range(0, n, minibatch_size)]
+                            if optimize_memory:
+                                X_batches = prefetch(
+                                    lambda ix: X_windows.get(ix, compact=True, trim=self.trim_history, float_type=self.storage_float_type),
+                                    [x[1] for x in batches],
+                                    depth=self.prefetch_depth
+                                )
+
+                        t_session = 0.
+                        t0_train = pytime.time()
                         for i in range(0, n, minibatch_size):
                             indices = p[i:i+minibatch_size]
-                            if optimize_memory:
+                            if use_dataset:
+                                fd = {
+                                    self.use_dataset: True,
+                                    self.X_file_ix: X_windows.file_ix,
+                                    self.training: not self.predict_mode
+                                }
+                            elif optimize_memory:
+                                w, rows, window_fd = batches[i // minibatch_size]
                                 _Y = Y[indices]
-                                _first_obs = [x[indices] for x in first_obs]
-                                _last_obs = [x[indices] for x in last_obs]
-                                _Y_time = Y_time[indices]
+                                _Y_time = Y_time[rows]
                                 _Y_mask = Y_mask[indices]
-                                _Y_gf = None if Y_gf is None else Y_gf[indices]
-                                _X_in_Y = None if X_in_Y is None else X_in_Y[indices]
-                                _X, _X_time, _X_mask = build_CDR_impulse_data(
-                                    X_in,
-                                    _first_obs,
-                                    _last_obs,
-                                    X_in_Y_names=X_in_Y_names,
-                                    X_in_Y=_X_in_Y,
-                                    history_length=self.history_length,
-                                    future_length=self.future_length,
-                                    impulse_names=self.impulse_names,
-                                    int_type=self.int_type,
-                                    float_type=self.float_type,
-                                )
+                                _Y_gf = None if Y_gf is None else Y_gf[rows]
+                                _X, _X_time, _X_len = next(X_batches)
                                 fd = {
                                     self.X: _X,
-                                    self.X_time: _X_time,
-                                    self.X_mask: _X_mask,
+                                    self.X_time_file: _X_time,
+                                    self.X_len: _X_len,
+                                    self.X_file_ix: X_windows.file_ix,
                                     self.Y: _Y,
                                     self.Y_time: _Y_time,
                                     self.Y_mask: _Y_mask,
                                     self.Y_gf: _Y_gf,
                                     self.training: not self.predict_mode
                                 }
+                                fd.update(self.interleave_feed(_X_time, X_windows.file_ix))
+                                fd.update(window_fd)
                             else:
+                                w, rows, window_fd = batches[i // minibatch_size]
+                                _X, _X_time, _X_len = X[w], X_time[w], X_len[w]
+                                if self.trim_history:
+                                    _X, _X_time, _X_len = trim_compact_windows(_X, _X_time, _X_len)
+                                _X_time = self.restore_time_offsets(_X_time, _X_len, Y_time[rows])
                                 fd = {
-                                    self.X: X[indices],
-                                    self.X_time: X_time[indices],
-                                    self.X_mask: X_mask[indices],
+                                    self.X: _X,
+                                    self.X_time_file: _X_time,
+                                    self.X_len: _X_len,
+                                    self.X_file_ix: X_windows.file_ix,
                                     self.Y: Y[indices],
-                                    self.Y_time: Y_time[indices],
+                                    self.Y_time: Y_time[rows],
                                     self.Y_mask: Y_mask[indices],
-                                    self.Y_gf: None if Y_gf is None else Y_gf[indices],
+                                    self.Y_gf: None if Y_gf is None else Y_gf[rows],
                                     self.training: not self.predict_mode
                                 }
-
-                            info_dict = self.run_train_step(fd)
-
-                            self.check_numerics()
+                                fd.update(self.interleave_feed(_X_time, X_windows.file_ix, None if self.trim_history else X_interleave, w))
+                                fd.update(window_fd)
+
+                            t0_session = pytime.time()
+                            if use_dataset and self.steps_per_run > 1:
+                                # Run the next steps_per_run minibatches from the input pipeline at once
+                                j = (i // minibatch_size) % self.steps_per_run
+                                if j == 0:
+                                    info_dicts = self.run_train_steps(
+                                        fd,
+                                        min(self.steps_per_run, n_minibatch - i // minibatch_size),
+                                        check_numerics=True
+                                    )
+                                info_dict = info_dicts[j]
+                            else:
+                                info_dict = self.run_train_step(fd, check_numerics=True)
+                            t_session += pytime.time() - t0_session
 
                             if self.loss_filter_n_sds:
                                 n_dropped += info_dict['n_dropped']
@@ -3445,12 +4099,17 @@ class Model(object):
                             #     self.save()
                             #     self.make_plots(prefix='plt')
 
-                        self.sess.run(self.incr_global_step)
+                        t1_train = pytime.time()
+
+                        step = self.sess.run(self.incr_global_step)
 
                         if self.check_convergence:
-                            self.run_convergence_check(verbose=False, feed_dict={self.loss_total: loss_total/n_minibatch})
+                            proportion_converged = self.run_convergence_check(
+                                verbose=False,
+                                feed_dict={self.loss_total: loss_total/n_minibatch}
+                            )[5]
 
-                        if self.log_freq > 0 and self.global_step.eval(session=self.sess) % self.log_freq == 0:
+                        if self.log_freq > 0 and step % self.log_freq == 0:
                             loss_total /= n_minibatch
                             reg_loss_total /= n_minibatch
                             log_fd = {self.loss_total: loss_total, self.reg_loss_total: reg_loss_total}
@@ -3459,23 +4118,33 @@ class Model(object):
                                 log_fd[self.kl_loss_total] = kl_loss_total
                             if self.loss_filter_n_sds:
                                 log_fd[self.n_dropped_in] = n_dropped
-                            summary_train_loss = self.sess.run(self.summary_opt, feed_dict=log_fd)
-                            self.writer.add_summary(summary_train_loss, self.global_step.eval(session=self.sess))
-                            summary_params = self.sess.run(self.summary_params)
-                            self.writer.add_summary(summary_params, self.global_step.eval(session=self.sess))
+                            to_run = [self.summary_opt, self.summary_params]
                             if self.log_random and self.is_mixed_model:
-                                summary_random = self.sess.run(self.summary_random)
-                                self.writer.add_summary(summary_random, self.global_step.eval(session=self.sess))
+                                to_run.append(self.summary_random)
+                            for summary in self.sess.run(to_run, feed_dict=log_fd):
+                                self.writer.add_summary(summary, step)
                             self.writer.flush()
 
-                        if self.save_freq > 0 and self.global_step.eval(session=self.sess) % self.save_freq == 0:
+                        if self.save_freq > 0 and step % self.save_freq == 0:
                             self.save()
                             self.make_plots(prefix='plt')
 
                         t1_iter = pytime.time()
                         if self.check_convergence:
-                            stderr('Convergence:    %.2f%%\n' % (100 * self.sess.run(self.proportion_converged) / self.convergence_alpha))
+                            stderr('Convergence:    %.2f%%\n' % (100 * proportion_converged / self.convergence_alpha))
                         stderr('Iteration time: %.2fs\n' % (t1_iter - t0_iter))
+                        stderr('Throughput:     %.1f samples/s (%s)\n' % (
+                            n / max(t1_train - t0_train, 1e-8),
+                            'tf.data' if use_dataset else 'feed_dict'
+                        ))
+                        stderr('Host time:      %.2fms/minibatch outside session calls\n' % (
+                            1000 * (t1_train - t0_train - t_session) / n_minibatch
+                        ))
+                        rss, rss_peak = get_rss()
+                        if rss is not None:
+                            stderr('Memory (RSS):   %.2f GB (peak %.2f GB)\n' % (rss / 1024 ** 3, (rss_peak or rss) / 1024 ** 3))
+
+                        state = self.get_training_state()
 
                     self.save()
 
@@ -3532,6 +4201,7 @@ class Model(object):
                     self.set_training_complete(True)
 
                     self.save()
+                    self.flush_saves()
 
     def predict(
             self,
@@ -3596,7 +4266,7 @@ class Model(object):
         :param extra_cols: ``bool``; whether to include columns from **Y** in output tables. Ignored unless **dump** is ``True``.
         :param partition: ``str`` or ``None``; name of data partition (or ``None`` if no partition name), used for output file naming. Ignored unless **dump** is ``True``.
         :param verbose: ``bool``; Report progress and metrics to standard error.
-        :param optimize_memory: ``bool``; Compute expanded impulse arrays on the fly rather than pre-computing. Can reduce memory consumption by orders of magnitude but adds computational overhead at each minibatch, slowing training (typically around 1.5-2x the unoptimized training time).
+        :param optimize_memory: ``bool``; Compute expanded impulse arrays on the fly rather than pre-computing. Can reduce memory consumption by orders of magnitude at the cost of a vectorized gather from the source impulse tables at each minibatch.
         :return: 1D ``numpy`` array; mean network predictions for regression targets (same length and sort order as ``y_time``).
         """
 
@@ -3652,19 +4322,25 @@ class Model(object):
             gf_map=self.rangf_map
         )
 
+        X_windows = get_impulse_windows(
+            X_in,
+            first_obs,
+            last_obs,
+            X_in_Y_names=X_in_Y_names,
+            X_in_Y=X_in_Y,
+            history_length=self.history_length,
+            future_length=self.future_length,
+            impulse_names=self.impulse_names,
+            int_type=self.int_type,
+            float_type=self.float_type,
+        )
+
+        plan = self.plan_memory(X_windows, optimize_memory=optimize_memory, verbose=verbose)
+        optimize_memory = plan['optimize_memory']
+        window_ix, unique_ix = self.get_window_ix(X_windows, Y_time, Y_gf, verbose=verbose)
+
         if not optimize_memory:
-            X, X_time, X_mask = build_CDR_impulse_data(
-                X_in,
-                first_obs,
-                last_obs,
-                X_in_Y_names=X_in_Y_names,
-                X_in_Y=X_in_Y,
-                history_length=self.history_length,
-                future_length=self.future_length,
-                impulse_names=self.impulse_names,
-                int_type=self.int_type,
-                float_type=self.float_type,
-            )
+            X, X_time, X_len, X_interleave = self.get_stored_windows(X_windows, Y_time, unique_ix)
 
         if return_preds or return_loglik:
             with self.sess.as_default():
@@ -3684,53 +4360,58 @@ class Model(object):
                     if return_loglik:
                         out['log_lik'] = {x: np.zeros((n,)) for x in responses}
 
-                    B = self.eval_minibatch_size
+                    B = plan['eval_minibatch_size']
                     n_eval_minibatch = math.ceil(n / B)
+                    batches = [self.get_window_batch(window_ix, unique_ix, slice(i, i + B)) for i in range(0, n, B)]
+                    if optimize_memory:
+                        X_batches = prefetch(
+                            lambda ix: X_windows.get(ix, compact=True, trim=self.trim_history, float_type=self.storage_float_type),
+                            [x[1] for x in batches],
+                            depth=self.prefetch_depth
+                        )
+
                     for i in range(0, n, B):
+                        w, rows, window_fd = batches[i // B]
                         if verbose:
                             stderr('\rMinibatch %d/%d' %((i/B)+1, n_eval_minibatch))
                         if optimize_memory:
                             _Y = None if Y is None else Y[i:i + B]
-                            _first_obs = [x[i:i + B] for x in first_obs]
-                            _last_obs = [x[i:i + B] for x in last_obs]
-                            _Y_time = Y_time[i:i + B]
+                            _Y_time = Y_time[rows]
                             _Y_mask = Y_mask[i:i + B]
-                            _Y_gf = None if Y_gf is None else Y_gf[i:i + B]
-                            _X_in_Y = None if X_in_Y is None else X_in_Y[i:i + B]
-
-                            _X, _X_time, _X_mask = build_CDR_impulse_data(
-                                X_in,
-                                _first_obs,
-                                _last_obs,
-                                X_in_Y_names=X_in_Y_names,
-                                X_in_Y=_X_in_Y,
-                                history_length=self.history_length,
-                                future_length=self.future_length,
-                                impulse_names=self.impulse_names,
-                                int_type=self.int_type,
-                                float_type=self.float_type,
-                            )
+                            _Y_gf = None if Y_gf is None else Y_gf[rows]
+
+                            _X, _X_time, _X_len = next(X_batches)
                             fd = {
                                 self.X: _X,
-                                self.X_time: _X_time,
-                                self.X_mask: _X_mask,
+                                self.X_time_file: _X_time,
+                                self.X_len: _X_len,
+                                self.X_file_ix: X_windows.file_ix,
                                 self.Y_time: _Y_time,
                                 self.Y_mask: _Y_mask,
                                 self.Y_gf: _Y_gf,
                                 self.training: not self.predict_mode
                             }
+                            fd.update(self.interleave_feed(_X_time, X_windows.file_ix))
+                            fd.update(window_fd)
                             if return_loglik:
                                 fd[self.Y] = _Y
                                 fd[self.Y_mask]: _Y_mask
                         else:
+                            _X, _X_time, _X_len = X[w], X_time[w], X_len[w]
+                            if self.trim_history:
+                                _X, _X_time, _X_len = trim_compact_windows(_X, _X_time, _X_len)
+                            _X_time = self.restore_time_offsets(_X_time, _X_len, Y_time[rows])
                             fd = {
-                                self.X: X[i:i + B],
-                                self.X_time: X_time[i:i + B],
-                                self.X_mask: X_mask[i:i + B],
-                                self.Y_time: Y_time[i:i + B],
-                                self.Y_gf: None if Y_gf is None else Y_gf[i:i + B],
+                                self.X: _X,
+                                self.X_time_file: _X_time,
+                                self.X_len: _X_len,
+                                self.X_file_ix: X_windows.file_ix,
+                                self.Y_time: Y_time[rows],
+                                self.Y_gf: None if Y_gf is None else Y_gf[rows],
                                 self.training: not self.predict_mode
                             }
+                            fd.update(self.interleave_feed(_X_time, X_windows.file_ix, None if self.trim_history else X_interleave, w))
+                            fd.update(window_fd)
                             if return_loglik:
                                 fd[self.Y] = Y[i:i + B]
                                 fd[self.Y_mask]: Y_mask[i:i + B]
@@ -3861,9 +4542,9 @@ class Model(object):
 
                         out = {}
                         if return_preds:
-                            out['preds'] = {x: np.zeros((len(feed_dict[self.Y_time]), n_samples)) for x in to_run_preds}
+                            out['preds'] = {x: np.zeros((self.get_feed_batch_size(feed_dict), n_samples)) for x in to_run_preds}
                         if return_loglik:
-                            out['log_lik'] = {x: np.zeros((len(feed_dict[self.Y_time]), n_samples)) for x in
+                            out['log_lik'] = {x: np.zeros((self.get_feed_batch_size(feed_dict), n_samples)) for x in
                                               to_run_loglik}
 
                         for i in range(n_samples):
@@ -4015,7 +4696,7 @@ class Model(object):
         :param dump: ``bool``; whether to save generated data and evaluations to disk.
         :param extra_cols: ``bool``; whether to include columns from **Y** in output tables. Ignored unless **dump** is ``True``.
         :param partition: ``str`` or ``None``; name of data partition (or ``None`` if no partition name), used for output file naming. Ignored unless **dump** is ``True``.
-        :param optimize_memory: ``bool``; Compute expanded impulse arrays on the fly rather than pre-computing. Can reduce memory consumption by orders of magnitude but adds computational overhead at each minibatch, slowing training (typically around 1.5-2x the unoptimized training time).
+        :param optimize_memory: ``bool``; Compute expanded impulse arrays on the fly rather than pre-computing. Can reduce memory consumption by orders of magnitude at the cost of a vectorized gather from the source impulse tables at each minibatch.
         :param verbose: ``bool``; Report progress and metrics to standard error.
         :return: pair of <``dict``, ``str``>; Dictionary of evaluation metrics, human-readable evaluation summary string.
         """
@@ -4254,7 +4935,7 @@ class Model(object):
         :param n_samples: ``int`` or ``None``; number of posterior samples to draw if Bayesian, ignored otherwise. If ``None``, use model defaults.
         :param algorithm: ``str``; algorithm to use for extracting predictions, one of [``MAP``, ``sampling``].
         :param training: ``bool``; Whether to compute loss in training mode.
-        :param optimize_memory: ``bool``; Compute expanded impulse arrays on the fly rather than pre-computing. Can reduce memory consumption by orders of magnitude but adds computational overhead at each minibatch, slowing training (typically around 1.5-2x the unoptimized training time).
+        :param optimize_memory: ``bool``; Compute expanded impulse arrays on the fly rather than pre-computing. Can reduce memory consumption by orders of magnitude at the cost of a vectorized gather from the source impulse tables at each minibatch.
         :param verbose: ``bool``; Report progress and metrics to standard error.
         :return: ``numpy`` array of shape [len(X)], log likelihood of each data point.
         """
@@ -4286,19 +4967,25 @@ class Model(object):
             gf_map=self.rangf_map
         )
 
+        X_windows = get_impulse_windows(
+            X_in,
+            first_obs,
+            last_obs,
+            X_in_Y_names=X_in_Y_names,
+            X_in_Y=X_in_Y,
+            history_length=self.history_length,
+            future_length=self.future_length,
+            impulse_names=self.impulse_names,
+            int_type=self.int_type,
+            float_type=self.float_type,
+        )
+
+        plan = self.plan_memory(X_windows, optimize_memory=optimize_memory, verbose=verbose)
+        optimize_memory = plan['optimize_memory']
+        window_ix, unique_ix = self.get_window_ix(X_windows, Y_time, Y_gf, verbose=verbose)
+
         if not optimize_memory:
-            X, X_time, X_mask = build_CDR_impulse_data(
-                X_in,
-                first_obs,
-                last_obs,
-                X_in_Y_names=X_in_Y_names,
-                X_in_Y=X_in_Y,
-                history_length=self.history_length,
-                future_length=self.future_length,
-                impulse_names=self.impulse_names,
-                int_type=self.int_type,
-                float_type=self.float_type,
-            )
+            X, X_time, X_len, X_interleave = self.get_stored_windows(X_windows, Y_time, unique_ix)
 
         with self.sess.as_default():
             with self.sess.graph.as_default():
@@ -4307,58 +4994,61 @@ class Model(object):
                 if training is None:
                     training = not self.predict_mode
                     
-                B = self.eval_minibatch_size
+                B = plan['eval_minibatch_size']
                 n = sum([len(_Y) for _Y in Y])
                 n_minibatch = math.ceil(n / B)
                 loss = np.zeros((n,))
+                batches = [self.get_window_batch(window_ix, unique_ix, slice(i, i + B)) for i in range(0, n, B)]
+                if optimize_memory:
+                    X_batches = prefetch(
+                        lambda ix: X_windows.get(ix, compact=True, trim=self.trim_history, float_type=self.storage_float_type),
+                        [x[1] for x in batches],
+                        depth=self.prefetch_depth
+                    )
+
                 for i in range(0, n, B):
+                    w, rows, window_fd = batches[i // B]
                     if verbose:
                         stderr('\rMinibatch %d/%d' %(i+1, n_minibatch))
                     if optimize_memory:
                         _Y = Y[i:i + B]
-                        _first_obs = [x[i:i + B] for x in first_obs]
-                        _last_obs = [x[i:i + B] for x in last_obs]
-                        _Y_time = Y_time[i:i + B]
+                        _Y_time = Y_time[rows]
                         _Y_mask = Y_mask[i:i + B]
-                        _Y_gf = None if Y_gf is None else Y_gf[i:i + B]
-                        _X_in_Y = None if X_in_Y is None else X_in_Y[i:i + B]
-
-                        _X, _X_time, _X_mask = build_CDR_impulse_data(
-                            X_in,
-                            _first_obs,
-                            _last_obs,
-                            X_in_Y_names=X_in_Y_names,
-                            X_in_Y=_X_in_Y,
-                            history_length=self.history_length,
-                            future_length=self.future_length,
-                            impulse_names=self.impulse_names,
-                            int_type=self.int_type,
-                            float_type=self.float_type,
-                        )
-                        _Y = None if Y is None else [_y[i:i + B] for _y in Y]
-                        _Y_gf = None if Y_gf is None else Y_gf[i:i + B]
+                        _Y_gf = None if Y_gf is None else Y_gf[rows]
+
+                        _X, _X_time, _X_len = next(X_batches)
 
                         fd = {
                             self.X: _X,
-                            self.X_time: _X_time,
-                            self.X_mask: _X_mask,
+                            self.X_time_file: _X_time,
+                            self.X_len: _X_len,
+                            self.X_file_ix: X_windows.file_ix,
                             self.Y: _Y,
                             self.Y_time: _Y_time,
                             self.Y_mask: _Y_mask,
                             self.Y_gf: _Y_gf,
                             self.training: not self.predict_mode
                         }
+                        fd.update(self.interleave_feed(_X_time, X_windows.file_ix))
+                        fd.update(window_fd)
                     else:
+                        _X, _X_time, _X_len = X[w], X_time[w], X_len[w]
+                        if self.trim_history:
+                            _X, _X_time, _X_len = trim_compact_windows(_X, _X_time, _X_len)
+                        _X_time = self.restore_time_offsets(_X_time, _X_len, Y_time[rows])
                         fd = {
-                            self.X: X[i:i + B],
-                            self.X_time: X_time[i:i + B],
-                            self.X_mask: X_mask[i:i + B],
-                            self.Y_time: Y_time[i:i + B],
+                            self.X: _X,
+                            self.X_time_file: _X_time,
+                            self.X_len: _X_len,
+                            self.X_file_ix: X_windows.file_ix,
+                            self.Y_time: Y_time[rows],
                             self.Y_mask: Y_mask[i:i + B],
-                            self.Y_gf: None if Y_gf is None else Y_gf[i:i + B],
+                            self.Y_gf: None if Y_gf is None else Y_gf[rows],
                             self.Y: Y[i:i + B],
                             self.training: training
                         }
+                        fd.update(self.interleave_feed(_X_time, X_windows.file_ix, None if self.trim_history else X_interleave, w))
+                        fd.update(window_fd)
                     loss[i:i + B] = self.run_loss_op(
                         fd,
                         n_samples=n_samples,
@@ -4400,7 +5090,7 @@ class Model(object):
                     if verbose:
                         pb = tf.contrib.keras.utils.Progbar(n_samples)
 
-                    loss = np.zeros((len(feed_dict[self.Y_time]), n_samples))
+                    loss = np.zeros((self.get_feed_batch_size(feed_dict), n_samples))
 
                     for i in range(n_samples):
                         if self.resample_ops:
@@ -4471,7 +5161,7 @@ class Model(object):
         :param extra_cols: ``bool``; whether to include columns from **Y** in output tables.
         :param dump; ``bool``; whether to save generated log likelihood vectors to disk.
         :param partition: ``str`` or ``None``; name of data partition (or ``None`` if no partition name), used for output file naming. Ignored unless **dump** is ``True``.
-        :param optimize_memory: ``bool``; Compute expanded impulse arrays on the fly rather than pre-computing. Can reduce memory consumption by orders of magnitude but adds computational overhead at each minibatch, slowing training (typically around 1.5-2x the unoptimized training time).
+        :param optimize_memory: ``bool``; Compute expanded impulse arrays on the fly rather than pre-computing. Can reduce memory consumption by orders of magnitude at the cost of a vectorized gather from the source impulse tables at each minibatch.
         :param verbose: ``bool``; Report progress and metrics to standard error.
         :return: ``numpy`` array of shape [len(X)], log likelihood of each data point.
         """
@@ -4539,24 +5229,30 @@ class Model(object):
             gf_map=self.rangf_map
         )
 
+        X_windows = get_impulse_windows(
+            X_in,
+            first_obs,
+            last_obs,
+            X_in_Y_names=X_in_Y_names,
+            X_in_Y=X_in_Y,
+            history_length=self.history_length,
+            future_length=self.future_length,
+            impulse_names=self.impulse_names,
+            int_type=self.int_type,
+            float_type=self.float_type,
+        )
+
+        plan = self.plan_memory(X_windows, optimize_memory=optimize_memory, verbose=verbose)
+        optimize_memory = plan['optimize_memory']
+        window_ix, unique_ix = self.get_window_ix(X_windows, Y_time, Y_gf, verbose=verbose)
+
         if not optimize_memory or not np.isfinite(self.minibatch_size):
-            X, X_time, X_mask = build_CDR_impulse_data(
-                X_in,
-                first_obs,
-                last_obs,
-                X_in_Y_names=X_in_Y_names,
-                X_in_Y=X_in_Y,
-                history_length=self.history_length,
-                future_length=self.future_length,
-                impulse_names=self.impulse_names,
-                int_type=self.int_type,
-                float_type=self.float_type,
-            )
+            X, X_time, X_len, X_interleave = self.get_stored_windows(X_windows, Y_time, unique_ix)
 
         with self.sess.as_default():
             with self.sess.graph.as_default():
                 self.set_predict_mode(True)
-                B = self.eval_minibatch_size
+                B = plan['eval_minibatch_size']
                 n_eval_minibatch = math.ceil(n / B)
                 X_conv = {}
                 for _response in responses:
@@ -4567,49 +5263,54 @@ class Model(object):
                             X_conv[_response][_dim_name] = np.zeros(
                                 (n, len(self.terminal_names))
                             )
+                batches = [self.get_window_batch(window_ix, unique_ix, slice(i, i + B)) for i in range(0, n, B)]
+                if optimize_memory:
+                    X_batches = prefetch(
+                        lambda ix: X_windows.get(ix, compact=True, trim=self.trim_history, float_type=self.storage_float_type),
+                        [x[1] for x in batches],
+                        depth=self.prefetch_depth
+                    )
+
                 for i in range(0, n, B):
+                    w, rows, window_fd = batches[i // B]
                     if verbose:
                         stderr('\rMinibatch %d/%d' % ((i / B) + 1, n_eval_minibatch))
                     if optimize_memory:
                         _Y = None if Y is None else Y[i:i + B]
-                        _first_obs = [x[i:i + B] for x in first_obs]
-                        _last_obs = [x[i:i + B] for x in last_obs]
-                        _Y_time = Y_time[i:i + B]
+                        _Y_time = Y_time[rows]
                         _Y_mask = Y_mask[i:i + B]
-                        _Y_gf = None if Y_gf is None else Y_gf[i:i + B]
-                        _X_in_Y = None if X_in_Y is None else X_in_Y[i:i + B]
-
-                        _X, _X_time, _X_mask = build_CDR_impulse_data(
-                            X_in,
-                            _first_obs,
-                            _last_obs,
-                            X_in_Y_names=X_in_Y_names,
-                            X_in_Y=_X_in_Y,
-                            history_length=self.history_length,
-                            future_length=self.future_length,
-                            impulse_names=self.impulse_names,
-                            int_type=self.int_type,
-                            float_type=self.float_type,
-                        )
+                        _Y_gf = None if Y_gf is None else Y_gf[rows]
+
+                        _X, _X_time, _X_len = next(X_batches)
                         fd = {
                             self.X: _X,
-                            self.X_time: _X_time,
-                            self.X_mask: _X_mask,
+                            self.X_time_file: _X_time,
+                            self.X_len: _X_len,
+                            self.X_file_ix: X_windows.file_ix,
                             self.Y_time: _Y_time,
                             self.Y_mask: _Y_mask,
                             self.Y_gf: _Y_gf,
                             self.training: not self.predict_mode
                         }
+                        fd.update(self.interleave_feed(_X_time, X_windows.file_ix))
+                        fd.update(window_fd)
                     else:
+                        _X, _X_time, _X_len = X[w], X_time[w], X_len[w]
+                        if self.trim_history:
+                            _X, _X_time, _X_len = trim_compact_windows(_X, _X_time, _X_len)
+                        _X_time = self.restore_time_offsets(_X_time, _X_len, Y_time[rows])
                         fd = {
-                            self.X: X[i:i + B],
-                            self.X_time: X_time[i:i + B],
-                            self.X_mask: X_mask[i:i + B],
-                            self.Y_time: Y_time[i:i + B],
+                            self.X: _X,
+                            self.X_time_file: _X_time,
+                            self.X_len: _X_len,
+                            self.X_file_ix: X_windows.file_ix,
+                            self.Y_time: Y_time[rows],
                             self.Y_mask: Y_mask[i:i + B],
-                            self.Y_gf: None if Y_gf is None else Y_gf[i:i + B],
+                            self.Y_gf: None if Y_gf is None else Y_gf[rows],
                             self.training: not self.predict_mode
                         }
+                        fd.update(self.interleave_feed(_X_time, X_windows.file_ix, None if self.trim_history else X_interleave, w))
+                        fd.update(window_fd)
                     if verbose:
                         stderr('\rMinibatch %d/%d' % ((i / B) + 1, n_eval_minibatch))
                     _X_conv = self.run_conv_op(
@@ -4623,6 +5324,8 @@ class Model(object):
                     for _response in _X_conv:
                         for _dim_name in _X_conv[_response]:
                             _X_conv_batch = _X_conv[_response][_dim_name]
+                            if window_fd:
+                                _X_conv_batch = _X_conv_batch[window_fd[self.Y_window_ix]]
                             X_conv[_response][_dim_name][i:i + B] = _X_conv_batch
 
                 # Split into per-file predictions.
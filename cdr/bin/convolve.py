@@ -3,9 +3,9 @@ import sys
 import os
 import pandas as pd
 from cdr.config import Config
-from cdr.io import read_tabular_data
+from cdr.io import read_data, get_source_columns, clear_preprocessing_cache
 from cdr.formula import Formula
-from cdr.data import preprocess_data, filter_invalid_responses
+from cdr.data import filter_invalid_responses, ImpulseWindowStore, set_impulse_window_store
 from cdr.util import load_cdr, filter_models, get_partition_list, paths_from_partition_cliarg, stderr
 
 pd.options.mode.chained_assignment = None
@@ -24,13 +24,22 @@ if __name__ == '__main__':
     argparser.add_argument('-a', '--algorithm', type=str, default='MAP', help='Algorithm ("sampling" or "MAP") to use for extracting predictions.')
     argparser.add_argument('-A', '--ablated_models', action='store_true', help='Perform convolution using ablated models. Otherwise only convolves using the full model in each ablation set.')
     argparser.add_argument('-e', '--extra_cols', action='store_true', help='Whether to include columns from the response dataframe in the outputs.')
-    argparser.add_argument('-O', '--optimize_memory', action='store_true', help="Compute expanded impulse arrays on the fly rather than pre-computing. Can reduce memory consumption by orders of magnitude but adds computational overhead at each minibatch, slowing training (typically around 1.5-2x the unoptimized training time).")
+    argparser.add_argument('-O', '--optimize_memory', action='store_true', help="Compute expanded impulse arrays on the fly rather than pre-computing. Can reduce memory consumption by orders of magnitude at the cost of a vectorized gather from the source impulse tables at each minibatch.")
     argparser.add_argument('--cpu_only', action='store_true', help='Use CPU implementation even if GPU is available.')
+    argparser.add_argument('--no_cache', action='store_true', help='Do not read or write the preprocessed data cache in the output directory; always re-read and preprocess the input data.')
+    argparser.add_argument('--clear_cache', action='store_true', help='Delete the preprocessed data cache in the output directory before running.')
     args, unknown = argparser.parse_known_args()
 
     for path in args.config_paths:
         p = Config(path)
 
+        if args.no_cache:
+            cache_dir = None
+        else:
+            cache_dir = os.path.join(p.outdir, 'data_cache')
+        if args.clear_cache:
+            clear_preprocessing_cache(os.path.join(p.outdir, 'data_cache'))
+
         if not p.use_gpu_if_available or args.cpu_only:
             os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
 
@@ -46,6 +55,16 @@ if __name__ == '__main__':
                     cdr_models_new.append(model_name)
             cdr_models = cdr_models_new
 
+        if args.extra_cols:  # Extra output columns can use any column
+            columns = None
+        else:
+            columns = get_source_columns(
+                cdr_formula_list,
+                series_ids=p.series_ids,
+                split_ids=p.split_ids,
+                filters=p.filters
+            )
+
         evaluation_sets = []
         evaluation_set_partitions = []
         evaluation_set_names = []
@@ -60,28 +79,32 @@ if __name__ == '__main__':
             else:
                 partition_str = '-'.join(partitions)
                 X_paths, Y_paths = paths_from_partition_cliarg(partitions, p)
-            X, Y = read_tabular_data(
+            X, Y, select, X_in_Y_names = read_data(
                 X_paths,
                 Y_paths,
+                cdr_formula_list,
                 p.series_ids,
                 sep=p.sep,
                 categorical_columns=list(
-                    set(p.split_ids + p.series_ids + [v for x in cdr_formula_list for v in x.rangf]))
-            )
-            X, Y, select, X_in_Y_names = preprocess_data(
-                X,
-                Y,
-                cdr_formula_list,
-                p.series_ids,
+                    set(p.split_ids + p.series_ids + [v for x in cdr_formula_list for v in x.rangf])),
                 filters=p.filters,
                 history_length=p.history_length,
-                future_length=p.future_length
+                future_length=p.future_length,
+                columns=columns,
+                n_threads=p.n_threads,
+                n_workers=p.n_workers,
+                chunk_size=p.chunk_size,
+                cache_dir=cache_dir,
+                sparse_categorical=p.sparse_categorical
             )
             evaluation_sets.append((X, Y, select, X_in_Y_names))
             evaluation_set_partitions.append(partitions)
             evaluation_set_names.append(partition_str)
             evaluation_set_paths.append((X_paths, Y_paths))
 
+        # Share impulse windows across models convolved on the same data
+        set_impulse_window_store(ImpulseWindowStore())
+
         for d in range(len(evaluation_sets)):
             X, Y, select, X_in_Y_names = evaluation_sets[d]
             partition_str = evaluation_set_names[d]
@@ -10,9 +10,10 @@ from sklearn.metrics import f1_score
 pd.options.mode.chained_assignment = None
 
 from cdr.config import Config
-from cdr.io import read_tabular_data
+from cdr.io import read_data, get_source_columns, clear_preprocessing_cache
 from cdr.formula import Formula
-from cdr.data import add_responses, filter_invalid_responses, preprocess_data, compute_splitID, compute_partition, s, c, z, split_cdr_outputs
+from cdr.data import add_responses, filter_invalid_responses, compute_splitID, compute_partition, s, c, z, split_cdr_outputs, \
+    ImpulseWindowStore, set_impulse_window_store
 from cdr.util import mse, mae, percent_variance_explained
 from cdr.util import load_cdr, filter_models, get_partition_list, paths_from_partition_cliarg, stderr, sn
 from cdr.plot import plot_qq
@@ -108,12 +109,21 @@ if __name__ == '__main__':
     argparser.add_argument('-T', '--training_mode', action='store_true', help='Use training mode for prediction.')
     argparser.add_argument('-A', '--ablated_models', action='store_true', help='For two-step prediction from CDR models, predict from data convolved using the ablated model. Otherwise predict from data convolved using the full model.')
     argparser.add_argument('-e', '--extra_cols', action='store_true', help='For prediction from CDR models, dump prediction outputs and response metadata to a single csv.')
-    argparser.add_argument('-O', '--optimize_memory', action='store_true', help="Compute expanded impulse arrays on the fly rather than pre-computing. Can reduce memory consumption by orders of magnitude but adds computational overhead at each minibatch, slowing training (typically around 1.5-2x the unoptimized training time).")
+    argparser.add_argument('-O', '--optimize_memory', action='store_true', help="Compute expanded impulse arrays on the fly rather than pre-computing. Can reduce memory consumption by orders of magnitude at the cost of a vectorized gather from the source impulse tables at each minibatch.")
     argparser.add_argument('--cpu_only', action='store_true', help='Use CPU implementation even if GPU is available.')
+    argparser.add_argument('--no_cache', action='store_true', help='Do not read or write the preprocessed data cache in the output directory; always re-read and preprocess the input data.')
+    argparser.add_argument('--clear_cache', action='store_true', help='Delete the preprocessed data cache in the output directory before running.')
     args, unknown = argparser.parse_known_args()
 
     p = Config(args.config_path)
 
+    if args.no_cache:
+        cache_dir = None
+    else:
+        cache_dir = os.path.join(p.outdir, 'data_cache')
+    if args.clear_cache:
+        clear_preprocessing_cache(os.path.join(p.outdir, 'data_cache'))
+
     models = filter_models(p.model_list, args.models)
 
     model_cache = {}
@@ -130,6 +140,17 @@ if __name__ == '__main__':
     cdr_formula_list = [Formula(p.models[m]['formula']) for m in models if (m.startswith('CDR') or m.startswith('DTSR'))]
     cdr_formula_name_list = [m for m in p.model_list if (m.startswith('CDR') or m.startswith('DTSR'))]
 
+    if run_baseline or args.extra_cols:  # Baseline formulae and extra output columns can use any column
+        columns = None
+    else:
+        columns = get_source_columns(
+            cdr_formula_list,
+            series_ids=p.series_ids,
+            split_ids=p.split_ids,
+            filters=p.filters,
+            other=[p.models[m]['crossval_factor'] for m in models if p.models[m].get('crossval_factor')]
+        )
+
     evaluation_sets = []
     evaluation_set_partitions = []
     evaluation_set_names = []
@@ -144,21 +165,22 @@ if __name__ == '__main__':
         else:
             partition_str = '-'.join(partitions)
             X_paths, Y_paths = paths_from_partition_cliarg(partitions, p)
-        X, Y = read_tabular_data(
+        X, Y, select, X_in_Y_names = read_data(
             X_paths,
             Y_paths,
-            p.series_ids,
-            sep=p.sep,
-            categorical_columns=list(set(p.split_ids + p.series_ids + [v for x in cdr_formula_list for v in x.rangf]))
-        )
-        X, Y, select, X_in_Y_names = preprocess_data(
-            X,
-            Y,
             cdr_formula_list,
             p.series_ids,
+            sep=p.sep,
+            categorical_columns=list(set(p.split_ids + p.series_ids + [v for x in cdr_formula_list for v in x.rangf])),
             filters=p.filters,
             history_length=p.history_length,
-            future_length=p.future_length
+            future_length=p.future_length,
+            columns=columns,
+            n_threads=p.n_threads,
+            n_workers=p.n_workers,
+            chunk_size=p.chunk_size,
+            cache_dir=cache_dir,
+            sparse_categorical=p.sparse_categorical
         )
         evaluation_sets.append((X, Y, select, X_in_Y_names))
         evaluation_set_partitions.append(partitions)
@@ -225,6 +247,9 @@ if __name__ == '__main__':
             X_baseline = py2ri(X_baseline)
             evaluation_set_baselines.append(X_baseline)
 
+    # Share impulse windows across models evaluated on the same data
+    set_impulse_window_store(ImpulseWindowStore())
+
     for d in range(len(evaluation_sets)):
         X, Y, select, X_in_Y_names = evaluation_sets[d]
         partition_str = evaluation_set_names[d]
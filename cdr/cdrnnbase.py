@@ -9,6 +9,7 @@ import tensorflow as tf
 from .kwargs import CDRNN_INITIALIZATION_KWARGS
 from .backend import *
 from .base import Model
+from .data import get_interleave_indices
 from .util import *
 
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
@@ -984,61 +985,52 @@ class CDRNN(Model):
                 # Handle multiple impulse streams with different timestamps
                 # by interleaving the impulses in temporal order
                 if self.n_impulse_df > 1:
-                    X_cdrnn = []
-                    t_delta_cdrnn = []
-                    X_time_cdrnn = []
-                    X_mask_cdrnn = []
-
                     X_shape = tf.shape(X)
                     B = X_shape[0]
                     T = X_shape[1]
 
+                    # Column holding the timestamps (and mask) of each stream, and mask of its impulse dimensions
+                    stream_col = np.array([ix[0] for ix in self.impulse_indices], dtype=self.INT_NP)
+                    stream_dim_mask = np.zeros((self.n_impulse_df, len(self.impulse_names)), dtype=self.FLOAT_NP)
                     for i, ix in enumerate(self.impulse_indices):
-                        dim_mask = np.zeros(len(self.impulse_names))
-                        dim_mask[ix] = 1
-                        while len(dim_mask.shape) < len(X.shape):
-                            dim_mask = dim_mask[None, ...]
-                        X_cur = X * dim_mask
-
-                        if t_delta.shape[-1] > 1:
-                            t_delta_cur = t_delta[..., ix[0]:ix[0]+1]
-                        else:
-                            t_delta_cur = t_delta
-
-                        if X_time.shape[-1] > 1:
-                            _X_time = X_time[..., ix[0]:ix[0]+1]
-                        else:
-                            _X_time = X_time
-
-                        if X_mask is not None and X_mask.shape[-1] > 1:
-                            _X_mask = X_mask[..., ix[0]]
-                        else:
-                            _X_mask = X_mask
-
-                        X_cdrnn.append(X_cur)
-                        t_delta_cdrnn.append(t_delta_cur)
-                        X_time_cdrnn.append(_X_time)
-                        if X_mask is not None:
-                            X_mask_cdrnn.append(_X_mask)
+                        stream_dim_mask[i, ix] = 1
 
-                    X_cdrnn = tf.concat(X_cdrnn, axis=1)
-                    t_delta_cdrnn = tf.concat(t_delta_cdrnn, axis=1)
-                    X_time_cdrnn = tf.concat(X_time_cdrnn, axis=1)
-                    if X_mask is not None:
-                        X_mask_cdrnn = tf.concat(X_mask_cdrnn, axis=1)
+                    # Order of the steps of all streams (concatenated over time) in temporal order. Normally
+                    # precomputed and fed with the data (see get_interleave_ix()), so the in-graph sort is skipped.
+                    if X_time.shape[-1] > 1:
+                        X_time_stream = tf.concat([X_time[..., i] for i in stream_col], axis=1)
+                    else:
+                        X_time_stream = tf.tile(X_time[..., 0], [1, self.n_impulse_df])
+                    self.X_interleave_ix = tf.placeholder_with_default(
+                        tf.contrib.framework.argsort(X_time_stream, axis=1),
+                        shape=[None, None],
+                        name='X_interleave_ix'
+                    )
 
-                    sort_ix = tf.contrib.framework.argsort(tf.squeeze(X_time_cdrnn, axis=-1), axis=1)
+                    # Gather each interleaved step from its stream directly, rather than sorting masked copies of X
+                    stream_ix = self.X_interleave_ix // T
+                    step_ix = self.X_interleave_ix % T
                     B_ix = tf.tile(
                         tf.range(B)[..., None],
                         [1, T * self.n_impulse_df]
                     )
-                    gather_ix = tf.stack([B_ix, sort_ix], axis=-1)
+                    gather_ix = tf.stack([B_ix, step_ix], axis=-1)
+                    col_ix = tf.gather(stream_col, stream_ix)
 
-                    X = tf.gather_nd(X_cdrnn, gather_ix)
-                    t_delta = tf.gather_nd(t_delta_cdrnn, gather_ix)
-                    X_time = tf.gather_nd(X_time_cdrnn, gather_ix)
+                    X = tf.gather_nd(X, gather_ix) * tf.gather(stream_dim_mask, stream_ix)
+                    if t_delta.shape[-1] > 1:
+                        t_delta = tf.gather_nd(t_delta, tf.stack([B_ix, step_ix, col_ix], axis=-1))[..., None]
+                    else:
+                        t_delta = tf.gather_nd(t_delta, gather_ix)
+                    if X_time.shape[-1] > 1:
+                        X_time = tf.gather_nd(X_time, tf.stack([B_ix, step_ix, col_ix], axis=-1))[..., None]
+                    else:
+                        X_time = tf.gather_nd(X_time, gather_ix)
                     if X_mask is not None:
-                        X_mask = tf.gather_nd(X_mask_cdrnn, gather_ix)
+                        if X_mask.shape[-1] > 1:
+                            X_mask = tf.gather_nd(X_mask, tf.stack([B_ix, step_ix, col_ix], axis=-1))
+                        else:
+                            X_mask = tf.gather_nd(X_mask[..., 0], gather_ix)
                 else:
                     t_delta = t_delta[..., :1]
                     X_time = X_time[..., :1]
@@ -1519,6 +1511,19 @@ class CDRNN(Model):
         self._initialize_nn()
         self._compile_random_effects()
 
+    def get_interleave_ix(self, X_time, file_ix):
+        if self.n_impulse_df > 1:
+            return get_interleave_indices(X_time, [file_ix[ix[0]] for ix in self.impulse_indices])
+        return None
+
+    def activation_units(self):
+        units = [self.n_impulse, self.n_units_hidden_state]
+        for x in self.n_units_input_projection + self.n_units_rnn + self.n_units_rnn_projection + (self.n_units_irf or []):
+            if isinstance(x, int):
+                units.append(x)
+        # Each layer computes pre-activations and activations
+        return 2 * sum(units)
+
     def report_settings(self, indent=0):
         out = super(CDRNN, self).report_settings(indent=indent)
         for kwarg in CDRNN_INITIALIZATION_KWARGS:
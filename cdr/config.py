@@ -1,6 +1,7 @@
 import sys
 import os
 import shutil
+import multiprocessing
 from itertools import chain, combinations
 if sys.version_info[0] == 2:
     import ConfigParser as configparser
@@ -81,6 +82,14 @@ class Config(object):
 
         self.history_length = data.getint('history_length', 128)
         self.future_length = data.getint('future_length', 0)
+        try:
+            n_cpu = multiprocessing.cpu_count()
+        except NotImplementedError:
+            n_cpu = 1
+        self.n_threads = data.getint('n_threads', min(8, n_cpu))
+        self.n_workers = data.getint('n_workers', 1)
+        self.chunk_size = data.getint('chunk_size', None)
+        self.sparse_categorical = data.getboolean('sparse_categorical', False)
 
         self.merge_cols = data.get('merge_cols', None)
         if self.merge_cols is not None:
@@ -1,6 +1,10 @@
 import re
+import copy
+import operator
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import numpy as np
 import pandas as pd
+import scipy.sparse
 from .util import names2ix, stderr
 
 op_finder = re.compile('([^()]+)\((.+)\) *')
@@ -429,76 +433,778 @@ def build_CDR_impulse_data(
     :return: triple of ``numpy`` arrays; let N, T, I, R respectively be the number of rows in **Y**, history length, number of impulse dimensions, and number of response dimensions. Outputs are (1) impulses with shape (N, T, I), (2) impulse timestamps with shape (N, T, I), and impulse mask with shape (N, T, I).
     """
 
-    # # Check prerequisites
-    # assert isinstance(X, list) and not [_X for _X in X if not isinstance(_X, pd.DataFrame)], "X must be a list of pandas DataFrames"
-    # assert isinstance(first_obs, list), "first_obs must be a list"
-    # assert isinstance(last_obs, list), "last_obs must be a list"
+    return ImpulseWindows(
+        X,
+        first_obs,
+        last_obs,
+        X_in_Y_names=X_in_Y_names,
+        X_in_Y=X_in_Y,
+        impulse_names=impulse_names,
+        history_length=history_length,
+        future_length=future_length,
+        int_type=int_type,
+        float_type=float_type
+    ).get()
 
-    if not (impulse_names):  # Empty (intercept-only) model
-        impulse_names = ['time']
 
-    # Process impulses
+def is_memmap(x):
+    """
+    Check whether an array is (a view of) a memory map, e.g. a column of a table loaded from a preprocessed store.
 
-    if X_in_Y_names is None:
-        X_in_Y_names = []
-    impulse_names_X = sorted(list(set(impulse_names).difference(set(X_in_Y_names))))
-    impulse_names_X_todo = set(impulse_names_X)
-    impulse_names_X_tmp = []
+    :param x: ``numpy`` array or other object.
+    :return: ``bool``; whether **x** is backed by a memory map.
+    """
 
-    X_2d = []
-    X_time_out = []
-    X_mask_out = []
+    while x is not None:
+        if isinstance(x, np.memmap):
+            return True
+        x = getattr(x, 'base', None)
 
-    window_length = history_length + future_length
+    return False
 
-    for i, _X in enumerate(X):
-        impulse_names_1d_cur = impulse_names_X_todo.intersection(set(_X.columns))
-        if len(impulse_names_1d_cur) > 0:
-            impulse_names_X_todo = impulse_names_X_todo - impulse_names_1d_cur
-            impulse_names_1d_cur = sorted(list(impulse_names_1d_cur))
-            impulse_names_X_tmp += impulse_names_1d_cur
-            _X_2d, _X_time_2d, _X_mask = expand_impulse_sequence(
-                _X[impulse_names_1d_cur],
-                _X.time,
-                first_obs[i],
-                last_obs[i],
-                window_length,
-                int_type=int_type,
-                float_type=float_type
-            )
-            X_2d.append(_X_2d)
-            X_time_out.append(_X_time_2d)
-            X_mask_out.append(_X_mask)
 
-    assert len(impulse_names_X_todo) == 0, 'Not all impulses were processed during CDR data array construction. Remaining impulses: %s' % impulse_names_X_todo
-    impulse_names_X = impulse_names_X_tmp
+class PaddedColumns(object):
+    """
+    Read-only view of a list of columns as a table with a leading padding row of zeros, in the layout used by
+    ``ImpulseWindows`` (row ``k`` of the columns is row ``k + 1`` of the view).
+    Supports the row gathers used by ``ImpulseWindows`` (``view[rows]`` and ``view[rows[..., None], cols]``), which read
+    the selected rows straight from the columns. When the columns are memory maps, the table is therefore never
+    copied into memory in full.
+
+    :param columns: ``list`` of ``numpy`` vectors; columns of equal length.
+    :param dtype: ``numpy`` dtype; dtype of gathered values.
+    :param vector: ``bool``; whether the view is a vector (**columns** must then have length 1) rather than a matrix.
+    """
 
-    X_out = np.concatenate(X_2d, axis=-1)
-    X_out = X_out[:,:,names2ix(impulse_names_X, impulse_names_X_tmp)]
-    X_time_out = np.concatenate(X_time_out, axis=-1)
-    X_mask_out = np.concatenate(X_mask_out, axis=-1)
+    def __init__(self, columns, dtype, vector=False):
+        assert not vector or len(columns) == 1, 'A vector view must have exactly one column.'
+        self.columns = columns
+        self.dtype = np.dtype(dtype)
+        self.vector = vector
+        self.n_rows = len(columns[0]) if columns else 0
+
+    def __len__(self):
+        return self.n_rows + 1
+
+    @property
+    def shape(self):
+        if self.vector:
+            return (self.n_rows + 1,)
+        return self.n_rows + 1, len(self.columns)
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            rows, cols = key
+            if not isinstance(rows, slice):
+                rows = np.asarray(rows)
+                if rows.ndim and rows.shape[-1] == 1:  # Rows given as view[rows[..., None], cols]
+                    rows = rows[..., 0]
+        else:
+            rows, cols = key, slice(None)
+        if isinstance(rows, slice):
+            rows = np.arange(self.n_rows + 1)[rows]
+        rows = np.asarray(rows)
+        cols = np.arange(len(self.columns))[cols]
+
+        out = np.zeros(rows.shape + (len(cols),), dtype=self.dtype)
+        if self.n_rows:
+            pad = rows == 0
+            src = np.where(pad, 0, rows - 1)
+            for k, j in enumerate(cols):
+                out[..., k] = self.columns[j][src]
+            out[pad] = 0
+        if self.vector:
+            out = out[..., 0]
+
+        return out
+
+
+class ImpulseWindows(object):
+    """
+    Lazily expanded impulse data for CDR fitting/evaluation.
+    Stores the flat impulse tables together with the time window of each response and builds the
+    (N, T, I) impulse, timestamp, and mask arrays required by the model for any subset of responses on demand,
+    using a single vectorized gather per impulse file.
+    Memory use is therefore proportional to the size of the source tables rather than to the size of the expanded arrays.
+    Source tables whose columns are memory maps (e.g. tables loaded from a preprocessed store, see ``cdr.io.read_data()``)
+    are not copied at all: windows are gathered straight from the memory maps (see ``PaddedColumns``), so only the
+    window bounds are held in memory.
+    Sparse impulse columns (e.g. sparse 1-hot expansions of categorical impulses, see ``Impulse.expand_categorical()``)
+    are stored as sparse matrices and gathered without densifying the source table.
 
-    if X_in_Y_names:
-        X_in_Y_shape = (X_out.shape[0], X_out.shape[1], len(X_in_Y_names))
-        _X_in_Y = np.zeros(X_in_Y_shape)
-        _X_in_Y[:, -1, :] = X_in_Y
-        X_out = np.concatenate([X_out, _X_in_Y], axis=2)
+    :param X: ``list`` of ``pandas`` tables; impulse (predictor) data.
+    :param first_obs: ``list`` of index vectors (``list``, ``pandas`` series, or ``numpy`` vector) of first observations; the list contains vectors of row indices, one for each element of **X**, of the first impulse in the time series associated with the response.
+    :param last_obs: ``list`` of index vectors (``list``, ``pandas`` series, or ``numpy`` vector) of last observations; the list contains vectors of row indices, one for each element of **X**, of the last impulse in the time series associated with the response.
+    :param X_in_Y_names: ``list`` of ``str``; names of predictors contained in **Y** rather than **X**. If ``None``, no such predictors.
+    :param X_in_Y: ``pandas`` ``DataFrame``, ``numpy`` array, or ``None``; table of predictors contained in **Y** rather than **X**. If ``None``, no such predictors.
+    :param impulse_names: ``list`` of ``str``; names of columns in **X** to be used as impulses by the model. If ``None``, all columns returned.
+    :param history_length: ``int``; maximum number of history (backward) observations.
+    :param future_length: ``int``; maximum number of future (forward) observations.
+    :param int_type: ``str``; name of int type.
+    :param float_type: ``str``; name of float type.
+    """
 
-        time_X_2d_new = np.zeros(X_in_Y_shape)
-        X_time_out = np.concatenate([X_time_out, time_X_2d_new], axis=2)
+    def __init__(
+            self,
+            X,
+            first_obs,
+            last_obs,
+            X_in_Y_names=None,
+            X_in_Y=None,
+            impulse_names=None,
+            history_length=128,
+            future_length=0,
+            int_type='int32',
+            float_type='float32'
+    ):
+        self.INT_NP = getattr(np, int_type)
+        self.FLOAT_NP = getattr(np, float_type)
+        self.window_length = history_length + future_length
+
+        if not (impulse_names):  # Empty (intercept-only) model
+            impulse_names = ['time']
+        self.impulse_names = impulse_names
+
+        if X_in_Y_names is None:
+            X_in_Y_names = []
+        impulse_names_X_todo = set(impulse_names).difference(set(X_in_Y_names))
+
+        # Each source table is stored with a leading padding row at index 0, so that padding cells
+        # in the expanded arrays can be filled by the same gather that retrieves the impulses.
+        self.values = []
+        self.times = []
+        self.first_obs = []
+        self.last_obs = []
+        self.impulse_ix = []
+        self.dense_names = []
+        self.dense_impulse_ix = []
+        self.value_ix = []
+        self.sparse_names = []
+        self.sparse_values = []
+        self.sparse_impulse_ix = []
+        for i, _X in enumerate(X):
+            impulse_names_cur = impulse_names_X_todo.intersection(set(_X.columns))
+            if len(impulse_names_cur) > 0:
+                impulse_names_X_todo = impulse_names_X_todo - impulse_names_cur
+                impulse_names_cur = sorted(list(impulse_names_cur))
+                sparse_names_cur = [x for x in impulse_names_cur if isinstance(_X[x].dtype, pd.SparseDtype)]
+                dense_names_cur = [x for x in impulse_names_cur if x not in sparse_names_cur]
+                dense_columns = [_X[x].values for x in dense_names_cur]
+                time_column = _X.time.values
+                if is_memmap(time_column) and all(is_memmap(x) for x in dense_columns):
+                    values = PaddedColumns(dense_columns, self.FLOAT_NP)
+                    times = PaddedColumns([time_column], self.FLOAT_NP, vector=True)
+                else:
+                    values = np.zeros((len(_X) + 1, len(dense_names_cur)), dtype=self.FLOAT_NP)
+                    values[1:] = _X[dense_names_cur]
+                    times = np.zeros((len(_X) + 1,), dtype=self.FLOAT_NP)
+                    times[1:] = _X.time
+                if sparse_names_cur:
+                    # Shift rows by one for the padding row
+                    coo = _X[sparse_names_cur].sparse.to_coo()
+                    sparse_values = scipy.sparse.csr_matrix(
+                        (coo.data.astype(self.FLOAT_NP), (coo.row + 1, coo.col)),
+                        shape=(len(_X) + 1, len(sparse_names_cur))
+                    )
+                else:
+                    sparse_values = None
+                self.values.append(values)
+                self.sparse_values.append(sparse_values)
+                self.times.append(times)
+                self.first_obs.append(np.array(first_obs[i], dtype=self.INT_NP))
+                self.last_obs.append(np.array(last_obs[i], dtype=self.INT_NP))
+                self.impulse_ix.append(names2ix(impulse_names_cur, impulse_names))
+                self.dense_names.append(dense_names_cur)
+                self.dense_impulse_ix.append(names2ix(dense_names_cur, impulse_names))
+                self.value_ix.append(None)
+                self.sparse_names.append(sparse_names_cur)
+                self.sparse_impulse_ix.append(names2ix(sparse_names_cur, impulse_names))
+
+        assert len(impulse_names_X_todo) == 0, 'Not all impulses were processed during CDR data array construction. Remaining impulses: %s' % impulse_names_X_todo
+
+        # Map from impulse dimensions to columns of the compact timestamp/length arrays (one column per impulse
+        # file, plus one for predictors contained in Y, which all share the same timestamps and mask).
+        self.file_ix = np.zeros((len(impulse_names),), dtype=self.INT_NP)
+        for i, impulse_ix in enumerate(self.impulse_ix):
+            self.file_ix[impulse_ix] = i
+
+        if X_in_Y_names:
+            self.X_in_Y_names = X_in_Y_names
+            self.X_in_Y = np.array(X_in_Y, dtype=self.FLOAT_NP)
+            self.X_in_Y_ix = names2ix(X_in_Y_names, impulse_names)
+            self.file_ix[self.X_in_Y_ix] = len(self.impulse_ix)
+        else:
+            self.X_in_Y_names = []
+            self.X_in_Y = None
+            self.X_in_Y_ix = None
+
+        # Full expansions returned by get(), retained if memoize is True (see ImpulseWindowStore)
+        self.memoize = False
+        self.expanded = {}
+        self.parent = None
+        self.parent_ix = None
+        self.parent_file_ix = None
+
+        if len(self.first_obs):
+            self.n = len(self.first_obs[0])
+        elif self.X_in_Y is not None:
+            self.n = len(self.X_in_Y)
+        else:
+            self.n = 0
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def n_files(self):
+        """
+        Number of columns in the compact timestamp/length arrays returned by ``get(compact=True)``.
+
+        :return: ``int``; number of impulse files used by the model, plus one if any predictors are contained in Y.
+        """
+
+        return len(self.impulse_ix) + int(self.X_in_Y is not None)
+
+    def expanded_nbytes(self, n=None, float_type=None):
+        """
+        Compute the size of the compact expansion returned by ``get(compact=True)``, without computing it.
+
+        :param n: ``int`` or ``None``; number of responses. If ``None``, all responses.
+        :param float_type: ``str`` or ``None``; name of float type of the impulses (see ``get()``). If ``None``, the float type of the windows.
+        :return: ``int``; size in bytes.
+        """
+
+        if n is None:
+            n = self.n
+        X_bytes = np.dtype(self.FLOAT_NP if float_type is None else getattr(np, float_type)).itemsize
+        T = self.window_length
+        out = n * T * len(self.impulse_names) * X_bytes
+        out += n * T * self.n_files * np.dtype(self.FLOAT_NP).itemsize
+        out += n * self.n_files * np.dtype(self.INT_NP).itemsize
+
+        return int(out)
+
+    def window_lengths(self, ix=None):
+        """
+        Compute the number of non-padding steps in the window of each response (maximum over impulse files).
+
+        :param ix: ``numpy`` vector of row indices, ``slice``, or ``None``; responses to compute lengths for. If ``None``, all responses.
+        :return: ``numpy`` vector; window length of each response selected by **ix**.
+        """
+
+        if ix is None:
+            ix = slice(None)
+        out = np.zeros((len(np.arange(self.n)[ix]),), dtype=self.INT_NP)
+        for first_obs, last_obs in zip(self.first_obs, self.last_obs):
+            out = np.maximum(out, np.clip(last_obs[ix] - first_obs[ix], 0, self.window_length))
+        if self.X_in_Y is not None:
+            out = np.maximum(out, 1)
+
+        return out
+
+    def deduplicate(self, keys=None):
+        """
+        Find responses with identical windows, e.g. responses from multiple response files that are sampled
+        at the same times in the same series. Windows are identical if their bounds in every impulse file
+        and their predictors contained in Y are identical.
+
+        :param keys: ``list`` of ``numpy`` arrays or ``None``; additional per-response values (e.g. response times) that must also be identical. Each array has the responses on its first axis.
+        :return: pair of ``numpy`` vectors; index of the distinct window of each response (shape (N,)), and the first response with each distinct window (shape (U,)), such that response i has the window of response **unique_ix** [**window_ix** [i]].
+        """
+
+        cols = self.first_obs + self.last_obs
+        if self.X_in_Y is not None:
+            cols.append(self.X_in_Y)
+        if keys is not None:
+            cols += list(keys)
+        key = np.concatenate([np.asarray(x, dtype='float64').reshape((self.n, -1)) for x in cols], axis=1)
+        key = np.ascontiguousarray(key).view(np.dtype((np.void, key.dtype.itemsize * key.shape[1]))).ravel()
+        _, unique_ix, window_ix = np.unique(key, return_index=True, return_inverse=True)
+
+        return window_ix.reshape(-1).astype(self.INT_NP), unique_ix.astype(self.INT_NP)
+
+    def get(self, ix=None, compact=False, trim=False, float_type=None):
+        """
+        Construct expanded impulse data arrays for a subset of responses.
+        If **compact** is ``True``, timestamps and masks are not expanded over impulse dimensions.
+        Instead, timestamps are returned once per impulse file and masks are encoded by their lengths, since within
+        a file all impulses share timestamps and the mask is a right-aligned run of ones.
+        Use **file_ix** to map impulse dimensions to file columns (see ``expand_compact_windows()``).
+
+        :param ix: ``numpy`` vector of row indices, ``slice``, or ``None``; responses to construct windows for. If ``None``, all responses.
+        :param compact: ``bool``; whether to return compact timestamp and mask encodings.
+        :param trim: ``bool``; whether to shorten the time dimension to the longest window among the selected responses, dropping leading steps that are padding for all of them.
+        :param float_type: ``str`` or ``None``; name of float type of the output impulses (e.g. a reduced storage precision). If ``None``, the float type of the windows. Timestamps and masks always use the float type of the windows.
+        :return: triple of ``numpy`` arrays; let B, T, I, F respectively be the number of responses selected by **ix**, history length, number of impulse dimensions, and ``n_files``. If **compact** is ``False``, outputs are (1) impulses with shape (B, T, I), (2) impulse timestamps with shape (B, T, I), and impulse mask with shape (B, T, I). Otherwise, outputs are (1) impulses with shape (B, T, I), (2) impulse timestamps with shape (B, T, F), and (3) integer window lengths with shape (B, F).
+        """
+
+        X_dtype = self.FLOAT_NP if float_type is None else getattr(np, float_type)
+        key = (compact, np.dtype(X_dtype).name)
+        full = ix is None and not trim
+        if full:
+            if key in self.expanded:
+                return self.expanded[key]
+            if self.parent is not None and key in self.parent.expanded:
+                X, X_time, X_len_or_mask = self.parent.expanded[key]
+                if compact:
+                    return X[..., self.parent_ix], X_time[..., self.parent_file_ix], X_len_or_mask[:, self.parent_file_ix]
+                return X[..., self.parent_ix], X_time[..., self.parent_ix], X_len_or_mask[..., self.parent_ix]
+
+        if ix is None:
+            ix = slice(None)
+        B = len(np.arange(self.n)[ix])
+        if trim:
+            T = max(int(self.window_lengths(ix).max(initial=0)), 1)
+        else:
+            T = self.window_length
+        shape = (B, T, len(self.impulse_names))
 
-        time_mask_new = np.zeros(X_in_Y_shape)
-        time_mask_new[:,-1,:] = 1.
-        X_mask_out = np.concatenate([X_mask_out, time_mask_new], axis=2)
+        X_out = np.zeros(shape, dtype=X_dtype)
+        if compact:
+            X_time_out = np.zeros((B, T, self.n_files), dtype=self.FLOAT_NP)
+            X_len_out = np.zeros((B, self.n_files), dtype=self.INT_NP)
+        else:
+            X_time_out = np.zeros(shape, dtype=self.FLOAT_NP)
+            X_mask_out = np.zeros(shape, dtype=self.FLOAT_NP)
+
+        for i, (values, sparse_values, times, first_obs, last_obs, impulse_ix) in enumerate(zip(
+                self.values,
+                self.sparse_values,
+                self.times,
+                self.first_obs,
+                self.last_obs,
+                self.impulse_ix
+        )):
+            gather_ix, mask = get_window_indices(first_obs[ix], last_obs[ix], T)
+            if self.value_ix[i] is None:
+                X_out[..., self.dense_impulse_ix[i]] = values[gather_ix]
+            else:
+                X_out[..., self.dense_impulse_ix[i]] = values[gather_ix[..., None], self.value_ix[i]]
+            if sparse_values is not None:
+                X_out[..., self.sparse_impulse_ix[i]] = sparse_values[gather_ix.ravel()].toarray().reshape(
+                    (B, T, sparse_values.shape[1])
+                )
+            if compact:
+                X_time_out[..., i] = times[gather_ix]
+                X_len_out[:, i] = mask.sum(axis=1)
+            else:
+                X_time_out[..., impulse_ix] = times[gather_ix][..., None]
+                X_mask_out[..., impulse_ix] = mask[..., None]
+
+        if self.X_in_Y is not None:
+            X_out[:, -1, self.X_in_Y_ix] = self.X_in_Y[ix]
+            if compact:
+                X_len_out[:, -1] = 1
+            else:
+                X_mask_out[:, -1, self.X_in_Y_ix] = 1.
+
+        if compact:
+            out = X_out, X_time_out, X_len_out
+        else:
+            out = X_out, X_time_out, X_mask_out
+        if full and self.memoize:
+            self.expanded[key] = out
+
+        return out
+
+    def subset(self, impulse_names):
+        """
+        Get the windows of a subset of the impulses (e.g. for an ablated model).
+        The result shares the source tables with this object, and if this object has memoized the full expansion
+        (see ``ImpulseWindowStore``), ``get()`` on the result selects its columns instead of expanding the windows again.
+
+        :param impulse_names: ``list`` of ``str``; names of impulses, all of which must be among ``impulse_names``.
+        :return: ``ImpulseWindows``; windows of **impulse_names**.
+        """
+
+        if not (impulse_names):  # Empty (intercept-only) model
+            impulse_names = ['time']
+        names = set(impulse_names)
+        assert names.issubset(set(self.impulse_names)), 'Impulses not found in windows: %s' % (names - set(self.impulse_names))
+
+        out = copy.copy(self)
+        out.impulse_names = impulse_names
+        for attr in ('values', 'times', 'first_obs', 'last_obs', 'impulse_ix', 'dense_names', 'dense_impulse_ix',
+                     'value_ix', 'sparse_names', 'sparse_values', 'sparse_impulse_ix'):
+            setattr(out, attr, [])
+        out.parent_file_ix = []
+        for i in range(len(self.values)):
+            dense_names_cur = [x for x in self.dense_names[i] if x in names]
+            sparse_names_cur = [x for x in self.sparse_names[i] if x in names]
+            if not (dense_names_cur or sparse_names_cur):
+                continue
+            value_ix = names2ix(dense_names_cur, self.dense_names[i])
+            if self.value_ix[i] is not None:
+                value_ix = self.value_ix[i][value_ix]
+            if sparse_names_cur:
+                sparse_values = self.sparse_values[i][:, names2ix(sparse_names_cur, self.sparse_names[i])]
+            else:
+                sparse_values = None
+            out.values.append(self.values[i])
+            out.times.append(self.times[i])
+            out.first_obs.append(self.first_obs[i])
+            out.last_obs.append(self.last_obs[i])
+            out.impulse_ix.append(names2ix(sorted(dense_names_cur + sparse_names_cur), impulse_names))
+            out.dense_names.append(dense_names_cur)
+            out.dense_impulse_ix.append(names2ix(dense_names_cur, impulse_names))
+            out.value_ix.append(value_ix)
+            out.sparse_names.append(sparse_names_cur)
+            out.sparse_values.append(sparse_values)
+            out.sparse_impulse_ix.append(names2ix(sparse_names_cur, impulse_names))
+            out.parent_file_ix.append(i)
+
+        out.file_ix = np.zeros((len(impulse_names),), dtype=self.INT_NP)
+        for i, impulse_ix in enumerate(out.impulse_ix):
+            out.file_ix[impulse_ix] = i
+
+        out.X_in_Y_names = [x for x in self.X_in_Y_names if x in names]
+        if out.X_in_Y_names:
+            out.X_in_Y = self.X_in_Y[:, names2ix(out.X_in_Y_names, self.X_in_Y_names)]
+            out.X_in_Y_ix = names2ix(out.X_in_Y_names, impulse_names)
+            out.file_ix[out.X_in_Y_ix] = len(out.impulse_ix)
+            out.parent_file_ix.append(len(self.impulse_ix))
+        else:
+            out.X_in_Y = None
+            out.X_in_Y_ix = None
+
+        out.memoize = False
+        out.expanded = {}
+        out.parent = self
+        out.parent_ix = names2ix(impulse_names, self.impulse_names)
+        out.parent_file_ix = np.array(out.parent_file_ix, dtype=self.INT_NP)
+
+        return out
+
+    def get_tables(self, float_type=None):
+        """
+        Stack the padded impulse tables into a single table for in-graph window expansion (e.g. by a ``tf.data`` pipeline).
+        Rows of each impulse file are placed after those of the preceding files, and window bounds are offset to match,
+        so that windows can be expanded for every file by one gather using the same indexing as ``get_window_indices()``.
+        Predictors contained in Y are stored as one additional file with a single row per response at time 0.
+        Sparse impulse columns are densified, and tables gathered from memory maps are copied into memory.
+
+        :param float_type: ``str`` or ``None``; name of float type of the output impulse values (e.g. a reduced storage precision). If ``None``, the float type of the windows.
+        :return: 5-tuple of ``numpy`` arrays; let M, I, N, and F respectively be the total number of impulse rows, number of impulse dimensions, number of responses, and ``n_files``. Outputs are (1) impulse values with shape (M + 1, I), (2) impulse timestamps with shape (M + 1,), (3) first observation indices with shape (N, F), (4) last observation indices with shape (N, F), and (5) **file_ix**. Row 0 of (1) and (2) is the padding row.
+        """
+
+        n_rows = sum([len(x) - 1 for x in self.times])
+        if self.X_in_Y is not None:
+            n_rows += self.n
+        values_out = np.zeros((n_rows + 1, len(self.impulse_names)), dtype=self.FLOAT_NP if float_type is None else getattr(np, float_type))
+        times_out = np.zeros((n_rows + 1,), dtype=self.FLOAT_NP)
+        first_obs_out = np.zeros((self.n, self.n_files), dtype=self.INT_NP)
+        last_obs_out = np.zeros((self.n, self.n_files), dtype=self.INT_NP)
+
+        offset = 0
+        for i, (values, sparse_values, times, first_obs, last_obs) in enumerate(zip(
+                self.values,
+                self.sparse_values,
+                self.times,
+                self.first_obs,
+                self.last_obs
+        )):
+            m = len(times) - 1
+            if self.value_ix[i] is None:
+                values_out[offset + 1:offset + m + 1, self.dense_impulse_ix[i]] = values[1:]
+            else:
+                values_out[offset + 1:offset + m + 1, self.dense_impulse_ix[i]] = values[1:, self.value_ix[i]]
+            if sparse_values is not None:
+                values_out[offset + 1:offset + m + 1, self.sparse_impulse_ix[i]] = sparse_values[1:].toarray()
+            times_out[offset + 1:offset + m + 1] = times[1:]
+            first_obs_out[:, i] = first_obs + offset
+            last_obs_out[:, i] = last_obs + offset
+            offset += m
+
+        if self.X_in_Y is not None:
+            values_out[offset + 1:offset + self.n + 1, self.X_in_Y_ix] = self.X_in_Y
+            first_obs_out[:, -1] = np.arange(self.n) + offset
+            last_obs_out[:, -1] = first_obs_out[:, -1] + 1
+
+        return values_out, times_out, first_obs_out, last_obs_out, self.file_ix
+
+    def storage_error(self, float_type):
+        """
+        Compute the rounding error incurred by storing the impulses in a given float type (see ``get()``).
+
+        :param float_type: ``str``; name of float type.
+        :return: pair of ``numpy`` vectors of shape (I,); maximum absolute rounding error and standard deviation of each impulse. The error is ``inf`` for impulses with values that overflow **float_type**.
+        """
+
+        FLOAT_NP = getattr(np, float_type)
+        err = np.zeros((len(self.impulse_names),))
+        sd = np.zeros((len(self.impulse_names),))
+        # One column at a time, to bound memory when the source tables are memory maps
+        tables = []
+        for i in range(len(self.values)):
+            value_ix = self.value_ix[i]
+            if value_ix is None:
+                value_ix = np.arange(len(self.dense_names[i]))
+            for j, k in zip(self.dense_impulse_ix[i], value_ix):
+                tables.append(([j], lambda values=self.values[i], k=k: values[1:, [k]]))
+            if self.sparse_values[i] is not None:
+                tables.append((self.sparse_impulse_ix[i], lambda values=self.sparse_values[i]: values[1:].toarray()))
+        if self.X_in_Y is not None:
+            tables.append((self.X_in_Y_ix, lambda: self.X_in_Y))
+
+        for impulse_ix, get_values in tables:
+            values = get_values()
+            if not len(values):
+                continue
+            values = values.astype('float64')
+            with np.errstate(over='ignore', invalid='ignore'):
+                e = np.abs(values.astype(FLOAT_NP).astype('float64') - values)
+            e = np.where(np.isfinite(values), e, 0)
+            err[impulse_ix] = e.max(axis=0)
+            sd[impulse_ix] = np.nanstd(values, axis=0)
+
+        return err, sd
+
+
+class ImpulseWindowStore(object):
+    """
+    Store of impulse windows shared by all models fit to or evaluated on the same data in one process
+    (e.g. the ablations, crossval folds, or CDR and CDRNN variants run by a single call to a CLI utility).
+    Entries are keyed by the source tables (by identity), the time windows of the responses, the history and future
+    lengths, and the int/float types. A request for a subset of the impulses of an entry gets a column view of
+    the entry (see ``ImpulseWindows.subset()``), so source tables are copied and windows expanded once per entry
+    rather than once per model. Full expansions computed by ``ImpulseWindows.get()`` are retained while the entry
+    is in the store.
+
+    :param max_entries: ``int``; maximum number of entries. Least recently used entries are evicted first.
+    """
+
+    def __init__(self, max_entries=2):
+        self.max_entries = max_entries
+        self.entries = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        """
+        Remove all entries.
+
+        :return: ``None``
+        """
+
+        self.entries = []
+
+    def get(
+            self,
+            X,
+            first_obs,
+            last_obs,
+            X_in_Y_names=None,
+            X_in_Y=None,
+            impulse_names=None,
+            history_length=128,
+            future_length=0,
+            int_type='int32',
+            float_type='float32'
+    ):
+        """
+        Get impulse windows, from the store if possible. Arguments are as for ``ImpulseWindows``.
+
+        :return: ``ImpulseWindows``; impulse windows.
+        """
+
+        if not (impulse_names):  # Empty (intercept-only) model
+            impulse_names = ['time']
+        if X_in_Y_names is None:
+            X_in_Y_names = []
+        first_obs = [np.asarray(x) for x in first_obs]
+        last_obs = [np.asarray(x) for x in last_obs]
+        settings = (history_length, future_length, int_type, float_type)
+
+        for k, entry in enumerate(self.entries):
+            windows = entry['windows']
+            if entry['settings'] != settings or len(entry['X']) != len(X):
+                continue
+            if not all(a is b for a, b in zip(entry['X'], X)):
+                continue
+            if not set(impulse_names).issubset(set(windows.impulse_names)):
+                continue
+            if any((x in X_in_Y_names) != (x in windows.X_in_Y_names) for x in impulse_names):
+                continue
+            if not all(np.array_equal(a, b) for a, b in zip(entry['first_obs'], first_obs)):
+                continue
+            if not all(np.array_equal(a, b) for a, b in zip(entry['last_obs'], last_obs)):
+                continue
+            if X_in_Y_names:
+                X_in_Y_cur = windows.X_in_Y[:, names2ix(X_in_Y_names, windows.X_in_Y_names)]
+                if not np.array_equal(X_in_Y_cur, np.asarray(X_in_Y, dtype=windows.FLOAT_NP), equal_nan=True):
+                    continue
+
+            self.entries.append(self.entries.pop(k))
+            if list(impulse_names) == list(windows.impulse_names):
+                return windows
+            return windows.subset(impulse_names)
+
+        windows = ImpulseWindows(
+            X,
+            first_obs,
+            last_obs,
+            X_in_Y_names=X_in_Y_names,
+            X_in_Y=X_in_Y,
+            impulse_names=impulse_names,
+            history_length=history_length,
+            future_length=future_length,
+            int_type=int_type,
+            float_type=float_type
+        )
+        windows.memoize = True
+        self.entries.append({
+            'X': list(X),
+            'first_obs': first_obs,
+            'last_obs': last_obs,
+            'settings': settings,
+            'windows': windows
+        })
+        if len(self.entries) > self.max_entries:
+            self.entries.pop(0)
+
+        return windows
+
+
+_impulse_window_store = None
+
+
+def set_impulse_window_store(store):
+    """
+    Set the impulse window store used by ``get_impulse_windows()`` in this process.
+
+    :param store: ``ImpulseWindowStore`` or ``None``; store. If ``None``, windows are not shared across models.
+    :return: ``None``
+    """
+
+    global _impulse_window_store
+    _impulse_window_store = store
 
-    # Ensure that impulses are properly aligned
-    impulse_names_cur = impulse_names_X + X_in_Y_names
-    ix = names2ix(impulse_names, impulse_names_cur)
-    X_out = X_out[:,:,ix]
-    X_time_out = X_time_out[:,:,ix]
-    X_mask_out = X_mask_out[:,:,ix]
 
-    return X_out, X_time_out, X_mask_out
+def get_impulse_windows(
+        X,
+        first_obs,
+        last_obs,
+        X_in_Y_names=None,
+        X_in_Y=None,
+        impulse_names=None,
+        history_length=128,
+        future_length=0,
+        int_type='int32',
+        float_type='float32'
+):
+    """
+    Get impulse windows from the store set by ``set_impulse_window_store()``, or construct them if no store is set.
+    Arguments are as for ``ImpulseWindows``.
+
+    :return: ``ImpulseWindows``; impulse windows.
+    """
+
+    kwargs = dict(
+        X_in_Y_names=X_in_Y_names,
+        X_in_Y=X_in_Y,
+        impulse_names=impulse_names,
+        history_length=history_length,
+        future_length=future_length,
+        int_type=int_type,
+        float_type=float_type
+    )
+    if _impulse_window_store is None:
+        return ImpulseWindows(X, first_obs, last_obs, **kwargs)
+
+    return _impulse_window_store.get(X, first_obs, last_obs, **kwargs)
+
+
+def trim_compact_windows(X, X_time, X_len):
+    """
+    Shorten the time dimension of compact impulse windows (see ``ImpulseWindows.get()``) to the longest window
+    in the batch, dropping leading steps that are padding for all responses.
+    Windows are right-aligned, so the retained steps are unchanged.
+
+    :param X: ``numpy`` array of shape (B, T, I); impulses.
+    :param X_time: ``numpy`` array of shape (B, T, F); impulse timestamps by impulse file.
+    :param X_len: ``numpy`` array of shape (B, F); number of non-padding steps by impulse file.
+    :return: triple of ``numpy`` arrays; **X**, **X_time**, and **X_len**, with the time dimension of **X** and **X_time** trimmed.
+    """
+
+    T = X.shape[1]
+    T_trim = min(max(int(X_len.max(initial=0)), 1), T)
+
+    return X[:, T - T_trim:], X_time[:, T - T_trim:], X_len
+
+
+def get_time_offsets(X_time, X_len, Y_time, float_type='float32'):
+    """
+    Encode compact impulse timestamps (see ``ImpulseWindows.get()``) as offsets from their response times,
+    which can be stored in a narrower float type than absolute timestamps without losing precision over the window.
+    Padding steps are encoded as 0. Inverse of ``apply_time_offsets()``.
+
+    :param X_time: ``numpy`` array of shape (B, T, F); impulse timestamps by impulse file.
+    :param X_len: ``numpy`` array of shape (B, F); number of non-padding steps by impulse file.
+    :param Y_time: ``numpy`` vector of shape (B,); response timestamps.
+    :param float_type: ``str``; name of float type of the offsets.
+    :return: ``numpy`` array of shape (B, T, F); offsets of **X_time** from **Y_time**.
+    """
+
+    T = X_time.shape[1]
+    mask = np.arange(T)[None, :, None] >= T - X_len[:, None, :]
+    out = np.where(mask, np.asarray(Y_time, dtype='float64')[:, None, None] - X_time, 0)
+
+    return out.astype(getattr(np, float_type))
+
+
+def apply_time_offsets(X_time_offset, X_len, Y_time, float_type='float32'):
+    """
+    Recover compact impulse timestamps from offsets computed by ``get_time_offsets()``. Padding steps are restored to 0.
+
+    :param X_time_offset: ``numpy`` array of shape (B, T, F); offsets of impulse timestamps from response timestamps.
+    :param X_len: ``numpy`` array of shape (B, F); number of non-padding steps by impulse file.
+    :param Y_time: ``numpy`` vector of shape (B,); response timestamps.
+    :param float_type: ``str``; name of float type of the timestamps.
+    :return: ``numpy`` array of shape (B, T, F); impulse timestamps by impulse file.
+    """
+
+    T = X_time_offset.shape[1]
+    mask = np.arange(T)[None, :, None] >= T - X_len[:, None, :]
+    out = np.where(mask, np.asarray(Y_time, dtype='float64')[:, None, None] - X_time_offset, 0)
+
+    return out.astype(getattr(np, float_type))
+
+
+def get_interleave_indices(X_time, stream_ix):
+    """
+    Compute the temporal interleaving of asynchronous impulse streams, i.e. the order in which the steps of the windows
+    of all streams, concatenated over the time dimension, occur in time. Ties keep the order of concatenation.
+
+    :param X_time: ``numpy`` array of shape (B, T, F); compact impulse timestamps (see ``ImpulseWindows.get()``).
+    :param stream_ix: ``list`` of ``int``; column of **X_time** containing the timestamps of each of S streams.
+    :return: ``numpy`` array of shape (B, T * S); indices into the concatenated streams, in temporal order. Index k refers to step k % T of stream k // T.
+    """
+
+    keys = np.concatenate([X_time[..., i] for i in stream_ix], axis=1)
+
+    return np.argsort(keys, axis=1, kind='stable').astype('int32')
+
+
+def expand_compact_windows(X_time, X_len, file_ix, float_type='float32'):
+    """
+    Expand compact timestamp and mask encodings (see ``ImpulseWindows.get()``) into full (N, T, I) arrays.
+    The model performs the equivalent operation in-graph; this function is mainly useful for inspection.
+
+    :param X_time: ``numpy`` array of shape (N, T, F); impulse timestamps by impulse file.
+    :param X_len: ``numpy`` array of shape (N, F); number of non-padding steps by impulse file.
+    :param file_ix: ``numpy`` vector of shape (I,); index of the impulse file of each impulse dimension.
+    :param float_type: ``str``; name of float type.
+    :return: pair of ``numpy`` arrays; impulse timestamps with shape (N, T, I) and impulse mask with shape (N, T, I).
+    """
+
+    FLOAT_NP = getattr(np, float_type)
+    T = X_time.shape[1]
+    X_time_out = X_time[..., file_ix]
+    X_mask_out = (np.arange(T)[None, :, None] >= T - X_len[:, None, file_ix]).astype(FLOAT_NP)
+
+    return X_time_out, X_mask_out
+
 
 # Do not use, kept for testing
 def _build_CDR_data_inner_obsolete(
@@ -825,6 +1531,82 @@ def get_rangf_array(
     return Y_rangf
 
 
+def get_series_codes(X, Y, series_ids):
+    """
+    Map the jointly unique values of **series_ids** in **X** and **Y** to a shared set of integer series codes.
+
+    :param X: ``pandas`` ``DataFrame``; impulse (predictor) data.
+    :param Y: ``pandas`` ``DataFrame``; response data.
+    :param series_ids: ``list`` of ``str``; column names whose jointly unique values define unique time series.
+    :return: 2-tuple of ``numpy`` vectors; integer series codes for each row of **X** and each row of **Y**.
+    """
+
+    m = len(X)
+    codes = np.zeros(m + len(Y), dtype='int64')
+    for col in series_ids:
+        vals = np.concatenate([np.asarray(X[col], dtype=object), np.asarray(Y[col], dtype=object)], axis=0)
+        col_codes, uniques = pd.factorize(vals)
+        codes, _ = pd.factorize(codes * (len(uniques) + 1) + col_codes)
+
+    return codes[:m], codes[m:]
+
+
+def get_series_positions(X, series_ids):
+    """
+    Compute the position of each row of **X** within its time series, for shifting columns within series by any
+    number of steps (see ``shift_series()``). Computed once per table and shared by all shifts.
+
+    :param X: ``pandas`` ``DataFrame``; impulse (predictor) data.
+    :param series_ids: ``list`` of ``str``; column names whose jointly unique values define unique time series.
+    :return: 2-tuple of ``numpy`` vectors; row order grouping **X** by series (stable, so ``None`` if **X** is already grouped), and the position within its series of each row in that order.
+    """
+
+    n = len(X)
+    codes = np.zeros(n, dtype='int64')
+    for col in series_ids:
+        col_codes, uniques = pd.factorize(np.asarray(X[col], dtype=object))
+        codes, _ = pd.factorize(codes * (len(uniques) + 1) + col_codes)
+
+    order = None
+    if n > 1 and not (codes[1:] >= codes[:-1]).all():
+        order = np.argsort(codes, kind='stable')
+        codes = codes[order]
+
+    ix = np.arange(n)
+    boundary = np.ones(n, dtype=bool)
+    boundary[1:] = codes[1:] != codes[:-1]
+    positions = ix - np.maximum.accumulate(np.where(boundary, ix, 0))
+
+    return order, positions
+
+
+def shift_series(x, series_positions, n, fill_value=0.):
+    """
+    Shift **x** forward by **n** steps within each time series. Equivalent to ``groupby(series_ids).shift(n)``.
+
+    :param x: ``pandas`` ``Series`` or ``numpy`` vector; values to shift.
+    :param series_positions: 2-tuple; output of ``get_series_positions()`` for the table containing **x**.
+    :param n: ``int``; number of steps to shift by.
+    :param fill_value: value of the first **n** rows of each series.
+    :return: ``numpy`` vector; shifted values.
+    """
+
+    order, positions = series_positions
+    x = np.asarray(x, dtype='float64')
+    if order is not None:
+        x = x[order]
+    out = np.full_like(x, fill_value)
+    if n < len(x):
+        out[n:] = x[:len(x) - n]
+    out[positions < n] = fill_value
+    if order is not None:
+        _out = np.empty_like(out)
+        _out[order] = out
+        out = _out
+
+    return out
+
+
 def get_time_windows(
         X,
         Y,
@@ -836,6 +1618,86 @@ def get_time_windows(
     """
     Compute row indices in **X** of initial and final impulses for each element of **y**.
     Assumes time series are already sorted by **series_ids**.
+    Windows are found by binary search over the sorted timestamps of each time series.
+
+    :param X: ``pandas`` ``DataFrame``; impulse (predictor) data.
+    :param Y: ``pandas`` ``DataFrame``; response data.
+    :param series_ids: ``list`` of ``str``; column names whose jointly unique values define unique time series.
+    :param forward: ``bool``; whether to compute forward windows (future inputs) or backward windows (past inputs, used if **forward** is ``False``).
+    :param window_length: ``int``; maximum size of time window to consider. If ``np.inf``, no bound on window size.
+    :param verbose: ``bool``; whether to report progress to stderr
+    :return: 2-tuple of ``numpy`` vectors; first and last impulse observations (respectively) for each response in **y**
+    """
+
+    if window_length is None:
+        window_length = 0
+
+    m = len(X)
+    n = len(Y)
+
+    X_time = np.array(X.time)
+    Y_time = np.array(Y.time)
+    X_id, Y_id = get_series_codes(X, Y, series_ids)
+
+    # Start and end rows of each series in X (X is sorted by series, so each series is a contiguous block)
+    n_series = max(X_id.max(initial=-1), Y_id.max(initial=-1)) + 1
+    series_start = np.zeros(n_series, dtype='int64')
+    series_end = np.zeros(n_series, dtype='int64')
+    if m:
+        boundaries = np.flatnonzero(X_id[1:] != X_id[:-1]) + 1
+        starts = np.concatenate([[0], boundaries])
+        ends = np.concatenate([boundaries, [m]])
+        series_start[X_id[starts]] = starts
+        series_end[X_id[starts]] = ends
+
+    first_obs = np.zeros(n, dtype='int64')
+    last_obs = np.zeros(n, dtype='int64')
+
+    epsilon = np.finfo(np.float32).eps
+    Y_ix_by_series = pd.Series(np.arange(n)).groupby(Y_id).indices
+    n_series_y = len(Y_ix_by_series)
+    for k, series in enumerate(Y_ix_by_series):
+        if verbose and (k == 0 or k % 100 == 99 or k == n_series_y - 1):
+            stderr('\r%d/%d' % (k + 1, n_series_y))
+        ix = Y_ix_by_series[series]
+        start = series_start[series]
+        end = series_end[series]
+        _X_time = X_time[start:end]
+        _Y_time = Y_time[ix]
+        if forward:
+            # Number of impulses no earlier than each response.
+            # If there are none, the window keeps the final impulse of the series, as in the sequential implementation.
+            n_obs = (end - start) - np.searchsorted(_X_time, _Y_time - epsilon, side='left')
+            first_obs[ix] = np.where(n_obs > 0, end - n_obs, max(end - 1, start))
+            last_obs[ix] = end
+        else:
+            first_obs[ix] = start
+            last_obs[ix] = start + np.searchsorted(_X_time, _Y_time + epsilon, side='right')
+
+    if forward:
+        if np.isfinite(window_length):
+            last_obs = np.minimum(last_obs, first_obs + window_length)
+    elif np.isfinite(window_length): # Backward with finite window length
+        first_obs = np.maximum(first_obs, last_obs - window_length)
+
+    if verbose:
+        stderr('\n')
+
+    return first_obs, last_obs
+
+
+# Do not use, kept for testing
+def _get_time_windows_obsolete(
+        X,
+        Y,
+        series_ids,
+        forward=False,
+        window_length=128,
+        verbose=True
+):
+    """
+    Compute row indices in **X** of initial and final impulses for each element of **y**.
+    Assumes time series are already sorted by **series_ids**.
 
     :param X: ``pandas`` ``DataFrame``; impulse (predictor) data.
     :param Y: ``pandas`` ``DataFrame``; response data.
@@ -944,37 +1806,138 @@ def get_time_windows(
     return first_obs, last_obs
 
 
+FILTER_OPS = [
+    ('<=', operator.le),
+    ('>=', operator.ge),
+    ('==', operator.eq),
+    ('!=', operator.ne),
+    ('<', operator.lt),
+    ('>', operator.gt)
+]
+
+
+def parse_filter(cond):
+    """
+    Parse a filtering condition into its comparator and value.
+
+    :param cond: ``str``; string representation of condition to use for filtering (e.g. ``'>= 100'``).
+    :return: 2-tuple; comparator (``str``) and value (``float`` if numeric, else ``str``, which may name a column).
+    """
+
+    assert isinstance(cond, str), 'Argument ``cond`` must be of type ``str``.'
+
+    cond = cond.strip()
+    for op, _ in FILTER_OPS:
+        if cond.startswith(op):
+            var = cond[len(op):].strip()
+            break
+    else:
+        raise ValueError('Unrecognized filtering condition: %s' % cond)
+
+    if var == 'inf':
+        var = np.inf
+    else:
+        try:
+            var = float(var)
+        except ValueError:
+            pass
+
+    return op, var
+
+
+class CompiledFilters(object):
+    """
+    Filter list parsed once into a sequence of vectorized comparisons, which ``compute_filters()`` evaluates in a single
+    pass over the columns they use. Compile the filters once and reuse the object for every table
+    (e.g. for every response file or chunk), rather than re-parsing the filter strings for each.
+    Iterating over the object yields the original (field, condition) pairs, so it can be used wherever a filter
+    list is accepted.
+
+    :param filters: ``list``; list of key-value pairs mapping column names to filtering criteria for their values.
+    """
+
+    def __init__(self, filters):
+        if isinstance(filters, CompiledFilters):
+            filters = filters.filters
+        self.filters = [(field, cond) for field, cond in filters]
+        self.program = []
+        for field, cond in self.filters:
+            op, var = parse_filter(cond)
+            self.program.append((field, op, dict(FILTER_OPS)[op], var))
+
+    def __iter__(self):
+        return iter(self.filters)
+
+    def __len__(self):
+        return len(self.filters)
+
+    @property
+    def key(self):
+        """
+        Canonical representation of the filters, which is identical for equivalent filter strings (e.g. ``'>=3'`` and ``'>= 3.0'``).
+        Used to key cached filtering masks (see ``cdr.io.get_preprocessing_cache_key()``).
+
+        :return: ``tuple``; canonical filters.
+        """
+
+        return tuple((field, op, var) for field, op, _, var in self.program)
+
+    def compute(self, Y):
+        """
+        Compute the filtering mask for a table.
+        Unique-count (``nunique``) filters count values among rows that pass the preceding filters, and the counts are
+        added to **Y** as column **field**.
+
+        :param Y: ``pandas`` ``DataFrame``; response data.
+        :return: ``numpy`` vector; boolean mask to use for ``pandas`` subsetting operations.
+        """
+
+        select = np.ones(len(Y), dtype=bool)
+        for field, op, fn, var in self.program:
+            if field not in Y:
+                if field.lower().endswith('nunique'):
+                    name = field[:-7]
+                    if name in Y:
+                        codes, _ = pd.factorize(Y[name])
+                        counts = np.bincount(codes[select & (codes >= 0)], minlength=codes.max(initial=-1) + 1)
+                        counts = counts[codes]
+                        Y[field] = np.where((codes >= 0) & (counts > 0), counts, np.nan)
+                    else:
+                        stderr('Skipping unique-counts filter for column "%s", which was not found in the data...\n' % name)
+                        continue
+                else:
+                    stderr('Skipping filter for column "%s", which was not found in the data...\n' % field)
+                    continue
+            col = Y[field]
+            if isinstance(var, str) and var in Y and not var in col.unique():
+                var = Y[var]
+            try:
+                _select = fn(col, var)
+            except TypeError:
+                if op in ['==', '!=']:
+                    _select = fn(col.astype('str'), var)
+                else:
+                    raise
+            select &= np.asarray(~pd.isna(col) & _select, dtype=bool)
+
+        return select
+
+
 def compute_filters(Y, filters=None):
     """
     Compute filters given a filter map.
 
     :param Y: ``pandas`` ``DataFrame``; response data.
-    :param filters: ``list``; list of key-value pairs mapping column names to filtering criteria for their values.
+    :param filters: ``list`` or ``CompiledFilters``; list of key-value pairs mapping column names to filtering criteria for their values. If ``None``, no filtering.
     :return: ``numpy`` vector; boolean mask to use for ``pandas`` subsetting operations.
     """
 
     if filters is None:
-        return Y
-    select = np.ones(len(Y), dtype=bool)
-    for f in filters:
-        field = f[0]
-        cond = f[1]
-        if field in Y:
-            select &= compute_filter(Y, field, cond)
-        elif field.lower().endswith('nunique'):
-            name = field[:-7]
-            if name in Y:
-                vals, counts = np.unique(Y[name][select], return_counts=True)
-                count_map = {}
-                for v, c in zip(vals, counts):
-                    count_map[v] = c
-                Y[field] = Y[name].map(count_map)
-                select &= compute_filter(Y, field, cond)
-            else:
-                stderr('Skipping unique-counts filter for column "%s", which was not found in the data...\n' % name)
-        else:
-            stderr('Skipping filter for column "%s", which was not found in the data...\n' % field)
-    return select
+        return np.ones(len(Y), dtype=bool)
+    if not isinstance(filters, CompiledFilters):
+        filters = CompiledFilters(filters)
+
+    return filters.compute(Y)
 
 
 def compute_filter(y, field, cond):
@@ -987,58 +1950,7 @@ def compute_filter(y, field, cond):
     :return: ``numpy`` vector; boolean mask to use for ``pandas`` subsetting operations.
     """
 
-    assert isinstance(cond, str), 'Argument ``cond`` must be of type ``str``.'
-
-    cond = cond.strip()
-    if cond.startswith('<='):
-        op = '<='
-        var = cond[2:].strip()
-    elif cond.startswith('>='):
-        op = '<='
-        var = cond[2:].strip()
-    elif cond.startswith('<'):
-        op = '<'
-        var = cond[1:].strip()
-    elif cond.startswith('>'):
-        op = '>'
-        var = cond[1:].strip()
-    elif cond.startswith('=='):
-        op = '=='
-        var = cond[2:].strip()
-    elif cond.startswith('!='):
-        op = '!='
-        var = cond[2:].strip()
-    else:
-        raise ValueError('Unrecognized filtering condition: %s' % cond)
-
-    if var == 'inf':
-        var = np.inf
-    else:
-        try:
-            var = float(var)
-        except ValueError:
-            if var in y and not var in y[field].unique():
-                var = y[var]
-
-    if op == '<=':
-        return ~pd.isna(y[field]) & (y[field] <= var)
-    if cond.startswith('>='):
-        return ~pd.isna(y[field]) & (y[field] >= var)
-    if cond.startswith('<'):
-        return ~pd.isna(y[field]) & (y[field] < var)
-    if cond.startswith('>'):
-        return ~pd.isna(y[field]) & (y[field] > var)
-    if cond.startswith('=='):
-        try:
-            return ~pd.isna(y[field]) & (y[field] == var)
-        except:
-            return ~pd.isna(y[field]) & (y[field].astype('str') == var)
-    if cond.startswith('!='):
-        try:
-            return ~pd.isna(y[field]) & (y[field] != var)
-        except:
-            return ~pd.isna(y[field]) & (y[field].astype('str') != var)
-    raise ValueError('Unsupported comparator in filter "%s"' %cond)
+    return CompiledFilters([(field, cond)]).compute(y)
 
 
 def compute_splitID(y, split_fields):
@@ -1072,6 +1984,26 @@ def compute_partition(y, modulus, n):
     return partition
 
 
+def get_window_indices(first_obs, last_obs, window_length):
+    """
+    Compute indices for gathering right-aligned impulse windows from an impulse table padded with one leading fill row.
+    Row ``k`` of the source table is located at index ``k + 1`` of the padded table, and padding cells point to index 0.
+
+    :param first_obs: ``numpy`` vector; row indices in the source table of the first impulse in the window of each response.
+    :param last_obs: ``numpy`` vector; row indices in the source table of the end (exclusive) of the window of each response.
+    :param window_length: ``int``; number of steps in time dimension of output
+    :return: 2-tuple of ``numpy`` arrays of shape (N, window_length); gather indices into the padded table and boolean mask over non-padding cells.
+    """
+
+    first_obs = np.asarray(first_obs)
+    last_obs = np.asarray(last_obs)
+    ix = last_obs[..., None] - window_length + np.arange(window_length)[None, ...]
+    mask = ix >= first_obs[..., None]
+    ix = np.where(mask, ix + 1, 0)
+
+    return ix, mask
+
+
 def expand_impulse_sequence(
         X, X_time, first_obs, last_obs, window_length, int_type='int32', float_type='float32', fill=0.):
     """
@@ -1092,24 +2024,91 @@ def expand_impulse_sequence(
     FLOAT_NP = getattr(np, float_type)
     last_obs = np.array(last_obs, dtype=INT_NP)
     first_obs = np.array(first_obs, dtype=INT_NP)
-    X_time = np.array(X_time, dtype=FLOAT_NP)
     X = np.array(X)
 
-    X_2d = np.full((first_obs.shape[0], window_length, X.shape[1]), fill, dtype=FLOAT_NP)
-    time_X_2d = np.zeros_like(X_2d)
-    time_mask = np.zeros_like(X_2d)
+    X_padded = np.full((X.shape[0] + 1, X.shape[1]), fill, dtype=FLOAT_NP)
+    X_padded[1:] = X
+    X_time_padded = np.zeros((X.shape[0] + 1,), dtype=FLOAT_NP)
+    X_time_padded[1:] = X_time
 
-    for i, first, last in zip(np.arange(first_obs.shape[0]), first_obs, last_obs):
-        if first < last:
-            sX = X[first:last]
-            sXt = X_time[first:last]
-            X_2d[i, -sX.shape[0]:] = sX
-            time_X_2d[i][-len(sXt):] = sXt[..., None]
-            time_mask[i][-len(sXt):] = 1
+    ix, mask = get_window_indices(first_obs, last_obs, window_length)
+    shape = (first_obs.shape[0], window_length, X.shape[1])
+
+    X_2d = X_padded[ix]
+    time_X_2d = np.broadcast_to(X_time_padded[ix][..., None], shape).copy()
+    time_mask = np.broadcast_to(mask[..., None], shape).astype(FLOAT_NP)
 
     return X_2d, time_X_2d, time_mask
 
 
+def get_window_similarities(
+        E, first_obs, last_obs, window_length, metric='cosine', minibatch_size=50000, n_threads=1, float_type='float32'):
+    """
+    Compare each impulse in the time window of each response to the final impulse of the window, using the cosine
+    similarity or Euclidean distance between impulse embeddings.
+    Equivalent to expanding the embeddings into (N, T, D) windows (see ``expand_impulse_sequence()``) and comparing each
+    window to its final row, but without materializing the windows: lagged similarities are computed once for each
+    distinct final impulse, in batches on a thread pool, and then gathered for each window.
+    Padding cells and non-finite similarities are 0.
+
+    :param E: ``numpy`` array of shape (M, D); impulse embeddings.
+    :param first_obs: ``numpy`` vector; row indices in **E** of the first impulse in the window of each response.
+    :param last_obs: ``numpy`` vector; row indices in **E** of the end (exclusive) of the window of each response.
+    :param window_length: ``int``; number of steps in time dimension of output.
+    :param metric: ``str``; ``'cosine'`` for cosine similarity or ``'euclidean'`` for Euclidean distance.
+    :param minibatch_size: ``int``; number of distinct final impulses per batch. Bounds temporary memory to O(**minibatch_size** * D) per thread.
+    :param n_threads: ``int``; number of threads.
+    :param float_type: ``str``; name of float type.
+    :return: ``numpy`` array of shape (N, window_length); similarities.
+    """
+
+    assert metric in ['cosine', 'euclidean'], 'Unrecognized metric: "%s".' % metric
+
+    FLOAT_NP = getattr(np, float_type)
+    T = window_length
+    E = np.asarray(E, dtype='float64')
+    first_obs = np.asarray(first_obs, dtype='int64')
+    last_obs = np.asarray(last_obs, dtype='int64')
+    base = last_obs - 1
+    valid = base >= first_obs
+    bases = np.unique(base[valid])
+
+    if metric == 'cosine':
+        with np.errstate(divide='ignore', invalid='ignore'):
+            E = E / np.sqrt((E ** 2).sum(axis=1, keepdims=True))
+
+    def lagged_similarities(ix):
+        # Similarity of each impulse in ix to each of the T - 1 impulses preceding it, by lag
+        out = np.zeros((len(ix), T))
+        E_base = E[ix]
+        with np.errstate(invalid='ignore', over='ignore'):
+            for k in range(T):
+                rows = ix - k
+                E_cur = E[np.maximum(rows, 0)]
+                if metric == 'cosine':
+                    sim = (E_base * E_cur).sum(axis=1)
+                else:
+                    sim = np.sqrt(((E_base - E_cur) ** 2).sum(axis=1))
+                out[:, k] = np.where(rows >= 0, sim, 0)
+        return out
+
+    batches = [bases[i:i + minibatch_size] for i in range(0, len(bases), minibatch_size)]
+    with ThreadPoolExecutor(max_workers=max(1, min(n_threads, len(batches)))) as pool:
+        S = list(pool.map(lagged_similarities, batches))
+    S = np.concatenate(S, axis=0) if S else np.zeros((0, T))
+
+    lag = T - 1 - np.arange(T)
+    mask = valid[:, None] & (last_obs[:, None] - T + np.arange(T)[None, :] >= first_obs[:, None])
+    u = np.minimum(np.searchsorted(bases, base), max(len(bases) - 1, 0))
+    if len(bases):
+        out = S[u[:, None], lag[None, :]]
+    else:
+        out = np.zeros((len(base), T))
+    out = np.where(mask & np.isfinite(out), out, 0).astype(FLOAT_NP)
+
+    return out
+
+
 def compute_time_mask(
         X_time,
         first_obs,
@@ -1147,6 +2146,55 @@ def compute_time_mask(
     return time_mask
 
 
+def _get_time_windows_pair(X, Y, series_ids, history_length, future_length, verbose=False):
+    """
+    Compute the time windows in **X** of each response in **Y** (see ``preprocess_data()``).
+    Module-level so that it can be run in worker processes.
+
+    :param X: ``pandas`` ``DataFrame``; impulse (predictor) data. Only the ``time`` and **series_ids** columns are used.
+    :param Y: ``pandas`` ``DataFrame``; response data. Only the ``time`` and **series_ids** columns are used.
+    :param series_ids: ``list`` of ``str``; column names whose jointly unique values define unique time series.
+    :param history_length: ``int``; maximum number of history (backward) observations.
+    :param future_length: ``int``; maximum number of future (forward) observations.
+    :param verbose: ``bool``; whether to report progress to stderr
+    :return: 4-tuple; first and last impulse observations for each response, followed by the backward and forward windows as pairs of vectors (``None`` if not computed)
+    """
+
+    first_obs = last_obs = None
+    windows_b = windows_f = None
+    if history_length:
+        if future_length and verbose:
+            stderr('Backward...\n')
+        first_obs, last_obs = get_time_windows(
+            X,
+            Y,
+            series_ids,
+            window_length=history_length,
+            verbose=verbose
+        )
+        windows_b = (first_obs, last_obs)
+    if future_length:
+        if history_length and verbose:
+            stderr('Forward...\n')
+        _first_obs, last_obs = get_time_windows(
+            X,
+            Y,
+            series_ids,
+            forward=True,
+            window_length=future_length,
+            verbose=verbose
+        )
+        windows_f = (_first_obs, last_obs)
+        if first_obs is None:
+            first_obs = _first_obs
+
+    # Ensure that time window doesn't exceed maximum, which can happen for high temporal res
+    # impulses or responses due to numerical imprecision.
+    last_obs = np.minimum(last_obs, first_obs + history_length + future_length)
+
+    return first_obs, last_obs, windows_b, windows_f
+
+
 def preprocess_data(
         X,
         Y,
@@ -1156,6 +2204,8 @@ def preprocess_data(
         history_length=128,
         future_length=0,
         all_interactions=False,
+        n_workers=1,
+        sparse_categorical=False,
         verbose=True,
         debug=False
 ):
@@ -1166,15 +2216,19 @@ def preprocess_data(
     :param Y: list of ``pandas`` tables; response data.
     :param formula_list: ``list`` of ``Formula``; CDR formula for which to preprocess data.
     :param series_ids: ``list`` of ``str``; column names whose jointly unique values define unique time series.
-    :param filters: ``list``; list of key-value pairs mapping column names to filtering criteria for their values.
+    :param filters: ``list`` or ``CompiledFilters``; list of key-value pairs mapping column names to filtering criteria for their values.
     :param history_length: ``int``; maximum number of history (backward) observations.
     :param future_length: ``int``; maximum number of future (forward) observations.
     :param all_interactions: ``bool``; add powerset of all conformable interactions.
+    :param n_workers: ``int``; number of worker processes to use for computing time windows. Output is identical regardless of the number of workers.
+    :param sparse_categorical: ``bool``; whether to store 1-hot expansions of categorical impulses as sparse columns.
     :param verbose: ``bool``; whether to report progress to stderr
     :param debug: ``bool``; print debugging information
     :return: 7-tuple; predictor data, response data, filtering mask, response-aligned predictor names, response-aligned predictors, 2D predictor names, and 2D predictors
     """
 
+    from .formula import TransformPlan
+
     if verbose:
         stderr('Pre-processing data...\n')
 
@@ -1183,6 +2237,9 @@ def preprocess_data(
     if not isinstance(Y, list):
         Y = [Y]
 
+    if filters is not None:
+        filters = CompiledFilters(filters)
+
     select = []
     for i, _Y in enumerate(Y):
         if filters is None:
@@ -1196,41 +2253,49 @@ def preprocess_data(
     X_in_Y_names = None
 
     if history_length or future_length:
+        # Time windows are independent across predictor/response file pairs, so they can be computed in
+        # parallel. Workers only receive the columns needed to find the windows.
+        window_columns = ['time'] + list(series_ids)
+        pairs = [(i, j) for i in range(len(X)) for j in range(len(Y))]
+        windows = {}
+        if n_workers > 1 and len(pairs) > 1:
+            if verbose:
+                stderr('Computing time windows for %d predictor/response file pairs...\n' % len(pairs))
+            with ProcessPoolExecutor(max_workers=min(n_workers, len(pairs))) as pool:
+                futures = {
+                    pool.submit(
+                        _get_time_windows_pair,
+                        X[i][window_columns],
+                        Y[j][window_columns],
+                        series_ids,
+                        history_length,
+                        future_length
+                    ): (i, j) for i, j in pairs
+                }
+                for k, future in enumerate(as_completed(futures)):
+                    windows[futures[future]] = future.result()
+                    if verbose:
+                        stderr('\r%d/%d' % (k + 1, len(pairs)))
+            if verbose:
+                stderr('\n')
+        else:
+            for i, j in pairs:
+                if verbose and j == 0:
+                    stderr('Computing time windows for each regression target in predictor file %d...\n' % (i+1))
+                windows[(i, j)] = _get_time_windows_pair(
+                    X[i],
+                    Y[j],
+                    series_ids,
+                    history_length,
+                    future_length,
+                    verbose=verbose
+                )
+
         X_new = []
         for i in range(len(X)):
             _X = X[i]
-            if verbose:
-                stderr('Computing time windows for each regression target in predictor file %d...\n' % (i+1))
             for j, _Y in enumerate(Y):
-                if history_length:
-                    if future_length:
-                        stderr('Backward...\n')
-                    first_obs, last_obs = get_time_windows(
-                        _X,
-                        _Y,
-                        series_ids,
-                        window_length=history_length
-                    )
-                    first_obs_b, last_obs_b = first_obs, last_obs
-                else:
-                    first_obs = last_obs = None
-                if future_length:
-                    if history_length:
-                        stderr('Forward...\n')
-                    _first_obs, last_obs = get_time_windows(
-                        _X,
-                        _Y,
-                        series_ids,
-                        forward=True,
-                        window_length=future_length
-                    )
-                    first_obs_f, last_obs_f = _first_obs, last_obs
-                    if first_obs is None:
-                        first_obs = _first_obs
-
-                # Ensure that time window doesn't exceed maximum, which can happen for high temporal res
-                # impulses or responses due to numerical imprecision.
-                last_obs = np.minimum(last_obs, first_obs + history_length + future_length)
+                first_obs, last_obs, windows_b, windows_f = windows[(i, j)]
 
                 _Y['first_obs_%d' % i] = first_obs
                 _Y['last_obs_%d' % i] = last_obs
@@ -1251,23 +2316,27 @@ def preprocess_data(
                         print(_Y[['subject', 'docid', 'word', 'time', 'first_obs_%d' % i, 'last_obs_%d' % i]].iloc[max(0, k-5):k+5])
                         print('Impulses:')
                         print(_X[['subject', 'docid', 'word', 'time']][row['first_obs_%d' % i]:row['last_obs_%d' % i]])
-                        print('Impulses (bw):')
-                        print(_X[['subject', 'docid', 'word', 'time']][first_obs_b[k]:last_obs_b[k]])
-                        print('Impulses (fw):')
-                        print(_X[['subject', 'docid', 'word', 'time']][first_obs_f[k]:last_obs_f[k]])
+                        if windows_b is not None:
+                            print('Impulses (bw):')
+                            print(_X[['subject', 'docid', 'word', 'time']][windows_b[0][k]:windows_b[1][k]])
+                        if windows_f is not None:
+                            print('Impulses (fw):')
+                            print(_X[['subject', 'docid', 'word', 'time']][windows_f[0][k]:windows_f[1][k]])
                         print()
 
                 Y[j] = _Y
 
             X_new.append(_X)
 
+        X_new = TransformPlan(formula_list).apply(X_new)
         for x in formula_list:
             X_new, Y, X_in_Y_names = x.apply_formula(
                 X_new,
                 Y,
                 X_in_Y_names=X_in_Y_names,
                 all_interactions=all_interactions,
-                series_ids=series_ids
+                series_ids=series_ids,
+                sparse_categorical=sparse_categorical
             )
     else:
         X_new = X
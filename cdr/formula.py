@@ -1,10 +1,12 @@
 import re
-import math
 import ast
 import itertools
 import numpy as np
+import pandas as pd
+import scipy.sparse
 
-from .data import z, c, s, compute_time_mask, expand_impulse_sequence
+from .data import z, c, s, get_window_similarities, get_series_positions, \
+    shift_series
 from .util import names2ix, sn, stderr
 
 interact = re.compile('([^ ]+):([^ ]+)')
@@ -917,12 +919,13 @@ class Formula(object):
             raise ValueError('Unrecognized op: "%s".' % op)
         return out
 
-    def apply_ops(self, impulse, X):
+    def apply_ops(self, impulse, X, sparse_categorical=False):
         """
         Apply all ops defined for an impulse
 
         :param impulse: ``Impulse`` object; the impulse.
         :param X: list of ``pandas`` tables; table containing the impulse data.
+        :param sparse_categorical: ``bool``; whether to store 1-hot expansions of categorical impulses as sparse columns. Ops are applied to dense copies, so expansions with ops are stored densely.
         :return: ``pandas`` table; table augmented with transformed impulse.
         """
 
@@ -939,23 +942,25 @@ class Formula(object):
             expanded_impulses = None
             if impulse.id not in _X:
                 if type(impulse).__name__ == 'ImpulseInteraction':
-                    _X, expanded_impulses, expanded_atomic_impulses = impulse.expand_categorical(_X)
+                    _X, expanded_impulses, expanded_atomic_impulses = impulse.expand_categorical(_X, sparse=sparse_categorical)
                     for x in expanded_atomic_impulses:
                         for a in x:
-                            _X = self.apply_ops(a, _X)
+                            _X = self.apply_ops(a, _X, sparse_categorical=sparse_categorical)
                     for x in expanded_impulses:
                         if x.name() not in _X:
-                            _X[x.id] = _X[[y.name() for y in x.atomic_impulses]].product(axis=1)
+                            _X[x.id] = interaction_product(_X, [y.name() for y in x.atomic_impulses])
             else:
                 if type(impulse).__name__ == 'ImpulseInteraction':
-                    _X, expanded_impulses, _ = impulse.expand_categorical(_X)
+                    _X, expanded_impulses, _ = impulse.expand_categorical(_X, sparse=sparse_categorical)
                 else:
-                    _X, expanded_impulses = impulse.expand_categorical(_X)
+                    _X, expanded_impulses = impulse.expand_categorical(_X, sparse=sparse_categorical)
 
             if expanded_impulses is not None:
                 for x in expanded_impulses:
                     if x.name() not in _X:
                         new_col = _X[x.id]
+                        if len(ops) and isinstance(new_col.dtype, pd.SparseDtype):
+                            new_col = new_col.sparse.to_dense()
                         for j in range(len(ops)):
                             op = ops[j]
                             new_col = self.apply_op(op, new_col)
@@ -980,12 +985,14 @@ class Formula(object):
     ):
         """
         Compute 2D predictor (predictor whose value depends on properties of the most recent impulse).
+        Distances are computed from lagged similarities of the embeddings (see ``get_window_similarities()``), so
+        expanded (N, T, D) embedding windows are never materialized.
 
         :param predictor_name: ``str``; name of predictor
         :param X: ``pandas`` table; input data
         :param first_obs: ``pandas`` ``Series`` or 1D ``numpy`` array; row indices in ``X`` of the start of the series associated with each regression target.
         :param last_obs: ``pandas`` ``Series`` or 1D ``numpy`` array; row indices in ``X`` of the most recent observation in the series associated with each regression target.
-        :param minibatch_size: ``int``; minibatch size for computing predictor, can help with memory footprint
+        :param minibatch_size: ``int``; number of distinct most recent observations per batch, can help with memory footprint
         :return: 2-tuple; new predictor name, ``numpy`` array of predictor values
         """
 
@@ -996,7 +1003,7 @@ class Formula(object):
 
         assert predictor_name in supported, '2D predictor "%s" not currently supported' %predictor_name
 
-        window_length = history_length + future_length
+        window_length = history_length + (future_length or 0)
 
         if predictor_name in ['cosdist2D', 'eucldist2D']:
             is_embedding_dimension = re.compile('d([0-9]+)')
@@ -1006,47 +1013,26 @@ class Formula(object):
 
             assert len(embedding_colnames) > 0, 'Model formula contains vector distance predictors but no embedding columns found in the input data'
 
-            new_2d_predictor = []
+            new_2d_predictor_name = predictor_name
+            E = np.ascontiguousarray(X[embedding_colnames], dtype='float32')
+            first_obs = np.asarray(first_obs, dtype='int64')
+            last_obs = np.asarray(last_obs, dtype='int64')
+
             if predictor_name == 'cosdist2D':
-                new_2d_predictor_name = 'cosdist2D'
                 stderr('Computing pointwise cosine distances...\n')
-            elif predictor_name == 'eucldist2D':
+                metric = 'cosine'
+            else:
                 stderr('Computing pointwise Euclidean distances...\n')
-                new_2d_predictor_name = 'eucldist2D'
-
-            for i in range(0, len(first_obs), minibatch_size):
-                stderr('\rProcessing batch %d/%d' %(i/minibatch_size + 1, math.ceil(float(len(first_obs))/minibatch_size)))
-                X_embeddings, _, _ = expand_impulse_sequence(
-                    np.array(X[embedding_colnames]),
-                    np.array(X['time']),
-                    np.array(first_obs)[i:i+minibatch_size],
-                    np.array(last_obs)[i:i+minibatch_size],
-                    window_length,
-                    fill=np.nan
-                )
-                X_bases = X_embeddings[:, -1:, :]
-
-                if predictor_name == 'cosdist2D':
-                    numerator = (X_bases * X_embeddings).sum(axis=2)
-                    denominator = np.sqrt((X_bases ** 2).sum(axis=2)) * np.sqrt((X_embeddings ** 2).sum(axis=2))
-                    cosine_distances = numerator / (denominator)
-
-                    cosine_distances = np.where(np.isfinite(cosine_distances), cosine_distances,
-                                                np.zeros(X_embeddings.shape[:2]))
-
-                    new_2d_predictor.append(np.expand_dims(cosine_distances, -1))
-
-                elif predictor_name == 'eucldist2D':
-                    diffs = X_bases - X_embeddings
-
-                    euclidean_distances = np.sqrt((diffs ** 2).sum(axis=2))
-                    euclidean_distances = np.where(np.isfinite(euclidean_distances), euclidean_distances,
-                                                   np.zeros(X_embeddings.shape[:2]))
+                metric = 'euclidean'
 
-                    new_2d_predictor.append(np.expand_dims(euclidean_distances, -1))
-
-            stderr('\n')
-            new_2d_predictor = np.concatenate(new_2d_predictor, axis=0)
+            new_2d_predictor = get_window_similarities(
+                E,
+                first_obs,
+                last_obs,
+                window_length,
+                metric=metric,
+                minibatch_size=minibatch_size
+            )[..., None]
 
         return new_2d_predictor_name, new_2d_predictor
 
@@ -1116,7 +1102,8 @@ class Formula(object):
             Y,
             X_in_Y_names=None,
             all_interactions=False,
-            series_ids=None
+            series_ids=None,
+            sparse_categorical=False
     ):
         """
         Extract all data and compute all transforms required by the model formula.
@@ -1126,6 +1113,7 @@ class Formula(object):
         :param X_in_Y_names: ``list`` or ``None``; List of column names for response-aligned predictors (predictors measured for every response rather than for every input) if applicable, ``None`` otherwise.
         :param all_interactions: ``bool``; add powerset of all conformable interactions.
         :param series_ids: ``list`` of ``str`` or ``None``; list of ids to use as grouping factors for lagged effects. If ``None``, lagging will not be attempted.
+        :param sparse_categorical: ``bool``; whether to store 1-hot expansions of categorical impulses in **X** as sparse columns (see ``Impulse.expand_categorical()``).
         :return: triple; transformed **X**, transformed **y**, response-aligned predictor names
         """
 
@@ -1165,6 +1153,8 @@ class Formula(object):
             for c in _X.columns:
                 X_columns.add(c)
 
+        series_positions = {}
+
         for impulse in impulses:
             if type(impulse).__name__ == 'ImpulseInteraction':
                 to_process = impulse.impulses()
@@ -1176,7 +1166,7 @@ class Formula(object):
                     for i in range(len(X)):
                         _X = X[i]
                         if x.id in _X:
-                            _X = self.apply_ops(x, _X)
+                            _X = self.apply_ops(x, _X, sparse_categorical=sparse_categorical)
                             X[i] = _X
                             break
                 else: # Not in X, so either it's spilled over (legacy from Cognition expts) or it's in Y (response aligned)
@@ -1187,8 +1177,10 @@ class Formula(object):
                         for i in range(len(X)):
                             _X = X[i]
                             if x_id in _X:
-                                _X[x_id] = _X.groupby(series_ids)[x_id].shift_activations(n, fill_value=0.)
-                                _X = self.apply_ops(x, _X)
+                                if i not in series_positions:
+                                    series_positions[i] = get_series_positions(_X, series_ids)
+                                _X[x.id] = shift_series(_X[x_id], series_positions[i], n, fill_value=0.)
+                                _X = self.apply_ops(x, _X, sparse_categorical=sparse_categorical)
                                 X[i] = _X
                                 break
                     else: # Response aligned
@@ -1220,7 +1212,7 @@ class Formula(object):
                             if atom.id not in _X:
                                 in_X = False
                         if in_X:
-                            _X = self.apply_ops(impulse, _X)
+                            _X = self.apply_ops(impulse, _X, sparse_categorical=sparse_categorical)
                             X[i] = _X
                             found = True
                             break
@@ -1536,16 +1528,19 @@ class Impulse(object):
         for _X in X:
             if self.id in _X:
                 dtype = _X[self.id].dtype
+                if isinstance(dtype, pd.SparseDtype):
+                    dtype = dtype.subtype
                 if dtype.name == 'category' or not np.issubdtype(dtype, np.number):
                     return True
         
         return False
 
-    def expand_categorical(self, X):
+    def expand_categorical(self, X, sparse=False):
         """
         Expand any categorical predictors in **X** into 1-hot columns.
 
         :param X: list of ``pandas`` tables; input data
+        :param sparse: ``bool``; whether to store the 1-hot columns as sparse columns (with fill value 0), which take memory proportional to the number of rows rather than to the number of rows times the number of levels.
         :return: 2-tuple of ``pandas`` table, ``list`` of ``Impulse``; expanded data, list of expanded ``Impulse`` objects
         """
 
@@ -1562,12 +1557,27 @@ class Impulse(object):
             if self.id in _X and self.categorical(X):
                 vals = sorted(_X[self.id].unique())[1:]
                 impulses = [Impulse('_'.join([self.id, pythonize_string(str(val))]), ops=self.ops) for val in vals]
-                expanded_value_names = [str(val) for val in vals]
-                for j in range(len(impulses)):
-                    x = impulses[j]
-                    val = expanded_value_names[j]
-                    if x.id not in _X:
-                        _X[x.id] = (_X[self.id] == val).astype('float')
+                if sparse:
+                    todo = [j for j in range(len(impulses)) if impulses[j].id not in _X]
+                    if todo:
+                        codes = pd.Categorical(_X[self.id], categories=vals).codes
+                        rows = np.flatnonzero(codes >= 0)
+                        onehot = scipy.sparse.csc_matrix(
+                            (np.ones(len(rows)), (rows, codes[rows])),
+                            shape=(len(_X), len(vals))
+                        )[:, todo]
+                        new_cols = pd.DataFrame.sparse.from_spmatrix(
+                            onehot,
+                            index=_X.index,
+                            columns=[impulses[j].id for j in todo]
+                        )
+                        _X = pd.concat([_X, new_cols], axis=1)
+                else:
+                    for j in range(len(impulses)):
+                        x = impulses[j]
+                        val = vals[j]
+                        if x.id not in _X:
+                            _X[x.id] = (_X[self.id] == val).astype('float')
                 X[i] = _X
                 break
 
@@ -1624,11 +1634,12 @@ class ImpulseInteraction(object):
 
         return self.atomic_impulses
 
-    def expand_categorical(self, X):
+    def expand_categorical(self, X, sparse=False):
         """
         Expand any categorical predictors in **X** into 1-hot columns.
 
         :param X: list of ``pandas`` tables; input data.
+        :param sparse: ``bool``; whether to store the 1-hot columns as sparse columns (see ``Impulse.expand_categorical()``).
         :return: 3-tuple of ``pandas`` table, ``list`` of ``ImpulseInteraction``, ``list`` of ``list`` of ``Impulse``; expanded data, list of expanded ``ImpulseInteraction`` objects, list of lists of expanded ``Impulse`` objects, one list for each interaction.
         """
 
@@ -1640,7 +1651,7 @@ class ImpulseInteraction(object):
 
         expanded_atomic_impulses = []
         for x in self.impulses():
-            X, expanded_atomic_impulses_cur = x.expand_categorical(X)
+            X, expanded_atomic_impulses_cur = x.expand_categorical(X, sparse=sparse)
             expanded_atomic_impulses.append(expanded_atomic_impulses_cur)
         expanded_interaction_impulses = [ImpulseInteraction(x, ops=self.ops) for x in itertools.product(*expanded_atomic_impulses)]
 
@@ -1649,6 +1660,135 @@ class ImpulseInteraction(object):
 
         return X, expanded_interaction_impulses, expanded_atomic_impulses
 
+def interaction_product(X, names):
+    """
+    Compute the product of columns **names** of **X**, ignoring NaNs (as in ``np.nanprod``).
+    If any of the columns are sparse (e.g. sparse 1-hot expansions of categorical impulses), the product is only
+    computed on rows where all sparse columns are non-zero and is returned as a sparse column.
+
+    :param X: ``pandas`` table; input data.
+    :param names: ``list`` of ``str``; names of columns to multiply.
+    :return: ``numpy`` vector or ``pandas`` sparse ``Series``; product.
+    """
+
+    sparse_names = [x for x in names if isinstance(X[x].dtype, pd.SparseDtype)]
+    if not sparse_names:
+        return np.nanprod(X[names].values, axis=1)
+
+    rows = None
+    for x in sparse_names:
+        rows_cur = X[x].array.sp_index.indices
+        rows = rows_cur if rows is None else np.intersect1d(rows, rows_cur, assume_unique=True)
+    vals = []
+    for x in names:
+        if x in sparse_names:
+            arr = X[x].array
+            vals.append(arr.sp_values[np.searchsorted(arr.sp_index.indices, rows)])
+        else:
+            vals.append(np.asarray(X[x], dtype='float64')[rows])
+    vals = np.nanprod(np.stack(vals, axis=1), axis=1)
+    out = scipy.sparse.csc_matrix((vals, (rows, np.zeros_like(rows))), shape=(len(X), 1))
+
+    return pd.DataFrame.sparse.from_spmatrix(out, index=X.index).iloc[:, 0]
+
+
+def apply_op_np(op, arr):
+    """
+    Apply op **op** to ``numpy`` array **arr**. Equivalent to ``Formula.apply_op()``, without modifying **arr**.
+
+    :param op: ``str``; name of op.
+    :param arr: ``numpy`` array; source data.
+    :return: ``numpy`` array; transformed data.
+    """
+
+    arr = np.array(arr, dtype='float64')
+    arr[np.isnan(arr) | (arr == np.inf)] = 0
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        if op in ['c', 'c.']:
+            out = arr - arr.mean()
+        elif op in ['z', 'z.']:
+            out = (arr - arr.mean()) / arr.std(ddof=1)
+        elif op in ['s', 's.']:
+            out = arr / arr.std(ddof=1)
+        elif op == 'log':
+            out = np.log(arr)
+        elif op == 'log1p':
+            out = np.log(arr + 1)
+        elif op == 'exp':
+            out = np.exp(arr)
+        else:
+            raise ValueError('Unrecognized op: "%s".' % op)
+    return out
+
+
+class TransformPlan(object):
+    """
+    Evaluation plan for the ops applied to impulses in one or more CDR formulae (e.g. all models in a config).
+    Op chains are deduplicated across formulae and interactions, and chains with a common prefix (e.g. ``log(x)`` and
+    ``z.(log(x))``) share intermediate results, so each distinct transform of each source column is computed exactly once,
+    on ``numpy`` arrays, in a single pass over each predictor table.
+    Columns computed by the plan are skipped by ``Formula.apply_formula()``, which handles everything else
+    (categorical expansion, spillover, response-aligned predictors, and interaction products).
+
+    :param formula_list: ``list`` of ``Formula``; formulae whose ops to plan.
+    """
+
+    def __init__(self, formula_list):
+        chains = set()
+        for x in formula_list:
+            for impulse in x.t.impulses(include_interactions=True):
+                if type(impulse).__name__ == 'ImpulseInteraction':
+                    atoms = impulse.impulses()
+                else:
+                    atoms = [impulse]
+                for atom in atoms:
+                    if atom.ops:
+                        chains.add((atom.id, tuple(atom.ops)))
+        self.chains = sorted(chains)
+        self.cache = {}
+
+    def apply(self, X):
+        """
+        Add the transformed columns required by the plan to the predictor tables.
+        Each source column is transformed in every table that contains it, so that ``Formula.apply_formula()`` never
+        has to recompute a planned column (e.g. for an interaction whose atoms are all found only in a later table).
+        Results are cached by op signature (table, source column, and op sequence), including intermediate results.
+        Source columns that are missing or categorical are skipped.
+
+        :param X: list of ``pandas`` tables; impulse data.
+        :return: list of ``pandas`` tables; impulse data with transformed columns added.
+        """
+
+        if not isinstance(X, list):
+            X = [X]
+
+        self.cache = {}
+        for i in range(len(X)):
+            _X = X[i]
+            new_cols = {}
+            for source, ops in self.chains:
+                name = Impulse(source, ops=list(ops)).name()
+                if source not in _X or name in _X or Impulse(source).categorical(_X):
+                    continue
+                if (i, source, ()) not in self.cache:
+                    # Formula.apply_op() fills missing and infinite values of the source column in place
+                    vals = _X[source].values
+                    if np.issubdtype(vals.dtype, np.floating):
+                        fill = np.isnan(vals) | (vals == np.inf)
+                        if fill.any():
+                            vals = np.where(fill, 0, vals).astype(vals.dtype)
+                            _X[source] = vals
+                    self.cache[(i, source, ())] = vals
+                for k in range(1, len(ops) + 1):
+                    if (i, source, ops[:k]) not in self.cache:
+                        self.cache[(i, source, ops[:k])] = apply_op_np(ops[k - 1], self.cache[(i, source, ops[:k - 1])])
+                new_cols[name] = self.cache[(i, source, ops)]
+            if new_cols:
+                X[i] = pd.concat([_X, pd.DataFrame(new_cols, index=_X.index)], axis=1)
+
+        return X
+
+
 class ResponseInteraction(object):
     """
     Data structure representing an interaction of response-aligned variables (containing at least one IRF-convolved impulse) in a CDR model.
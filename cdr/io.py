@@ -1,9 +1,123 @@
 import sys
+import os
+import shutil
+import hashlib
+import bisect
+import tempfile
+import atexit
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
+import scipy.sparse
 
 from .util import stderr
 
-def read_tabular_data(X_paths, Y_paths, series_ids, categorical_columns=None, sep=' ', verbose=True):
+def read_table(path, sep=' ', columns=None):
+    """
+    Read a single data table. The format is determined by the file extension: ``.parquet``/``.pq`` (Parquet),
+    ``.feather``/``.arrow`` (Feather), or ``.npz`` (one ``numpy`` vector per column), with any other extension
+    read as delimited text. Parquet and Feather require ``pyarrow``.
+
+    :param path: ``str``; path to data table.
+    :param sep: ``str``; string representation of field delimiter (delimited text only).
+    :param columns: ``set`` of ``str`` or ``None``; names of columns to load. Columns not in the table are ignored. If ``None``, all columns are loaded.
+    :return: ``pandas`` ``DataFrame``; data table.
+    """
+
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ['.parquet', '.pq']:
+        if columns is None:
+            return pd.read_parquet(path)
+        import pyarrow.parquet as pq
+        names = pq.read_schema(path).names
+        return pd.read_parquet(path, columns=[x for x in names if x in columns])
+    if ext in ['.feather', '.arrow']:
+        if columns is None:
+            return pd.read_feather(path)
+        import pyarrow.feather as feather
+        table = feather.read_table(path, memory_map=True)
+        return table.select([x for x in table.column_names if x in columns]).to_pandas()
+    if ext == '.npz':
+        with np.load(path, allow_pickle=True) as data:
+            names = [x for x in data.files if columns is None or x in columns]
+            return pd.DataFrame({x: data[x] for x in names}, columns=names)
+    if columns is None:
+        usecols = None
+    else:
+        usecols = lambda x: x in columns
+    return pd.read_csv(path, sep=sep, skipinitialspace=True, usecols=usecols)
+
+
+def get_source_columns(formula_list, series_ids=None, split_ids=None, filters=None, other=None):
+    """
+    Get the names of all data columns that may be used in preprocessing and modeling, for column projection in
+    ``read_tabular_data()``.
+
+    :param formula_list: ``list`` of ``Formula``; CDR formulae to be run.
+    :param series_ids: ``list`` of ``str`` or ``None``; column names whose jointly unique values define unique time series.
+    :param split_ids: ``list`` of ``str`` or ``None``; column names used to compute data partitions.
+    :param filters: ``list`` or ``None``; list of key-value pairs mapping column names to filtering criteria for their values.
+    :param other: ``list`` of ``str`` or ``None``; names of any other columns to retain.
+    :return: ``set`` of ``str``; column names.
+    """
+
+    from .formula import spillover
+
+    out = {'time', 'trial'}
+    for x in formula_list:
+        impulses = x.responses() + x.t.impulses(include_interactions=True)
+        for impulse in impulses:
+            if type(impulse).__name__ == 'ImpulseInteraction':
+                to_process = impulse.impulses()
+            else:
+                to_process = [impulse]
+            for _impulse in to_process:
+                out.add(_impulse.id)
+                sp = spillover.match(_impulse.id)
+                if sp:
+                    out.add(sp.group(1))
+        out |= set(x.rangf)
+    for ids in (series_ids, split_ids, other):
+        if ids is not None:
+            out |= set(ids)
+    if filters is not None:
+        for k, v in filters:
+            out.add(k)
+            if k.lower().endswith('nunique'):
+                out.add(k[:-7])
+            var = v.strip().lstrip('<>=!').strip()
+            try:
+                float(var)
+            except ValueError:  # Filter values may name other columns
+                out.add(var)
+
+    return out
+
+
+def _finalize_tables(X, Y, series_ids, categorical_columns=None):
+    # Process categorical
+
+    if categorical_columns is not None:
+        for t in categorical_columns:
+            for col in t.split(':'):
+                for _X in X:
+                    if col in _X:
+                        _X[col] = _X[col].astype('category')
+                for _Y in Y:
+                    if col in _Y:
+                        _Y[col] = _Y[col].astype('category')
+
+    # Add columns to X
+
+    for _X in X:
+        assert not 'rate' in _X, '"rate" is a reserved column name in CDR. Rename your input column...'
+        _X['rate'] = 1.
+        if 'trial' not in _X:
+            _X['trial'] = _X.groupby(series_ids).rate.cumsum()
+
+
+def read_tabular_data(X_paths, Y_paths, series_ids, categorical_columns=None, sep=' ', columns=None, n_threads=1, finalize=True, verbose=True):
     """
     Read impulse and response data into pandas dataframes and perform basic pre-processing.
 
@@ -12,6 +126,9 @@ def read_tabular_data(X_paths, Y_paths, series_ids, categorical_columns=None, se
     :param series_ids: ``list`` of ``str``; column names whose jointly unique values define unique time series.
     :param categorical_columns: ``list`` of ``str``; column names that should be treated as categorical.
     :param sep: ``str``; string representation of field delimiter in input data.
+    :param columns: ``set`` of ``str`` or ``None``; names of columns to load (see ``get_source_columns()``). If ``None``, all columns are loaded.
+    :param n_threads: ``int``; number of threads to use for reading and sorting files. Output is identical regardless of the number of threads.
+    :param finalize: ``bool``; whether to convert categorical columns and add the ``rate`` and ``trial`` columns. If ``False``, tables are returned as read (but sorted).
     :param verbose: ``bool``; whether to log progress to stderr.
     :return: 2-tuple of list(``pandas`` DataFrame); (impulse data, response data). X and Y each have one element for each dataset in X_paths/Y_paths, each containing the column-wise concatenation of all column files in the path.
     """
@@ -23,20 +140,15 @@ def read_tabular_data(X_paths, Y_paths, series_ids, categorical_columns=None, se
 
     if verbose:
         stderr('Loading data...\n')
-    X = []
-    Y = []
+    X_paths = [path.split(';') for path in X_paths]
+    Y_paths = [path.split(';') for path in Y_paths]
+    paths = [x for path in X_paths + Y_paths for x in path]
 
-    for path in X_paths:
-        _X = []
-        for x in path.split(';'):
-            _X.append(pd.read_csv(x, sep=sep, skipinitialspace=True))
-        X.append(_X)
-
-    for path in Y_paths:
-        _Y = []
-        for y in path.split(';'):
-            _Y.append(pd.read_csv(y, sep=sep, skipinitialspace=True))
-        Y.append(_Y)
+    # Results of map() are in input order, so output does not depend on the order in which reads complete
+    with ThreadPoolExecutor(max_workers=max(1, min(n_threads, len(paths)))) as pool:
+        tables = pool.map(lambda x: read_table(x, sep=sep, columns=columns), paths)
+        X = [[next(tables) for _ in path] for path in X_paths]
+        Y = [[next(tables) for _ in path] for path in Y_paths]
 
     # Regroup by column
     
@@ -70,29 +182,1109 @@ def read_tabular_data(X_paths, Y_paths, series_ids, categorical_columns=None, se
 
     if verbose:
         stderr('Ensuring sort order...\n')
-    for i, x in enumerate(X):
-        X[i] = x.sort_values(series_ids + ['time']).reset_index(drop=True)
-    for i, y in enumerate(Y):
-        Y[i] = y.sort_values(series_ids + ['time']).reset_index(drop=True)
+    with ThreadPoolExecutor(max_workers=max(1, min(n_threads, len(X) + len(Y)))) as pool:
+        tables = list(pool.map(lambda x: x.sort_values(series_ids + ['time']).reset_index(drop=True), X + Y))
+    X = tables[:len(X)]
+    Y = tables[len(X):]
 
-    # Process categorical
+    if finalize:
+        _finalize_tables(X, Y, series_ids, categorical_columns=categorical_columns)
+
+    return X, Y
+
+
+def get_data_fingerprint(paths):
+    """
+    Get a fingerprint of the files in one or more data paths, for use in cache keys.
+
+    :param paths: ``str`` or ``list`` of ``str``; path(s) to data, as passed to ``read_tabular_data()``. Each path may be a ``;``-delimited list of paths.
+    :return: ``list`` of 3-tuples; (absolute path, size in bytes, modification time) for each file.
+    """
+
+    if not isinstance(paths, list):
+        paths = [paths]
+
+    out = []
+    for path in paths:
+        for x in path.split(';'):
+            stat = os.stat(x)
+            out.append((os.path.realpath(x), stat.st_size, stat.st_mtime_ns))
+
+    return out
+
+
+def get_preprocessing_cache_key(
+        X_paths,
+        Y_paths,
+        formula_list,
+        series_ids,
+        categorical_columns=None,
+        sep=' ',
+        filters=None,
+        history_length=128,
+        future_length=0,
+        all_interactions=False,
+        columns=None,
+        chunk_size=None,
+        sparse_categorical=False,
+        append=None
+):
+    """
+    Compute a key identifying the output of ``read_tabular_data()`` followed by ``preprocess_data()``.
+    The key depends on the path, size, and modification time of every input file, as well as on all settings that
+    affect preprocessing, so changes to either invalidate cached data.
+
+    :param X_paths: ``str`` or ``list`` of ``str``; path(s) to impulse (predictor) data.
+    :param Y_paths: ``str`` or ``list`` of ``str``; path(s) to response data.
+    :param formula_list: ``list`` of ``Formula``; CDR formulae for which to preprocess data.
+    :param series_ids: ``list`` of ``str``; column names whose jointly unique values define unique time series.
+    :param categorical_columns: ``list`` of ``str``; column names that should be treated as categorical.
+    :param sep: ``str``; string representation of field delimiter in input data.
+    :param filters: ``list``; list of key-value pairs mapping column names to filtering criteria for their values. Equivalent conditions (e.g. ``>=3`` and ``>= 3.0``) give the same key.
+    :param history_length: ``int``; maximum number of history (backward) observations.
+    :param future_length: ``int``; maximum number of future (forward) observations.
+    :param all_interactions: ``bool``; add powerset of all conformable interactions.
+    :param columns: ``set`` of ``str`` or ``None``; names of columns to load. If ``None``, all columns are loaded.
+    :param chunk_size: ``int`` or ``None``; chunk size for out-of-core preprocessing, or ``None`` for in-memory preprocessing.
+    :param sparse_categorical: ``bool``; whether 1-hot expansions of categorical impulses are stored as sparse columns.
+    :param append: ``list`` of 2-tuples or ``None``; (X_paths, Y_paths) of data appended to the preprocessed data with ``update_preprocessed_store()``, in order (see ``read_data()``).
+    :return: ``str``; hexadecimal cache key.
+    """
+
+    from .data import CompiledFilters
 
     if categorical_columns is not None:
-        for t in categorical_columns:
-            for col in t.split(':'):
-                for _X in X:
-                    if col in _X:
-                        _X[col] = _X[col].astype('category')
-                for _Y in Y:
-                    if col in _Y:
-                        _Y[col] = _Y[col].astype('category')
+        categorical_columns = sorted(categorical_columns)
+    if columns is not None:
+        columns = sorted(columns)
+    if filters is not None:
+        filters = CompiledFilters(filters).key
 
-    # Add columns to X
+    key = (
+        get_data_fingerprint(X_paths),
+        get_data_fingerprint(Y_paths),
+        [str(x) for x in formula_list],
+        list(series_ids),
+        categorical_columns,
+        sep,
+        filters,
+        history_length,
+        future_length,
+        all_interactions,
+        columns,
+        chunk_size,
+        sparse_categorical
+    )
+    if append:
+        key += ([(get_data_fingerprint(x), get_data_fingerprint(y)) for x, y in append],)
 
-    for _X in X:
-        assert not 'rate' in _X, '"rate" is a reserved column name in CDR. Rename your input column...'
-        _X['rate'] = 1.
-        if 'trial' not in _X:
-            _X['trial'] = _X.groupby(series_ids).rate.cumsum()
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
 
-    return X, Y
+
+def _save_table(df, path):
+    if not os.path.exists(path):
+        os.makedirs(path)
+    columns = []
+    for i, col in enumerate(df.columns):
+        x = df[col]
+        if isinstance(x.dtype, pd.CategoricalDtype):
+            np.save(os.path.join(path, '%d.npy' % i), x.cat.codes.values)
+            columns.append((col, 'category', (x.cat.categories, x.cat.ordered)))
+        elif isinstance(x.dtype, pd.SparseDtype) and x.sparse.fill_value == 0:
+            np.save(os.path.join(path, '%d.npy' % i), x.array.sp_values)
+            columns.append((col, 'sparse', x.array.sp_index.indices))
+        elif x.dtype == object:
+            columns.append((col, 'object', x.values))
+        else:
+            np.save(os.path.join(path, '%d.npy' % i), x.values)
+            columns.append((col, 'array', None))
+    with open(os.path.join(path, 'meta.obj'), 'wb') as f:
+        pickle.dump({'columns': columns, 'index': df.index}, f)
+
+
+def _load_table(path):
+    with open(os.path.join(path, 'meta.obj'), 'rb') as f:
+        meta = pickle.load(f)
+    n = meta.get('n', None)
+    data = {}
+    for i, (col, kind, info) in enumerate(meta['columns']):
+        # Numeric data are copy-on-write memory maps, so downstream in-place edits never touch the stored data
+        if kind == 'object':
+            data[col] = info
+        elif kind == 'raw':
+            data[col] = np.memmap(os.path.join(path, '%d.bin' % i), dtype=info, mode='c', shape=(n,))
+        else:
+            x = np.load(os.path.join(path, '%d.npy' % i), mmap_mode='c')
+            if kind == 'category':
+                categories, ordered = info
+                x = pd.Categorical.from_codes(x, categories=categories, ordered=ordered)
+            elif kind == 'sparse':
+                x = scipy.sparse.csc_matrix(
+                    (np.asarray(x), (info, np.zeros_like(info))),
+                    shape=(len(meta['index']) if meta['index'] is not None else n, 1)
+                )
+                x = pd.arrays.SparseArray.from_spmatrix(x)
+            data[col] = x
+    index = meta['index']
+    if index is None:
+        index = pd.Index(np.memmap(os.path.join(path, 'index.bin'), dtype='int64', mode='c', shape=(n,)))
+
+    # copy=False keeps columns backed by the memory maps instead of consolidating them in memory
+    return pd.DataFrame(data, index=index, columns=[x[0] for x in meta['columns']], copy=False)
+
+
+class _TableWriter(object):
+    """
+    Incrementally write a table in the format read by ``_load_table()``, one chunk of rows at a time.
+    Numeric columns are appended to raw binary files and categorical columns are stored as codes into a set of
+    categories accumulated over all chunks, so the table never needs to be held in memory in full.
+
+    :param path: ``str``; path to output directory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.columns = None
+        self.kinds = None
+        self.categories = None
+        self.objects = None
+        self.n = 0
+
+    def append(self, df, index_offset=0):
+        """
+        Append rows to the table.
+
+        :param df: ``pandas`` ``DataFrame``; rows to append. Must have the same columns as previous chunks.
+        :param index_offset: ``int``; offset to add to the (integer) index of **df**.
+        :return: ``None``
+        """
+
+        if self.columns is None:
+            self.columns = list(df.columns)
+            self.kinds = []
+            self.categories = {}
+            self.objects = {}
+            for col in self.columns:
+                x = df[col]
+                if isinstance(x.dtype, pd.CategoricalDtype):
+                    self.kinds.append('category')
+                    self.categories[col] = {}
+                elif x.dtype == object:
+                    self.kinds.append('object')
+                    self.objects[col] = []
+                else:
+                    self.kinds.append(x.dtype)
+        assert set(df.columns) == set(self.columns), 'Column mismatch between data chunks (%s vs. %s). Streaming preprocessing requires transforms (e.g. categorical expansion) to produce the same columns in every chunk.' % (sorted(df.columns), sorted(self.columns))
+
+        for i, (col, kind) in enumerate(zip(self.columns, self.kinds)):
+            x = df[col]
+            if kind == 'category':
+                cat_map = self.categories[col]
+                lookup = []
+                for c in x.cat.categories:
+                    if c not in cat_map:
+                        cat_map[c] = len(cat_map)
+                    lookup.append(cat_map[c])
+                lookup = np.array(lookup + [-1], dtype='int64')  # Code -1 (missing) maps to -1
+                x = lookup[x.cat.codes.values]
+            elif kind == 'object':
+                self.objects[col].append(x.values)
+                continue
+            else:
+                assert x.dtype != object and not isinstance(x.dtype, pd.CategoricalDtype), 'Type mismatch between data chunks for column "%s" (%s vs. %s).' % (col, x.dtype, kind)
+                dtype = np.result_type(kind, x.dtype)
+                if dtype != kind:  # Type inferred for this chunk is wider (e.g. float vs. int), so promote earlier chunks
+                    path = os.path.join(self.path, '%d.bin' % i)
+                    if os.path.exists(path):
+                        np.fromfile(path, dtype=kind).astype(dtype).tofile(path)
+                    self.kinds[i] = kind = dtype
+                x = np.asarray(x.values, dtype=kind)
+            with open(os.path.join(self.path, '%d.bin' % i), 'ab') as f:
+                x.tofile(f)
+        with open(os.path.join(self.path, 'index.bin'), 'ab') as f:
+            np.asarray(df.index.values + index_offset, dtype='int64').tofile(f)
+
+        self.n += len(df)
+
+    def close(self):
+        """
+        Finalize the table and write its metadata.
+
+        :return: ``None``
+        """
+
+        columns = []
+        for i, (col, kind) in enumerate(zip(self.columns, self.kinds)):
+            if kind == 'category':
+                # Sort categories as in ``astype('category')`` and recode
+                cat_map = self.categories[col]
+                try:
+                    categories = sorted(cat_map)
+                except TypeError:
+                    categories = list(cat_map)
+                recode = np.zeros((len(categories) + 1,), dtype='int64')
+                for j, c in enumerate(categories):
+                    recode[cat_map[c]] = j
+                recode[-1] = -1
+                codes = np.fromfile(os.path.join(self.path, '%d.bin' % i), dtype='int64')
+                np.save(os.path.join(self.path, '%d.npy' % i), recode[codes])
+                os.remove(os.path.join(self.path, '%d.bin' % i))
+                columns.append((col, 'category', (pd.Index(categories), False)))
+            elif kind == 'object':
+                columns.append((col, 'object', np.concatenate(self.objects[col])))
+            else:
+                columns.append((col, 'raw', np.dtype(kind).str))
+        with open(os.path.join(self.path, 'meta.obj'), 'wb') as f:
+            pickle.dump({'columns': columns, 'index': None, 'n': self.n}, f)
+
+
+def save_preprocessing_cache(cache_dir, key, X, Y, select, X_in_Y_names, stats=None, appended=None):
+    """
+    Save the outputs of ``preprocess_data()`` to the preprocessing cache.
+    Numeric and categorical columns are stored as ``numpy`` arrays that can be memory-mapped when loaded.
+    The entry is written to a temporary directory and then moved into place, so interrupted writes never leave
+    partial entries in the cache.
+
+    :param cache_dir: ``str``; path to cache directory.
+    :param key: ``str``; cache key (see ``get_preprocessing_cache_key()``).
+    :param X: list of ``pandas`` tables; preprocessed impulse (predictor) data.
+    :param Y: list of ``pandas`` tables; preprocessed response data.
+    :param select: list of ``numpy`` boolean vectors; filtering masks.
+    :param X_in_Y_names: ``list`` of ``str`` or ``None``; names of predictors contained in **Y** rather than **X**.
+    :param stats: ``dict`` or ``None``; sufficient statistics of data-dependent formula ops (see ``update_preprocessed_store()``). If ``None``, not saved.
+    :param appended: ``list`` or ``None``; fingerprints (see ``get_data_fingerprint()``) of the (X_paths, Y_paths) of each dataset appended with ``update_preprocessed_store()``, in order.
+    :return: ``None``
+    """
+
+    path = os.path.join(cache_dir, key)
+    if os.path.exists(path):
+        return
+    tmp_path = path + '.tmp%d' % os.getpid()
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    for i, _X in enumerate(X):
+        _save_table(_X, os.path.join(tmp_path, 'X_%d' % i))
+    for i, _Y in enumerate(Y):
+        _save_table(_Y, os.path.join(tmp_path, 'Y_%d' % i))
+    for i, _select in enumerate(select):
+        np.save(os.path.join(tmp_path, 'select_%d.npy' % i), np.asarray(_select))
+    with open(os.path.join(tmp_path, 'meta.obj'), 'wb') as f:
+        pickle.dump({'n_X': len(X), 'n_Y': len(Y), 'X_in_Y_names': X_in_Y_names, 'stats': stats, 'appended': appended}, f)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:  # Entry written concurrently by another process
+        shutil.rmtree(tmp_path)
+
+
+def load_preprocessing_cache(cache_dir, key):
+    """
+    Load the outputs of ``preprocess_data()`` from the preprocessing cache.
+
+    :param cache_dir: ``str``; path to cache directory.
+    :param key: ``str``; cache key (see ``get_preprocessing_cache_key()``).
+    :return: 4-tuple or ``None``; predictor data, response data, filtering mask, and names of predictors contained in Y, or ``None`` if **key** is not in the cache.
+    """
+
+    path = os.path.join(cache_dir, key)
+    if not os.path.exists(os.path.join(path, 'meta.obj')):
+        return None
+    with open(os.path.join(path, 'meta.obj'), 'rb') as f:
+        meta = pickle.load(f)
+    X = [_load_table(os.path.join(path, 'X_%d' % i)) for i in range(meta['n_X'])]
+    Y = [_load_table(os.path.join(path, 'Y_%d' % i)) for i in range(meta['n_Y'])]
+    select = [np.load(os.path.join(path, 'select_%d.npy' % i)) for i in range(meta['n_Y'])]
+
+    return X, Y, select, meta['X_in_Y_names']
+
+
+def clear_preprocessing_cache(cache_dir):
+    """
+    Delete all entries in the preprocessing cache.
+
+    :param cache_dir: ``str``; path to cache directory.
+    :return: ``None``
+    """
+
+    if os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir)
+
+
+class _SeriesKeys(object):
+    # Sequence view of the series keys of the rows of a table, for binary search with ``bisect``
+
+    def __init__(self, df, series_ids):
+        self.cols = [df[x].values for x in series_ids]
+        self.n = len(df)
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        return tuple(x[i] for x in self.cols)
+
+
+def read_table_chunks(path, sep=' ', columns=None, chunk_size=100000):
+    """
+    Read a single data table in chunks of rows. Supports the same formats as ``read_table()``.
+    Delimited text and Parquet are read incrementally; other formats are read in full and then split.
+
+    :param path: ``str``; path to data table.
+    :param sep: ``str``; string representation of field delimiter (delimited text only).
+    :param columns: ``set`` of ``str`` or ``None``; names of columns to load. If ``None``, all columns are loaded.
+    :param chunk_size: ``int``; number of rows per chunk.
+    :return: generator of ``pandas`` ``DataFrame``; chunks of the data table.
+    """
+
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ['.parquet', '.pq']:
+        import pyarrow.parquet as pq
+        f = pq.ParquetFile(path)
+        if columns is not None:
+            columns = [x for x in f.schema.names if x in columns]
+        for batch in f.iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pandas()
+    elif ext in ['.feather', '.arrow', '.npz']:
+        df = read_table(path, sep=sep, columns=columns)
+        for i in range(0, len(df), chunk_size):
+            yield df.iloc[i:i + chunk_size]
+    else:
+        if columns is None:
+            usecols = None
+        else:
+            usecols = lambda x: x in columns
+        for chunk in pd.read_csv(path, sep=sep, skipinitialspace=True, usecols=usecols, chunksize=chunk_size):
+            yield chunk
+
+
+def iter_tabular_data_chunks(
+        X_paths,
+        Y_paths,
+        series_ids,
+        categorical_columns=None,
+        sep=' ',
+        columns=None,
+        chunk_size=100000
+):
+    """
+    Read impulse and response data in chunks of complete time series, for out-of-core preprocessing.
+    Files must already be sorted by **series_ids** and time (as they would be by ``read_tabular_data()``).
+    Each chunk contains all rows (from every impulse and response file) of the time series it covers, and because
+    time windows never cross series boundaries, each chunk can be preprocessed independently.
+    Elements of **X_paths** and **Y_paths** are paired and read as separate datasets, which must not share time series.
+
+    :param X_paths: ``str`` or ``list`` of ``str``; path(s) to impulse (predictor) data. Each path may also be a ``;``-delimited list of paths to files containing predictors with different timestamps.
+    :param Y_paths: ``str`` or ``list`` of ``str``; path(s) to response data. Each path may also be a ``;``-delimited list of paths to files containing different response variables with different timestamps.
+    :param series_ids: ``list`` of ``str``; column names whose jointly unique values define unique time series.
+    :param categorical_columns: ``list`` of ``str``; column names that should be treated as categorical.
+    :param sep: ``str``; string representation of field delimiter in input data.
+    :param columns: ``set`` of ``str`` or ``None``; names of columns to load (see ``get_source_columns()``). If ``None``, all columns are loaded.
+    :param chunk_size: ``int``; approximate number of rows per chunk and per file read. Chunks are extended as needed to contain complete time series.
+    :return: generator of 2-tuples of list(``pandas`` DataFrame); (impulse data, response data) for each chunk, in the format returned by ``read_tabular_data()``.
+    """
+
+    if not isinstance(X_paths, list):
+        X_paths = [X_paths]
+    if not isinstance(Y_paths, list):
+        Y_paths = [Y_paths]
+    assert len(X_paths) == len(Y_paths), 'Streaming requires the same number of impulse and response datasets.'
+
+    for X_path, Y_path in zip(X_paths, Y_paths):
+        X_files = X_path.split(';')
+        paths = X_files + Y_path.split(';')
+        readers = [read_table_chunks(x, sep=sep, columns=columns, chunk_size=chunk_size) for x in paths]
+        buffers = [None] * len(paths)
+        done = [False] * len(paths)
+        limiting = [True] * len(paths)
+        out = [[] for _ in paths]
+        n_out = 0
+
+        while True:
+            for i in range(len(paths)):
+                if limiting[i] and not done[i]:
+                    try:
+                        chunk = next(readers[i])
+                        if buffers[i] is None:
+                            buffers[i] = chunk
+                        else:
+                            buffers[i] = pd.concat([buffers[i], chunk], axis=0)
+                    except StopIteration:
+                        done[i] = True
+            if [i for i in range(len(paths)) if not done[i] and (buffers[i] is None or len(buffers[i]) == 0)]:
+                continue
+
+            # Series at or beyond the last buffered row of an unfinished file may be incomplete, so
+            # only series strictly preceding all such rows can be emitted.
+            frontiers = []
+            for i in range(len(paths)):
+                if not done[i] and buffers[i] is not None and len(buffers[i]):
+                    frontiers.append(_SeriesKeys(buffers[i], series_ids)[len(buffers[i]) - 1])
+            if frontiers:
+                bound = min(frontiers)
+            else:
+                bound = None
+
+            for i in range(len(paths)):
+                if buffers[i] is None:
+                    continue
+                if bound is None:
+                    ix = len(buffers[i])
+                else:
+                    ix = bisect.bisect_left(_SeriesKeys(buffers[i], series_ids), bound)
+                out[i].append(buffers[i].iloc[:ix])
+                n_out += ix
+                buffers[i] = buffers[i].iloc[ix:]
+                limiting[i] = len(buffers[i]) == 0 or _SeriesKeys(buffers[i], series_ids)[len(buffers[i]) - 1] == bound
+
+            if n_out and (n_out >= chunk_size or bound is None):
+                tables = [pd.concat(x, axis=0).sort_values(series_ids + ['time']).reset_index(drop=True) for x in out]
+                X = tables[:len(X_files)]
+                Y = tables[len(X_files):]
+                _finalize_tables(X, Y, series_ids, categorical_columns=categorical_columns)
+                yield X, Y
+                out = [[] for _ in paths]
+                n_out = 0
+
+            if bound is None:
+                break
+
+
+def _check_streaming_formulae(formula_list):
+    # Ops that depend on statistics of the full data cannot be computed chunk by chunk
+    for x in formula_list:
+        impulses = x.responses() + x.t.impulses(include_interactions=True)
+        for impulse in impulses:
+            if type(impulse).__name__ == 'ImpulseInteraction':
+                to_process = impulse.impulses()
+            else:
+                to_process = [impulse]
+            for _impulse in to_process:
+                for op in _impulse.ops:
+                    if op in ['c', 'c.', 'z', 'z.', 's', 's.']:
+                        raise ValueError('Op "%s" in term %s depends on statistics of the full dataset and is not supported in streaming mode. Apply it to the data as a preprocess.' % (op, _impulse.name()))
+
+
+def preprocess_data_streaming(
+        X_paths,
+        Y_paths,
+        formula_list,
+        series_ids,
+        store_dir,
+        categorical_columns=None,
+        sep=' ',
+        filters=None,
+        history_length=128,
+        future_length=0,
+        all_interactions=False,
+        columns=None,
+        chunk_size=100000,
+        verbose=True
+):
+    """
+    Read and preprocess CDR data out of core.
+    Input files (which must already be sorted by series and time) are read in chunks of complete time series (see
+    ``iter_tabular_data_chunks()``). Each chunk is preprocessed with ``preprocess_data()`` and appended to an on-disk
+    store in **store_dir**, with window indices offset to point into the full tables. The store is then loaded
+    as memory-mapped tables, so the full data never need to be held in memory at once.
+    During fitting and prediction with on-the-fly inputs (``optimize_memory``, see ``Model.plan_memory()``), impulse
+    windows are gathered per minibatch straight from the memory-mapped predictor tables (see ``ImpulseWindows``).
+    Response arrays (one row per response, without time windows) are still built in memory.
+    Each response table gets a ``chunk`` column containing the index of the chunk it was read in, which
+    ``Model.fit()`` uses to keep minibatch reads local to one chunk at a time.
+
+    Filters are applied per chunk, so count-based (``nunique``) filters are only exact for columns among the
+    **series_ids**. Ops that require statistics of the full data (``c``, ``z``, ``s``) are not supported.
+
+    :param X_paths: ``str`` or ``list`` of ``str``; path(s) to impulse (predictor) data.
+    :param Y_paths: ``str`` or ``list`` of ``str``; path(s) to response data.
+    :param formula_list: ``list`` of ``Formula``; CDR formulae for which to preprocess data.
+    :param series_ids: ``list`` of ``str``; column names whose jointly unique values define unique time series.
+    :param store_dir: ``str``; path to output directory.
+    :param categorical_columns: ``list`` of ``str``; column names that should be treated as categorical.
+    :param sep: ``str``; string representation of field delimiter in input data.
+    :param filters: ``list``; list of key-value pairs mapping column names to filtering criteria for their values.
+    :param history_length: ``int``; maximum number of history (backward) observations.
+    :param future_length: ``int``; maximum number of future (forward) observations.
+    :param all_interactions: ``bool``; add powerset of all conformable interactions.
+    :param columns: ``set`` of ``str`` or ``None``; names of columns to load (see ``get_source_columns()``). If ``None``, all columns are loaded.
+    :param chunk_size: ``int``; approximate number of rows per chunk.
+    :param verbose: ``bool``; whether to log progress to stderr.
+    :return: 4-tuple; predictor data, response data, filtering mask, and names of predictors contained in Y (see ``preprocess_data()``).
+    """
+
+    from .data import preprocess_data, CompiledFilters
+
+    _check_streaming_formulae(formula_list)
+
+    if filters is not None:
+        filters = CompiledFilters(filters)
+
+    tmp_dir = store_dir + '.tmp%d' % os.getpid()
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+
+    X_writers = None
+    Y_writers = None
+    select_files = None
+    X_offsets = None
+    Y_offsets = None
+    X_in_Y_names = None
+
+    for i, (X, Y) in enumerate(iter_tabular_data_chunks(
+            X_paths,
+            Y_paths,
+            series_ids,
+            categorical_columns=categorical_columns,
+            sep=sep,
+            columns=columns,
+            chunk_size=chunk_size
+    )):
+        if verbose:
+            stderr('\rPre-processing data chunk %d...' % (i + 1))
+        if X_writers is None:
+            X_writers = [_TableWriter(os.path.join(tmp_dir, 'X_%d' % j)) for j in range(len(X))]
+            Y_writers = [_TableWriter(os.path.join(tmp_dir, 'Y_%d' % j)) for j in range(len(Y))]
+            select_files = [os.path.join(tmp_dir, 'select_%d.bin' % j) for j in range(len(Y))]
+            X_offsets = [0] * len(X)
+            Y_offsets = [0] * len(Y)
+        n_Y = [len(_Y) for _Y in Y]
+        X, Y, select, X_in_Y_names = preprocess_data(
+            X,
+            Y,
+            formula_list,
+            series_ids,
+            filters=filters,
+            history_length=history_length,
+            future_length=future_length,
+            all_interactions=all_interactions,
+            verbose=False
+        )
+        for j, _Y in enumerate(Y):
+            for k in range(len(X)):
+                if 'first_obs_%d' % k in _Y:
+                    _Y['first_obs_%d' % k] += X_offsets[k]
+                    _Y['last_obs_%d' % k] += X_offsets[k]
+            _Y['chunk'] = i
+            Y_writers[j].append(_Y, index_offset=Y_offsets[j])
+            with open(select_files[j], 'ab') as f:
+                np.asarray(select[j], dtype=bool).tofile(f)
+            Y_offsets[j] += n_Y[j]
+        for k, _X in enumerate(X):
+            X_writers[k].append(_X, index_offset=X_offsets[k])
+            X_offsets[k] += len(_X)
+
+    assert X_writers is not None, 'No data found.'
+    if verbose:
+        stderr('\n')
+
+    for writer in X_writers + Y_writers:
+        writer.close()
+    for j, path in enumerate(select_files):
+        np.save(os.path.join(tmp_dir, 'select_%d.npy' % j), np.fromfile(path, dtype=bool))
+        os.remove(path)
+    with open(os.path.join(tmp_dir, 'meta.obj'), 'wb') as f:
+        pickle.dump({'n_X': len(X_writers), 'n_Y': len(Y_writers), 'X_in_Y_names': X_in_Y_names}, f)
+    if os.path.exists(store_dir):
+        shutil.rmtree(store_dir)
+    os.rename(tmp_dir, store_dir)
+
+    store_dir, key = os.path.split(os.path.normpath(store_dir))
+
+    return load_preprocessing_cache(store_dir, key)
+
+
+def _get_stats_op_specs(formula_list, X, Y, all_interactions=False):
+    # Locate each term whose values depend on statistics of the data (c, z, and s ops), in the same table(s) in
+    # which Formula.apply_formula() computes it. Returns a dict from statistics key to (formula, term, table type,
+    # table index).
+    specs = {}
+    X_columns = set([c for _X in X for c in _X.columns])
+    for x in formula_list:
+        terms = [(dv, True) for dv in x.responses()] + [(impulse, False) for impulse in x.t.impulses(include_interactions=True)]
+        for term, is_response in terms:
+            if type(term).__name__ == 'ImpulseInteraction':
+                for _term in term.impulses() + [term]:
+                    for op in _term.ops:
+                        if op in ['c', 'c.', 'z', 'z.', 's', 's.']:
+                            raise ValueError('Op "%s" in interaction %s is not supported for incremental preprocessing. Apply it to the data as a preprocess.' % (op, term.name()))
+                continue
+            stats_ops = [op for op in term.ops if op in ['c', 'c.', 'z', 'z.', 's', 's.']]
+            if not stats_ops:
+                continue
+            if all_interactions:
+                raise ValueError('Op "%s" in term %s is not supported for incremental preprocessing with all_interactions. Apply it to the data as a preprocess.' % (stats_ops[0], term.name()))
+            if len(stats_ops) > 1 or term.ops[-1] != stats_ops[0]:
+                raise ValueError('Op "%s" in term %s must be the last op applied to the term for incremental preprocessing.' % (stats_ops[0], term.name()))
+            if is_response:
+                locations = [('Y', [i for i, _Y in enumerate(Y) if term.id in _Y][0])]
+            elif term.id in X_columns:
+                locations = [('X', [i for i, _X in enumerate(X) if term.id in _X][0])]
+            elif all(term.id in _Y for _Y in Y):
+                locations = [('Y', i) for i in range(len(Y))]
+            else:
+                raise ValueError('Op "%s" in term %s is not supported for incremental preprocessing because the term is not a column of the data. Apply it to the data as a preprocess.' % (stats_ops[0], term.name()))
+            for kind, i in locations:
+                df = X[i] if kind == 'X' else Y[i]
+                if term.categorical(df):
+                    raise ValueError('Op "%s" in categorical term %s is not supported for incremental preprocessing.' % (stats_ops[0], term.name()))
+                specs['%s_%d/%s' % (kind, i, term.name())] = (x, term, kind, i)
+
+    return specs
+
+
+def _get_stats_op_input(formula, term, df):
+    # Values of a term immediately before its final (statistics-dependent) op, as seen by Formula.apply_op()
+    arr = df[term.id].copy()
+    for op in term.ops[:-1]:
+        arr = formula.apply_op(op, arr)
+    arr = pd.Series(np.asarray(arr, dtype='float64'))
+    arr.fillna(0, inplace=True)
+    arr[arr == np.inf] = 0
+
+    return arr.values
+
+
+def _get_stats(x):
+    # Sufficient statistics (count, mean, sum of squared deviations) of the non-missing values of x
+    x = x[~np.isnan(x)]
+    if len(x) == 0:
+        return 0, 0., 0.
+    mean = x.mean()
+
+    return len(x), mean, ((x - mean) ** 2).sum()
+
+
+def _merge_stats(a, b, remove=False):
+    # Pairwise update of sufficient statistics (Chan et al.). If remove is True, the contribution of b is removed from a.
+    n_a, mean_a, m2_a = a
+    n_b, mean_b, m2_b = b
+    if remove:
+        n = n_a - n_b
+        if n <= 0:
+            return 0, 0., 0.
+        mean = (n_a * mean_a - n_b * mean_b) / n
+        m2 = m2_a - m2_b - (mean_b - mean) ** 2 * n * n_b / n_a
+    else:
+        n = n_a + n_b
+        if n == 0:
+            return 0, 0., 0.
+        mean = mean_a + (mean_b - mean_a) * n_b / n
+        m2 = m2_a + m2_b + (mean_b - mean_a) ** 2 * n_a * n_b / n
+
+    return n, mean, max(m2, 0.)
+
+
+def _apply_stats_op(op, x, stats):
+    # Equivalent to the c, z, and s functions in data.py, using precomputed statistics
+    n, mean, m2 = stats
+    sd = np.sqrt(m2 / (n - 1)) if n > 1 else np.nan
+    if op in ['c', 'c.']:
+        return x - mean
+    if op in ['z', 'z.']:
+        return (x - mean) / sd
+    return x / sd
+
+
+def _in_series(df, series_ids, keys):
+    # Boolean mask over the rows of df belonging to any of the series in keys
+    return pd.MultiIndex.from_frame(df[series_ids]).isin(keys)
+
+
+def _combine_block(old, new, series_ids):
+    # Stored rows of the series that receive new data, followed by the new rows, stably sorted by series and time.
+    # Only source columns are kept; derived columns are recomputed.
+    columns = list(new.columns)
+    if 'trial' in old and 'trial' not in columns:
+        old = old.drop(columns=['trial'])
+    missing = [c for c in columns if c not in old]
+    if missing:
+        raise ValueError('Columns %s of the new data are not in the preprocessed store.' % missing)
+    old = old[columns].copy()
+    for col in columns:
+        if isinstance(old[col].dtype, pd.CategoricalDtype):
+            old[col] = old[col].astype(object)
+    block = pd.concat([old, new], axis=0, ignore_index=True)
+    block = block.sort_values(series_ids + ['time'], kind='mergesort')
+    is_new = block.index.values >= len(old)
+
+    return block.reset_index(drop=True), is_new
+
+
+def _concat_tables(tables):
+    # Row-wise concatenation that preserves categorical columns with different categories
+    out = pd.concat(tables, axis=0, ignore_index=True)
+    for col in out.columns:
+        if not isinstance(out[col].dtype, pd.CategoricalDtype) and \
+                all(isinstance(t[col].dtype, pd.CategoricalDtype) for t in tables):
+            out[col] = pd.api.types.union_categoricals([t[col] for t in tables], ignore_order=True)
+
+    return out
+
+
+def update_preprocessed_store(
+        store_dir,
+        X_paths,
+        Y_paths,
+        formula_list,
+        series_ids,
+        categorical_columns=None,
+        sep=' ',
+        filters=None,
+        history_length=128,
+        future_length=0,
+        all_interactions=False,
+        columns=None,
+        n_threads=1,
+        n_workers=1,
+        sparse_categorical=False,
+        out_dir=None,
+        verbose=True
+):
+    """
+    Add new data to an existing store of preprocessed data (a preprocessing cache entry written by ``read_data()``
+    or a store written by ``preprocess_data_streaming()``) without preprocessing the full dataset again.
+    Only the time series that occur in the new data are re-sorted and re-windowed, together with any rows already stored
+    for them. Rows of all other series are kept as stored, with window indices shifted to their new positions.
+    Updated series are moved to the end of each table.
+
+    Ops that depend on statistics of the full data (``c``, ``z``, ``s``) are updated using sufficient statistics
+    (count, mean, and sum of squared deviations) saved in the store, so the data are never rescanned to recompute them.
+    Statistics are computed once from the stored data if the store does not yet contain them.
+    Such ops must be the last op applied to a term and cannot be used in interactions.
+
+    The preprocessing settings must match those used to create the store. Filters are applied to the updated series only.
+    The filtering mask of each response file is extended with the mask over the new response rows.
+    Fingerprints of the appended files are recorded in the store metadata. Since cache keys depend on the input files,
+    updated cache entries should be written to a new key with **out_dir** (as done by ``read_data()`` with **append**)
+    rather than in place.
+
+    :param store_dir: ``str``; path to the store directory.
+    :param X_paths: ``str`` or ``list`` of ``str``; path(s) to new impulse (predictor) data, with the same column files as the store.
+    :param Y_paths: ``str`` or ``list`` of ``str``; path(s) to new response data, with the same column files as the store.
+    :param formula_list: ``list`` of ``Formula``; CDR formulae for which to preprocess data.
+    :param series_ids: ``list`` of ``str``; column names whose jointly unique values define unique time series.
+    :param categorical_columns: ``list`` of ``str``; column names that should be treated as categorical.
+    :param sep: ``str``; string representation of field delimiter in input data.
+    :param filters: ``list``; list of key-value pairs mapping column names to filtering criteria for their values.
+    :param history_length: ``int``; maximum number of history (backward) observations.
+    :param future_length: ``int``; maximum number of future (forward) observations.
+    :param all_interactions: ``bool``; add powerset of all conformable interactions.
+    :param columns: ``set`` of ``str`` or ``None``; names of columns to load (see ``get_source_columns()``). If ``None``, all columns are loaded.
+    :param n_threads: ``int``; number of threads to use for reading and sorting files.
+    :param n_workers: ``int``; number of worker processes to use for computing time windows. Worker processes pay off only for large data with several predictor/response file pairs, so the default is to compute windows serially.
+    :param sparse_categorical: ``bool``; whether to store 1-hot expansions of categorical impulses as sparse columns.
+    :param out_dir: ``str`` or ``None``; path to which to write the updated store. If ``None``, **store_dir** is updated in place.
+    :param verbose: ``bool``; whether to log progress to stderr.
+    :return: 4-tuple; predictor data, response data, filtering mask, and names of predictors contained in Y (see ``preprocess_data()``).
+    """
+
+    from .data import preprocess_data
+
+    store_dir = os.path.normpath(store_dir)
+    parent, key = os.path.split(store_dir)
+    out = load_preprocessing_cache(parent, key)
+    assert out is not None, 'No preprocessed data found in %s.' % store_dir
+    X_old, Y_old, select_old, X_in_Y_names = out
+    with open(os.path.join(store_dir, 'meta.obj'), 'rb') as f:
+        meta = pickle.load(f)
+    stats = meta.get('stats')
+    if stats is None:
+        stats = {}
+    appended = (meta.get('appended') or []) + [(get_data_fingerprint(X_paths), get_data_fingerprint(Y_paths))]
+
+    specs = _get_stats_op_specs(formula_list, X_old, Y_old, all_interactions=all_interactions)
+    for k in specs:
+        if k not in stats:
+            formula, term, kind, i = specs[k]
+            df = X_old[i] if kind == 'X' else Y_old[i]
+            stats[k] = _get_stats(_get_stats_op_input(formula, term, df))
+
+    X_new, Y_new = read_tabular_data(
+        X_paths,
+        Y_paths,
+        series_ids,
+        sep=sep,
+        columns=columns,
+        n_threads=n_threads,
+        finalize=False,
+        verbose=verbose
+    )
+    assert len(X_new) == len(X_old) and len(Y_new) == len(Y_old), 'New data must have the same predictor and response files as the preprocessed store.'
+
+    keys = pd.MultiIndex.from_frame(pd.concat([df[series_ids] for df in X_new + Y_new])).unique()
+    if verbose:
+        stderr('Updating %d time series...\n' % len(keys))
+
+    X_affected = [_in_series(_X, series_ids, keys) for _X in X_old]
+    Y_affected = [_in_series(_Y, series_ids, keys) for _Y in Y_old]
+    X_block = [_combine_block(_X[affected], _X_new, series_ids)[0] for _X, _X_new, affected in zip(X_old, X_new, X_affected)]
+    Y_block = []
+    Y_is_new = []
+    for _Y, _Y_new, affected in zip(Y_old, Y_new, Y_affected):
+        _Y_block, is_new = _combine_block(_Y[affected], _Y_new, series_ids)
+        Y_block.append(_Y_block)
+        Y_is_new.append(is_new)
+    _finalize_tables(X_block, Y_block, series_ids, categorical_columns=categorical_columns)
+
+    X_block, Y_block, select_block, _ = preprocess_data(
+        X_block,
+        Y_block,
+        formula_list,
+        series_ids,
+        filters=filters,
+        history_length=history_length,
+        future_length=future_length,
+        all_interactions=all_interactions,
+        n_workers=n_workers,
+        sparse_categorical=sparse_categorical,
+        verbose=verbose
+    )
+
+    # Replace the contribution of the stored rows of the updated series to the op statistics with that of the new block
+    for k in specs:
+        formula, term, kind, i = specs[k]
+        if kind == 'X':
+            df_old, df_block = X_old[i][X_affected[i]], X_block[i]
+        else:
+            df_old, df_block = Y_old[i][Y_affected[i]], Y_block[i]
+        stats[k] = _merge_stats(stats[k], _get_stats(_get_stats_op_input(formula, term, df_old)), remove=True)
+        stats[k] = _merge_stats(stats[k], _get_stats(_get_stats_op_input(formula, term, df_block)))
+
+    X = []
+    X_offsets = []
+    X_positions = []
+    for _X_old, affected, _X_block in zip(X_old, X_affected, X_block):
+        missing = [c for c in _X_old.columns if c not in _X_block]
+        if missing:
+            raise ValueError('Columns %s of the preprocessed store were not recomputed for the new data. Check that the preprocessing settings match those used to create the store.' % missing)
+        keep = ~affected
+        X.append(_concat_tables([_X_old[keep], _X_block[list(_X_old.columns)]]))
+        X_offsets.append(int(keep.sum()))
+        # Position of each stored row among the kept rows, for shifting window indices
+        X_positions.append(np.concatenate([[0], np.cumsum(keep)]))
+
+    Y = []
+    select = []
+    for j, (_Y_old, affected, _Y_block) in enumerate(zip(Y_old, Y_affected, Y_block)):
+        _Y_old = _Y_old[~affected].copy()
+        if 'chunk' in _Y_old:
+            _Y_block['chunk'] = _Y_old['chunk'].max() + 1 if len(_Y_old) else 0
+        missing = [c for c in _Y_old.columns if c not in _Y_block]
+        if missing:
+            raise ValueError('Columns %s of the preprocessed store were not recomputed for the new data. Check that the preprocessing settings match those used to create the store.' % missing)
+        _Y_block = _Y_block[list(_Y_old.columns)].copy()
+        for k in range(len(X)):
+            if 'first_obs_%d' % k in _Y_old:
+                for col in ['first_obs_%d' % k, 'last_obs_%d' % k]:
+                    _Y_old[col] = X_positions[k][_Y_old[col].values]
+                    _Y_block[col] += X_offsets[k]
+        Y.append(_concat_tables([_Y_old, _Y_block]))
+        select.append(np.concatenate([select_old[j], select_block[j][Y_is_new[j]]]))
+
+    for k in specs:
+        formula, term, kind, i = specs[k]
+        df = X[i] if kind == 'X' else Y[i]
+        df[term.name()] = _apply_stats_op(term.ops[-1], _get_stats_op_input(formula, term, df), stats[k])
+
+    if out_dir is not None:
+        parent, key = os.path.split(os.path.normpath(out_dir))
+        if verbose:
+            stderr('Saving updated store (%s)...\n' % out_dir)
+        save_preprocessing_cache(parent, key, X, Y, select, X_in_Y_names, stats=stats, appended=appended)
+    else:
+        if verbose:
+            stderr('Saving updated store (%s)...\n' % store_dir)
+        tmp_key = key + '.update%d' % os.getpid()
+        if os.path.exists(os.path.join(parent, tmp_key)):
+            shutil.rmtree(os.path.join(parent, tmp_key))
+        save_preprocessing_cache(parent, tmp_key, X, Y, select, X_in_Y_names, stats=stats, appended=appended)
+        old_dir = store_dir + '.old%d' % os.getpid()
+        os.rename(store_dir, old_dir)
+        os.rename(os.path.join(parent, tmp_key), store_dir)
+        shutil.rmtree(old_dir)
+
+    return load_preprocessing_cache(parent, key)
+
+
+def read_data(
+        X_paths,
+        Y_paths,
+        formula_list,
+        series_ids,
+        categorical_columns=None,
+        sep=' ',
+        filters=None,
+        history_length=128,
+        future_length=0,
+        all_interactions=False,
+        columns=None,
+        n_threads=1,
+        n_workers=1,
+        chunk_size=None,
+        cache_dir=None,
+        sparse_categorical=False,
+        append=None,
+        verbose=True
+):
+    """
+    Read and preprocess CDR data, i.e. ``read_tabular_data()`` followed by ``preprocess_data()``.
+    If **cache_dir** is provided, results are cached on disk and subsequent calls with the same input files and
+    preprocessing settings load them from the cache instead of recomputing.
+    If **append** is provided, the preprocessed data for **X_paths**/**Y_paths** (with all but the last appended dataset)
+    are loaded or computed and cached, and the last appended dataset is added to them with ``update_preprocessed_store()``,
+    so only the series it contains are reprocessed. The result is cached under a key that includes the appended files.
+
+    :param X_paths: ``str`` or ``list`` of ``str``; path(s) to impulse (predictor) data.
+    :param Y_paths: ``str`` or ``list`` of ``str``; path(s) to response data.
+    :param formula_list: ``list`` of ``Formula``; CDR formulae for which to preprocess data.
+    :param series_ids: ``list`` of ``str``; column names whose jointly unique values define unique time series.
+    :param categorical_columns: ``list`` of ``str``; column names that should be treated as categorical.
+    :param sep: ``str``; string representation of field delimiter in input data.
+    :param filters: ``list``; list of key-value pairs mapping column names to filtering criteria for their values.
+    :param history_length: ``int``; maximum number of history (backward) observations.
+    :param future_length: ``int``; maximum number of future (forward) observations.
+    :param all_interactions: ``bool``; add powerset of all conformable interactions.
+    :param columns: ``set`` of ``str`` or ``None``; names of columns to load (see ``get_source_columns()``). If ``None``, all columns are loaded.
+    :param n_threads: ``int``; number of threads to use for reading and sorting files.
+    :param n_workers: ``int``; number of worker processes to use for computing time windows. Worker processes pay off only for large data with several predictor/response file pairs, so the default is to compute windows serially.
+    :param chunk_size: ``int`` or ``None``; if provided, read and preprocess data out of core in chunks of approximately **chunk_size** rows (see ``preprocess_data_streaming()``). Input files must already be sorted by series and time. If **cache_dir** is ``None``, the resulting store is written to a temporary directory that is deleted at exit.
+    :param cache_dir: ``str`` or ``None``; path to preprocessing cache directory. If ``None``, no caching.
+    :param sparse_categorical: ``bool``; whether to store 1-hot expansions of categorical impulses as sparse columns (in-memory preprocessing only).
+    :param append: ``list`` of 2-tuples or ``None``; (X_paths, Y_paths) of new data to append, in order, to the data in **X_paths**/**Y_paths**. Each must have the same column files as **X_paths**/**Y_paths**. Requires **cache_dir**.
+    :param verbose: ``bool``; whether to log progress to stderr.
+    :return: 4-tuple; predictor data, response data, filtering mask, and names of predictors contained in Y (see ``preprocess_data()``).
+    """
+
+    from .data import preprocess_data
+
+    if append:
+        assert cache_dir is not None, 'Appending data requires a preprocessing cache directory.'
+
+    key = None
+    if cache_dir is not None:
+        key = get_preprocessing_cache_key(
+            X_paths,
+            Y_paths,
+            formula_list,
+            series_ids,
+            categorical_columns=categorical_columns,
+            sep=sep,
+            filters=filters,
+            history_length=history_length,
+            future_length=future_length,
+            all_interactions=all_interactions,
+            columns=columns,
+            chunk_size=chunk_size,
+            sparse_categorical=sparse_categorical,
+            append=append
+        )
+        out = load_preprocessing_cache(cache_dir, key)
+        if out is not None:
+            if verbose:
+                stderr('Loading preprocessed data from cache (%s)...\n' % os.path.join(cache_dir, key))
+            return out
+
+    if append:
+        kwargs = dict(
+            categorical_columns=categorical_columns,
+            sep=sep,
+            filters=filters,
+            history_length=history_length,
+            future_length=future_length,
+            all_interactions=all_interactions,
+            columns=columns
+        )
+        # Ensure that the data before the last append are in the cache, then write the update to a new entry
+        read_data(
+            X_paths,
+            Y_paths,
+            formula_list,
+            series_ids,
+            n_threads=n_threads,
+            n_workers=n_workers,
+            chunk_size=chunk_size,
+            cache_dir=cache_dir,
+            sparse_categorical=sparse_categorical,
+            append=append[:-1],
+            verbose=verbose,
+            **kwargs
+        )
+        base_key = get_preprocessing_cache_key(
+            X_paths,
+            Y_paths,
+            formula_list,
+            series_ids,
+            chunk_size=chunk_size,
+            sparse_categorical=sparse_categorical,
+            append=append[:-1],
+            **kwargs
+        )
+        return update_preprocessed_store(
+            os.path.join(cache_dir, base_key),
+            append[-1][0],
+            append[-1][1],
+            formula_list,
+            series_ids,
+            n_threads=n_threads,
+            n_workers=n_workers,
+            sparse_categorical=sparse_categorical,
+            out_dir=os.path.join(cache_dir, key),
+            verbose=verbose,
+            **kwargs
+        )
+
+    if chunk_size:
+        if cache_dir is None:
+            store_dir = tempfile.mkdtemp()
+            atexit.register(shutil.rmtree, store_dir, True)
+            store_dir = os.path.join(store_dir, 'data')
+        else:
+            store_dir = os.path.join(cache_dir, key)
+        return preprocess_data_streaming(
+            X_paths,
+            Y_paths,
+            formula_list,
+            series_ids,
+            store_dir,
+            categorical_columns=categorical_columns,
+            sep=sep,
+            filters=filters,
+            history_length=history_length,
+            future_length=future_length,
+            all_interactions=all_interactions,
+            columns=columns,
+            chunk_size=chunk_size,
+            verbose=verbose
+        )
+
+    X, Y = read_tabular_data(
+        X_paths,
+        Y_paths,
+        series_ids,
+        categorical_columns=categorical_columns,
+        sep=sep,
+        columns=columns,
+        n_threads=n_threads,
+        verbose=verbose
+    )
+    X, Y, select, X_in_Y_names = preprocess_data(
+        X,
+        Y,
+        formula_list,
+        series_ids,
+        filters=filters,
+        history_length=history_length,
+        future_length=future_length,
+        all_interactions=all_interactions,
+        n_workers=n_workers,
+        sparse_categorical=sparse_categorical,
+        verbose=verbose
+    )
+
+    if cache_dir is not None:
+        if verbose:
+            stderr('Saving preprocessed data to cache (%s)...\n' % os.path.join(cache_dir, key))
+        save_preprocessing_cache(cache_dir, key, X, Y, select, X_in_Y_names)
+
+    return X, Y, select, X_in_Y_names
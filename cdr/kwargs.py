@@ -371,6 +371,48 @@ MODEL_INITIALIZATION_KWARGS = [
         int,
         "Size of minibatches to use for prediction/evaluation."
     ),
+    Kwarg(
+        'prefetch_depth',
+        2,
+        int,
+        "Number of minibatches to construct ahead on a background thread while the current minibatch runs, when expanded impulse arrays are computed on the fly (**optimize_memory**). If ``0``, minibatches are constructed inline."
+    ),
+    Kwarg(
+        'steps_per_run',
+        1,
+        int,
+        "Number of training minibatches to run per call into the TensorFlow runtime when training inputs are drawn from the ``tf.data`` input pipeline (``use_dataset``). Steps are run through a compiled session callable without constructing feed dicts between them, which reduces per-step overhead for small models. Each step still performs its own parameter, EMA, loss filter, and step counter updates, so results do not depend on this setting. Ignored for ``feed_dict`` input."
+    ),
+    Kwarg(
+        'trim_history',
+        False,
+        bool,
+        "Trim the time dimension of each minibatch to its longest actual impulse window rather than padding to **history_length** + **future_length**, so that the cost of convolution, recurrence, and interpolation scales with the real history. Has no effect on model outputs."
+    ),
+    Kwarg(
+        'bucket_pool_size',
+        None,
+        [int, None],
+        "If not ``None``, sort responses by impulse window length within pools of this many randomly drawn training minibatches before splitting them into minibatches, so that minibatches group windows of similar length. Most useful in combination with **trim_history**. If ``None``, no bucketing."
+    ),
+    Kwarg(
+        'storage_float_type',
+        None,
+        [str, None],
+        "``float`` type in which to store expanded impulse arrays for training and evaluation, independently of **float_type**. Impulses are stored in this type and cast to **float_type** in-graph, and impulse timestamps are stored as ``float32`` offsets from their response times. E.g. ``float16`` roughly halves the memory held by expanded impulses, at the cost of rounding impulse values to about 3 significant digits. If ``None``, impulses are stored in **float_type**."
+    ),
+    Kwarg(
+        'deduplicate_windows',
+        False,
+        bool,
+        "Store and convolve the impulse window of responses that share their window, response time, and random effects levels once, and gather the model outputs back to each response before computing predictions and likelihoods. Useful when multiple response files (e.g. one per fMRI region or per measure) are sampled at the same times within each series. Minibatch statistics (e.g. batch normalization) and dropout masks are computed over the distinct windows of each minibatch."
+    ),
+    Kwarg(
+        'memory_budget',
+        None,
+        [float, None],
+        "Memory budget in GB for expanded impulse arrays and model activations. If not ``None``, the footprint of each call to ``fit()``, ``predict()``, etc. is estimated before building inputs, expanded impulse arrays are computed on the fly (as with **optimize_memory**) if materializing them would exceed the budget, and the evaluation minibatch size is capped to fit the budget. If ``None``, the estimate is logged but not enforced."
+    ),
     Kwarg(
         'n_samples_eval',
         1000,
@@ -550,6 +592,18 @@ MODEL_INITIALIZATION_KWARGS = [
         "Frequency (in iterations) with which to save model checkpoints.",
         default_value_cdrnn=10
     ),
+    Kwarg(
+        'async_save',
+        False,
+        bool,
+        "Write model checkpoints on a background thread. Variables are snapshotted in memory (doubling their memory footprint) and training continues while the snapshot is written to disk. Pending writes are flushed at the end of training and at exit."
+    ),
+    Kwarg(
+        'checkpoint_keep',
+        1,
+        int,
+        "Number of most recent model checkpoints to retain. The latest is always saved as ``model.ckpt``; older ones are kept as ``model_1.ckpt``, ``model_2.ckpt``, etc."
+    ),
     Kwarg(
         'log_freq',
         100,
@@ -4,6 +4,10 @@ import os
 import re
 import math
 import pickle
+import atexit
+import weakref
+import collections
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from scipy import linalg
 
@@ -135,6 +139,172 @@ def get_random_permutation(n):
     return p, p_inv
 
 
+def prefetch(fn, args, depth=2):
+    """
+    Apply **fn** to each element of **args**, computing up to **depth** results ahead on a background thread.
+    Results are yielded in order. Used to overlap construction of minibatch inputs with model execution.
+
+    :param fn: callable; function to apply.
+    :param args: iterable; arguments to **fn**.
+    :param depth: ``int``; maximum number of results to compute ahead. If ``0``, results are computed inline.
+    :return: generator; results of **fn**.
+    """
+
+    if not depth:
+        for x in args:
+            yield fn(x)
+        return
+
+    args = iter(args)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        queue = collections.deque()
+        for x in args:
+            queue.append(pool.submit(fn, x))
+            if len(queue) > depth:
+                yield queue.popleft().result()
+        while queue:
+            yield queue.popleft().result()
+
+
+_background_writers = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_background_writers():
+    for writer in list(_background_writers):
+        writer.flush()
+
+
+class BackgroundWriter(object):
+    """
+    Run write jobs one at a time on a background thread.
+    At most one job is pending at any time: submitting a new job first waits for the previous one to finish.
+    Pending jobs of live writers are flushed at interpreter exit, and exceptions raised by a job are re-raised on the next call to ``submit()`` or ``flush()``.
+    """
+
+    def __init__(self):
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+        _background_writers.add(self)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Wait for any pending job, then start **fn** on the background thread.
+
+        :param fn: callable; job to run.
+        :param args: positional arguments to **fn**.
+        :param kwargs: keyword arguments to **fn**.
+        :return: ``None``
+        """
+
+        self.flush()
+        self.pending = self.pool.submit(fn, *args, **kwargs)
+
+    def flush(self):
+        """
+        Block until the pending job (if any) has finished.
+
+        :return: ``None``
+        """
+
+        pending, self.pending = self.pending, None
+        if pending is not None:
+            pending.result()
+
+    def close(self):
+        """
+        Flush any pending job and shut down the background thread.
+
+        :return: ``None``
+        """
+
+        _background_writers.discard(self)
+        try:
+            self.flush()
+        finally:
+            self.pool.shutdown()
+
+
+def get_rss():
+    """
+    Get the resident set size of the current process.
+
+    :return: pair of ``int`` or ``None``; current and peak resident set size in bytes, or ``None`` if unavailable on this platform.
+    """
+
+    cur = peak = None
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            cur = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != 'darwin':  # Linux reports kilobytes, macOS bytes
+            peak *= 1024
+    except (ImportError, OSError):
+        pass
+
+    return cur, peak
+
+
+def get_chunked_random_permutation(chunk_ix):
+    """
+    Draw a random permutation that keeps elements of the same chunk contiguous.
+    Chunks are visited in random order and elements are shuffled within each chunk, which keeps reads local when
+    the shuffled data are stored out of core in chunks.
+    Returns a permutation and its inverse as in ``get_random_permutation()``.
+
+    :param chunk_ix: ``numpy`` vector; chunk index of each element
+    :return: 2-tuple of ``numpy`` arrays; the permutation and its inverse
+    """
+
+    chunk_ix = np.asarray(chunk_ix)
+    n = len(chunk_ix)
+    chunks, chunk_ix = np.unique(chunk_ix, return_inverse=True)
+    chunk_order = np.random.permutation(len(chunks))
+    # Sort by (shuffled chunk position, random key)
+    p = np.lexsort((np.random.random(n), chunk_order[chunk_ix]))
+    p_inv = np.zeros_like(p)
+    p_inv[p] = np.arange(n)
+    return p, p_inv
+
+
+def get_bucketed_random_permutation(lengths, minibatch_size, pool_size, p=None):
+    """
+    Reorder a random permutation so that elements of similar length fall into the same minibatch.
+    The permutation is split into pools of **pool_size** minibatches, each pool is sorted by length and cut into
+    minibatches, and the order of the full minibatches is shuffled within the pool.
+    Any final partial minibatch stays at the end, so minibatch boundaries are unchanged.
+    Returns a permutation and its inverse as in ``get_random_permutation()``.
+
+    :param lengths: ``numpy`` vector; length of each element
+    :param minibatch_size: ``int``; minibatch size
+    :param pool_size: ``int``; number of minibatches per pool
+    :param p: ``numpy`` vector or ``None``; permutation to reorder. If ``None``, a new random permutation is drawn.
+    :return: 2-tuple of ``numpy`` arrays; the permutation and its inverse
+    """
+
+    lengths = np.asarray(lengths)
+    n = len(lengths)
+    if p is None:
+        p = np.random.permutation(n)
+    p = np.array(p)
+    pool = minibatch_size * pool_size
+    for i in range(0, n, pool):
+        p_cur = p[i:i + pool]
+        p_cur = p_cur[np.argsort(lengths[p_cur], kind='stable')]
+        n_full = len(p_cur) // minibatch_size
+        order = np.random.permutation(n_full)
+        batches = p_cur[:n_full * minibatch_size].reshape(n_full, minibatch_size)[order]
+        p[i:i + n_full * minibatch_size] = batches.reshape(-1)
+        p[i + n_full * minibatch_size:i + len(p_cur)] = p_cur[n_full * minibatch_size:]
+    p_inv = np.zeros_like(p)
+    p_inv[p] = np.arange(n)
+    return p, p_inv
+
+
 def sn(string):
     """
     Compute a Tensorboard-compatible version of a string.
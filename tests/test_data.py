@@ -0,0 +1,239 @@
+import re
+import numpy as np
+import pandas as pd
+import pytest
+
+from cdr.data import ImpulseWindows, PaddedColumns, CompiledFilters, compute_filters, compute_filter, get_time_windows, \
+    _get_time_windows_obsolete, _get_time_windows_pair
+from cdr.io import _save_table, _load_table
+
+
+def _make_series_data(rng, n_subjects=3, n_docs=2, m=30, n=12):
+    # Random multi-series data sorted by series and time. Some response times coincide with impulse times, and some
+    # fall before the first or after the last impulse of their series.
+    X = []
+    Y = []
+    for subject in range(n_subjects):
+        for doc in range(n_docs):
+            _m = int(rng.integers(1, m))
+            x_time = np.sort(rng.choice(np.arange(100), size=_m, replace=False) + rng.random(_m))
+            X.append(pd.DataFrame({
+                'subject': subject,
+                'docid': 'd%d' % doc,
+                'time': x_time,
+                'a': rng.normal(size=_m),
+                'b': rng.normal(size=_m)
+            }))
+            y_time = np.concatenate([
+                rng.uniform(-5, 105, n),
+                rng.choice(x_time, size=min(3, _m), replace=False)
+            ])
+            y_time = np.sort(y_time)
+            Y.append(pd.DataFrame({
+                'subject': subject,
+                'docid': 'd%d' % doc,
+                'time': y_time,
+                'y': rng.normal(size=len(y_time))
+            }))
+    X = pd.concat(X, ignore_index=True)
+    Y = pd.concat(Y, ignore_index=True)
+
+    return X, Y
+
+
+def _expand_windows(X, columns, first_obs, last_obs, window_length):
+    # Reference expansion, one response at a time: the last window_length impulses of the window, right-aligned
+    B = len(first_obs)
+    values = np.zeros((B, window_length, len(columns)))
+    times = np.zeros((B, window_length))
+    mask = np.zeros((B, window_length))
+    for i in range(B):
+        rows = X.iloc[max(first_obs[i], last_obs[i] - window_length):last_obs[i]]
+        k = len(rows)
+        if k:
+            values[i, -k:] = rows[columns].values
+            times[i, -k:] = rows.time.values
+            mask[i, -k:] = 1
+
+    return values, times, mask
+
+
+@pytest.mark.parametrize('forward', [False, True])
+@pytest.mark.parametrize('window_length', [4, np.inf])
+def test_get_time_windows_matches_obsolete(forward, window_length):
+    rng = np.random.default_rng(0)
+    series_ids = ['subject', 'docid']
+    for _ in range(5):
+        X, Y = _make_series_data(rng)
+        # The obsolete implementation looks up the row after the end of each window, which fails for windows
+        # ending at the last row of X. A trailing row from a series without responses leaves all windows unchanged.
+        X = pd.concat([X, X.iloc[-1:].assign(subject=-1)], ignore_index=True)
+        first_obs, last_obs = get_time_windows(
+            X,
+            Y,
+            series_ids,
+            forward=forward,
+            window_length=window_length,
+            verbose=False
+        )
+        first_obs_ref, last_obs_ref = _get_time_windows_obsolete(
+            X,
+            Y,
+            series_ids,
+            forward=forward,
+            window_length=window_length,
+            verbose=False
+        )
+        assert np.array_equal(first_obs, first_obs_ref)
+        assert np.array_equal(last_obs, last_obs_ref)
+
+
+@pytest.mark.parametrize('forward', [False, True])
+def test_get_time_windows_unsorted_responses(forward):
+    rng = np.random.default_rng(1)
+    series_ids = ['subject', 'docid']
+    X, Y = _make_series_data(rng)
+    first_obs, last_obs = get_time_windows(X, Y, series_ids, forward=forward, window_length=4, verbose=False)
+    perm = rng.permutation(len(Y))
+    _first_obs, _last_obs = get_time_windows(
+        X,
+        Y.iloc[perm].reset_index(drop=True),
+        series_ids,
+        forward=forward,
+        window_length=4,
+        verbose=False
+    )
+    assert np.array_equal(_first_obs, first_obs[perm])
+    assert np.array_equal(_last_obs, last_obs[perm])
+
+
+def test_get_time_windows_series_without_impulses():
+    rng = np.random.default_rng(2)
+    X, Y = _make_series_data(rng)
+    Y_missing = Y[Y.subject == 0].copy()
+    Y_missing['subject'] = -1
+    Y = pd.concat([Y, Y_missing], ignore_index=True)
+    for forward in [False, True]:
+        first_obs, last_obs = get_time_windows(X, Y, ['subject', 'docid'], forward=forward, window_length=4, verbose=False)
+        missing = (Y.subject == -1).values
+        assert (last_obs[missing] == first_obs[missing]).all()
+        assert (last_obs[~missing] >= first_obs[~missing]).all()
+
+
+def test_impulse_windows_gather(tmp_path):
+    rng = np.random.default_rng(3)
+    series_ids = ['subject', 'docid']
+    history_length = 6
+    future_length = 3
+    T = history_length + future_length
+    X1, Y = _make_series_data(rng)
+    X2, _ = _make_series_data(rng)
+    X2 = X2.rename(columns={'a': 'c', 'b': 'd'})
+    X = [X1, X2]
+    first_obs = []
+    last_obs = []
+    for _X in X:
+        _first_obs, _last_obs, _, _ = _get_time_windows_pair(_X, Y, series_ids, history_length, future_length)
+        first_obs.append(_first_obs)
+        last_obs.append(_last_obs)
+
+    impulse_names = ['d', 'a', 'c', 'b']
+    _save_table(X1[['time', 'a', 'b']], str(tmp_path / 'X1'))
+    _save_table(X2[['time', 'c', 'd']], str(tmp_path / 'X2'))
+    X_memmap = [_load_table(str(tmp_path / 'X1')), _load_table(str(tmp_path / 'X2'))]
+    kwargs = dict(impulse_names=impulse_names, history_length=history_length, future_length=future_length)
+    windows = ImpulseWindows(X, first_obs, last_obs, **kwargs)
+    windows_memmap = ImpulseWindows(X_memmap, first_obs, last_obs, **kwargs)
+    assert all(isinstance(x, PaddedColumns) for x in windows_memmap.values)
+
+    for ix in [None, rng.permutation(len(Y))[:20], slice(5, 17)]:
+        sel = np.arange(len(Y))[ix if ix is not None else slice(None)]
+        values_ref = np.zeros((len(sel), T, len(impulse_names)))
+        times_ref = np.zeros((len(sel), T, len(impulse_names)))
+        mask_ref = np.zeros((len(sel), T, len(impulse_names)))
+        for _X, columns, _first_obs, _last_obs in zip(X, [['a', 'b'], ['c', 'd']], first_obs, last_obs):
+            values, times, mask = _expand_windows(_X, columns, _first_obs[sel], _last_obs[sel], T)
+            impulse_ix = [impulse_names.index(x) for x in columns]
+            values_ref[..., impulse_ix] = values
+            times_ref[..., impulse_ix] = times[..., None]
+            mask_ref[..., impulse_ix] = mask[..., None]
+        for w in [windows, windows_memmap]:
+            values, times, mask = w.get(ix)
+            assert np.allclose(values, values_ref.astype('float32'))
+            assert np.allclose(times, times_ref.astype('float32'))
+            assert np.array_equal(mask, mask_ref)
+
+
+def _eval_filters(Y, filters):
+    # Reference implementation: evaluate each condition as a Python expression over the columns
+    select = np.ones(len(Y), dtype=bool)
+    for field, cond in filters:
+        op, var = re.match(r'(<=|>=|==|!=|<|>)\s*(.*)$', cond.strip()).groups()
+        if field.endswith('nunique'):
+            name = field[:-7]
+            vals, counts = np.unique(Y[name][select], return_counts=True)
+            Y[field] = Y[name].map(dict(zip(vals, counts)))
+        if var in Y:
+            expr = 'Y[field] %s Y[var]' % op
+        elif var == 'inf':
+            expr = 'Y[field] %s np.inf' % op
+        else:
+            try:
+                expr = 'Y[field] %s %r' % (op, float(var))
+            except ValueError:
+                expr = 'Y[field] %s %r' % (op, var)
+        select &= np.asarray(Y[field].notna() & eval(expr, {'Y': Y, 'np': np, 'field': field, 'var': var}), dtype=bool)
+
+    return select
+
+
+def _make_filter_data(rng, n=200):
+    Y = pd.DataFrame({
+        'x': rng.integers(0, 10, n).astype(float),
+        'z': rng.integers(0, 10, n).astype(float),
+        'word': rng.choice(['a', 'b', 'c'], n).astype(object),
+        'subject': rng.choice(['s1', 's2', 's3', 's4'], n)
+    })
+    Y.loc[rng.random(n) < 0.1, 'x'] = np.nan
+    Y.loc[rng.random(n) < 0.1, 'z'] = np.nan
+    Y.loc[rng.random(n) < 0.1, 'word'] = np.nan
+
+    return Y
+
+
+@pytest.mark.parametrize('op', ['<', '<=', '>', '>=', '==', '!='])
+def test_compiled_filters_operators(op):
+    rng = np.random.default_rng(4)
+    Y = _make_filter_data(rng)
+    for field, var in [('x', '5'), ('x', ' 5.0'), ('x', '-1'), ('x', 'inf'), ('x', 'z'), ('z', '0')]:
+        filters = [(field, '%s%s' % (op, var))]
+        ref = _eval_filters(Y.copy(), filters)
+        assert np.array_equal(compute_filters(Y.copy(), filters), ref), filters
+        assert np.array_equal(compute_filter(Y.copy(), field, '%s%s' % (op, var)), ref), filters
+    if op in ['==', '!=']:
+        filters = [('word', '%s b' % op)]
+        assert np.array_equal(compute_filters(Y.copy(), filters), _eval_filters(Y.copy(), filters))
+
+
+def test_compiled_filters_combined():
+    rng = np.random.default_rng(5)
+    filters = [
+        ('x', '>= 2'),
+        ('z', '< 8'),
+        ('word', '!= c'),
+        ('x', '!= z'),
+        ('subjectnunique', '> 12'),
+        ('missing', '> 0')
+    ]
+    compiled = CompiledFilters(filters)
+    assert list(compiled) == filters
+    # The same compiled filters are reused across tables
+    for _ in range(3):
+        Y = _make_filter_data(rng)
+        ref = _eval_filters(Y.copy(), [f for f in filters if f[0] != 'missing'])
+        assert 0 < ref.sum() < len(Y)
+        assert np.array_equal(compiled.compute(Y.copy()), ref)
+        assert np.array_equal(compute_filters(Y.copy(), filters), ref)
+
+    assert CompiledFilters([('x', '>=3')]).key == CompiledFilters([('x', '>= 3.0')]).key
+    assert CompiledFilters([('x', '>=3')]).key != CompiledFilters([('x', '<=3')]).key
@@ -0,0 +1,251 @@
+import os
+import numpy as np
+import pandas as pd
+
+from cdr.data import ImpulseWindows, is_memmap
+from cdr.formula import Formula
+from cdr.io import read_data, get_preprocessing_cache_key, load_preprocessing_cache, clear_preprocessing_cache, \
+    _save_table, _load_table, _TableWriter, _get_stats, _merge_stats
+
+
+def _make_data(subjects, t0, n, rng):
+    X = pd.DataFrame({
+        'subject': np.repeat(subjects, n),
+        'time': np.tile(t0 + np.arange(n, dtype=float), len(subjects))
+    })
+    X['a'] = rng.random(len(X))
+    X['b'] = rng.random(len(X))
+    X['cond'] = rng.choice(['p', 'q', 'r'], size=len(X))
+    Y = X[['subject', 'time']].iloc[::3].copy()
+    Y['time'] += 0.5
+    Y['y'] = rng.random(len(Y))
+
+    return X, Y
+
+
+def _write_data(tmp_path, new_subjects=(1, 3)):
+    rng = np.random.default_rng(0)
+    X0, Y0 = _make_data([0, 1, 2], 0, 40, rng)
+    X1, Y1 = _make_data(list(new_subjects), 40, 20, rng)
+    paths = {}
+    for name, df in [('X0', X0), ('Y0', Y0), ('X1', X1), ('Y1', Y1),
+                     ('Xall', pd.concat([X0, X1])), ('Yall', pd.concat([Y0, Y1]))]:
+        paths[name] = str(tmp_path / ('%s.csv' % name))
+        df.to_csv(paths[name], sep=' ', index=False)
+
+    return paths
+
+
+def _by_series(X, Y, columns):
+    # Rows and window boundaries keyed by (subject, time), independent of the order of the series in the tables
+    X = X[0]
+    Y = Y[0]
+    keys = list(zip(X['subject'], X['time']))
+    Xs = X.sort_values(['subject', 'time']).reset_index(drop=True)
+    Xs = pd.DataFrame({c: np.asarray(Xs[c], dtype=float) for c in columns})
+    Y = Y.copy()
+    Y['first'] = [keys[i] if i < len(keys) else None for i in Y['first_obs_0']]
+    Y['last'] = [keys[i - 1] for i in Y['last_obs_0']]
+    Y = Y.sort_values(['subject', 'time']).reset_index(drop=True)
+
+    return Xs, Y
+
+
+def test_merge_stats():
+    rng = np.random.default_rng(1)
+    x = rng.normal(3., 2., 1000)
+    x[rng.random(1000) < 0.1] = np.nan
+    a, b, c = x[:400], x[400:700], x[700:]
+
+    stats = _merge_stats(_merge_stats(_get_stats(a), _get_stats(b)), _get_stats(c))
+    ref = _get_stats(x)
+    assert stats[0] == ref[0]
+    assert np.allclose(stats[1:], ref[1:])
+
+    x_ = x[~np.isnan(x)]
+    assert np.isclose(stats[1], x_.mean())
+    assert np.isclose(stats[2] / (stats[0] - 1), x_.var(ddof=1))
+
+    stats = _merge_stats(stats, _get_stats(b), remove=True)
+    ref = _get_stats(np.concatenate([a, c]))
+    assert stats[0] == ref[0]
+    assert np.allclose(stats[1:], ref[1:])
+
+    assert _merge_stats(_get_stats(a), _get_stats(a), remove=True) == (0, 0., 0.)
+    assert _merge_stats(_get_stats(a[:0]), _get_stats(b)) == _get_stats(b)
+
+
+def test_append_matches_full_preprocessing(tmp_path):
+    paths = _write_data(tmp_path)
+    f = [Formula('y ~ C(a + z.(b), Normal())')]
+    kwargs = dict(categorical_columns=['subject'], history_length=8, verbose=False)
+    ref = read_data(paths['Xall'], paths['Yall'], f, ['subject'], **kwargs)
+    out = read_data(
+        paths['X0'],
+        paths['Y0'],
+        f,
+        ['subject'],
+        cache_dir=str(tmp_path / 'cache'),
+        append=[(paths['X1'], paths['Y1'])],
+        **kwargs
+    )
+
+    columns = ['a', 'b', 'z(b)']
+    X_ref, Y_ref = _by_series(ref[0], ref[1], columns)
+    X_out, Y_out = _by_series(out[0], out[1], columns)
+    for c in columns:
+        assert np.allclose(X_ref[c], X_out[c]), c
+    assert list(Y_ref['first']) == list(Y_out['first'])
+    assert list(Y_ref['last']) == list(Y_out['last'])
+
+
+def test_append_sparse_categorical(tmp_path):
+    # All stored series receive new data, so the updated tables consist of recomputed rows only
+    paths = _write_data(tmp_path, new_subjects=(0, 1, 2))
+    f = [Formula('y ~ C(a + cond, Normal())')]
+    kwargs = dict(categorical_columns=['subject', 'cond'], history_length=8, sparse_categorical=True, verbose=False)
+    ref = read_data(paths['Xall'], paths['Yall'], f, ['subject'], **kwargs)
+    out = read_data(
+        paths['X0'],
+        paths['Y0'],
+        f,
+        ['subject'],
+        cache_dir=str(tmp_path / 'cache'),
+        append=[(paths['X1'], paths['Y1'])],
+        **kwargs
+    )
+
+    expanded = [c for c in ref[0][0].columns if c.startswith('cond') and c != 'cond']
+    assert expanded
+    assert sorted(expanded) == sorted(c for c in out[0][0].columns if c.startswith('cond') and c != 'cond')
+    for c in expanded:
+        assert isinstance(ref[0][0][c].dtype, pd.SparseDtype), c
+        assert isinstance(out[0][0][c].dtype, pd.SparseDtype), c
+
+    X_ref, Y_ref = _by_series(ref[0], ref[1], ['a'] + expanded)
+    X_out, Y_out = _by_series(out[0], out[1], ['a'] + expanded)
+    for c in ['a'] + expanded:
+        assert np.allclose(X_ref[c], X_out[c]), c
+    assert list(Y_ref['first']) == list(Y_out['first'])
+    assert list(Y_ref['last']) == list(Y_out['last'])
+
+
+def _read_files(path):
+    out = {}
+    for root, _, files in os.walk(path):
+        for name in files:
+            with open(os.path.join(root, name), 'rb') as f:
+                out[os.path.join(root, name)] = f.read()
+
+    return out
+
+
+def test_table_round_trip(tmp_path):
+    rng = np.random.default_rng(2)
+    n = 50
+    df = pd.DataFrame({
+        'time': np.sort(rng.random(n)),
+        'a': rng.normal(size=n),
+        'i': rng.integers(0, 5, n),
+        'word': rng.choice(['x', 'y', 'z'], n).astype(object),
+        'subject': pd.Categorical(rng.choice(['s1', 's2', None], n)),
+        'cond': pd.arrays.SparseArray(np.where(rng.random(n) < 0.2, 1., 0.), fill_value=0.)
+    }, index=np.arange(n) + 10)
+    _save_table(df, str(tmp_path / 'table'))
+    out = _load_table(str(tmp_path / 'table'))
+    pd.testing.assert_frame_equal(out, df)
+    assert is_memmap(out['a'].values)
+
+    chunks = [df.iloc[:20], df.iloc[20:35], df.iloc[35:]]
+    # Integer values in an early chunk are promoted when a later chunk is float
+    chunks[0] = chunks[0].assign(i=chunks[0]['i'].astype('int64'))
+    chunks[2] = chunks[2].assign(i=chunks[2]['i'].astype('float64'))
+    writer = _TableWriter(str(tmp_path / 'chunks'))
+    for chunk in chunks:
+        # Categories differ between chunks
+        chunk = chunk.drop(columns=['cond']).assign(subject=chunk['subject'].astype(object).astype('category'))
+        writer.append(chunk.reset_index(drop=True), index_offset=chunk.index[0])
+    writer.close()
+    out = _load_table(str(tmp_path / 'chunks'))
+    expected = df.drop(columns=['cond']).assign(i=df['i'].astype('float64'))
+    expected['subject'] = expected['subject'].cat.remove_unused_categories()
+    pd.testing.assert_frame_equal(out, expected, check_index_type=False)
+
+
+def test_cache_hit_matches_cold_run(tmp_path):
+    paths = _write_data(tmp_path)
+    f = [Formula('y ~ C(a + z.(b), Normal())')]
+    kwargs = dict(categorical_columns=['subject'], history_length=8, filters=[('y', '> 0.1')], verbose=False)
+    cache = str(tmp_path / 'cache')
+    ref = read_data(paths['Xall'], paths['Yall'], f, ['subject'], **kwargs)
+    cold = read_data(paths['Xall'], paths['Yall'], f, ['subject'], cache_dir=cache, **kwargs)
+    hit = read_data(paths['Xall'], paths['Yall'], f, ['subject'], cache_dir=cache, **kwargs)
+    assert len(os.listdir(cache)) == 1
+    assert is_memmap(hit[0][0]['a'].values)
+
+    for out in [cold, hit]:
+        for df_ref, df in zip(ref[0] + ref[1], out[0] + out[1]):
+            pd.testing.assert_frame_equal(df, df_ref, check_index_type=False)
+        for select_ref, select in zip(ref[2], out[2]):
+            assert np.array_equal(select, select_ref)
+        assert out[3] == ref[3]
+
+    windows = []
+    for X, Y, _, _ in [ref, hit]:
+        w = ImpulseWindows(X, [Y[0]['first_obs_0']], [Y[0]['last_obs_0']], impulse_names=['a', 'z(b)'], history_length=8)
+        windows.append(w.get())
+    for x_ref, x in zip(*windows):
+        assert np.array_equal(x, x_ref)
+
+
+def test_cache_key(tmp_path):
+    paths = _write_data(tmp_path)
+    f = [Formula('y ~ C(a + z.(b), Normal())')]
+    kwargs = dict(categorical_columns=['subject'], history_length=8, filters=[('y', '>= 0.1')])
+    key = get_preprocessing_cache_key(paths['X0'], paths['Y0'], f, ['subject'], **kwargs)
+    assert key == get_preprocessing_cache_key(paths['X0'], paths['Y0'], f, ['subject'], **kwargs)
+    assert key == get_preprocessing_cache_key(
+        paths['X0'],
+        paths['Y0'],
+        [Formula('y ~ C(a + z.(b), Normal())')],
+        ['subject'],
+        categorical_columns=['subject'],
+        history_length=8,
+        filters=[('y', '>=0.10')]
+    )
+
+    assert key != get_preprocessing_cache_key(paths['X0'], paths['Y0'], [Formula('y ~ C(a + b, Normal())')], ['subject'], **kwargs)
+    assert key != get_preprocessing_cache_key(paths['X0'], paths['Y0'], f, ['subject'], **dict(kwargs, history_length=16))
+    assert key != get_preprocessing_cache_key(paths['X0'], paths['Y0'], f, ['subject'], **dict(kwargs, filters=[('y', '> 0.1')]))
+    assert key != get_preprocessing_cache_key(paths['X1'], paths['Y0'], f, ['subject'], **kwargs)
+
+    X0 = pd.read_csv(paths['X0'], sep=' ')
+    X0.loc[0, 'a'] += 1
+    X0.to_csv(paths['X0'], sep=' ', index=False)
+    assert key != get_preprocessing_cache_key(paths['X0'], paths['Y0'], f, ['subject'], **kwargs)
+
+
+def test_cache_is_read_only(tmp_path):
+    paths = _write_data(tmp_path)
+    f = [Formula('y ~ C(a + z.(b), Normal())')]
+    kwargs = dict(categorical_columns=['subject'], history_length=8, verbose=False)
+    cache = str(tmp_path / 'cache')
+    ref = read_data(paths['Xall'], paths['Yall'], f, ['subject'], cache_dir=cache, **kwargs)
+    a_ref = np.array(ref[0][0]['a'])
+    files = _read_files(cache)
+
+    # In-place edits of the loaded data never reach the files of the cache entry
+    X, Y, select, _ = read_data(paths['Xall'], paths['Yall'], f, ['subject'], cache_dir=cache, **kwargs)
+    X[0]['a'].values[:] = 0.
+    X[0]['z(b)'].values[:] = 0.
+    Y[0]['first_obs_0'].values[:] = 0
+    select[0][:] = False
+    assert (X[0]['a'] == 0).all()
+    assert _read_files(cache) == files
+
+    X, _, _, _ = read_data(paths['Xall'], paths['Yall'], f, ['subject'], cache_dir=cache, **kwargs)
+    assert np.array_equal(X[0]['a'], a_ref)
+
+    key = os.listdir(cache)[0]
+    clear_preprocessing_cache(cache)
+    assert load_preprocessing_cache(cache, key) is None